@@ -3,29 +3,55 @@
 FAX注文書画像をアップロードして、店舗ごとの出荷ラベルPDFを生成
 """
 import streamlit as st
-import google.generativeai as genai
+from streamlit.errors import StreamlitAPIException
 from PIL import Image
 import pandas as pd
-from pdf_generator import LabelPDFGenerator
-import tempfile
-import os
-import json
+from pdf_generator import (
+    LabelPDFGenerator, LABEL_LAYOUTS, PDF_CACHE, make_pdf_cache_key, parse_page_ranges, make_label_filter,
+    configured_render_workers, configured_parallel_min_labels
+)
+import io
 from datetime import datetime, timedelta
-from collections import defaultdict
-import re
 import traceback
 
 # 設定管理モジュールのインポート
 from config_manager import (
-    load_stores, save_stores, add_store, remove_store,
-    load_items, save_items, add_item_variant, add_new_item, remove_item,
-    auto_learn_store, auto_learn_item,
-    load_units, lookup_unit, add_unit_if_new, set_unit, initialize_default_units,
-    load_item_settings, save_item_settings, get_item_setting, set_item_setting, set_item_receive_as_boxes, remove_item_setting,
-    DEFAULT_ITEM_SETTINGS, get_box_count_items
+    load_stores, add_store, remove_store,
+    load_items, add_item_variant, add_new_item, remove_item,
+    set_units,
+    load_item_settings, save_item_settings, get_item_setting, set_item_setting, remove_item_setting,
+    master_version, on_master_change, run_migrations
+)
+from email_config_manager import (
+    load_email_config, save_email_config, detect_imap_server,
+    load_email_profiles, save_email_profiles, normalize_profile
+)
+from email_reader import iter_profile_attachments, dedupe_attachments, make_thumbnail, THUMBNAIL_SIZE
+from email_watcher import load_prefetched_orders, load_prefetched_image_bytes, remove_prefetched_order
+from label_records import LabelLine, LabelList
+from order_totals import OrderTotals, aggregate_orders
+import order_parser
+from order_parser import (
+    safe_int, normalize_item_name, validate_store_name, get_unit_label_for_item
 )
-from email_config_manager import load_email_config, save_email_config, detect_imap_server
-from email_reader import check_email_for_orders
+
+# メール取得結果をセッション内で再利用する時間（分）
+EMAIL_CACHE_TTL_MINUTES = 10
+
+# PDFを描画するプロセス数（既定は1。benchmarks/bench_parallel_pdf.py の計測では並列描画が速くならないため、
+# 速くなる環境でだけ環境変数 LABEL_PDF_WORKERS / LABEL_PDF_PARALLEL_MIN_LABELS で有効にする）
+PDF_RENDER_WORKERS = configured_render_workers()
+
+# 設定管理タブの品目一覧で1ページに表示する品目数
+SETTINGS_ITEMS_PER_PAGE = 20
+
+# 解析結果の編集表で1ページに表示する行数
+EDITOR_ROWS_PER_PAGE = 50
+
+# 解析結果の編集表の列と型
+EDITOR_COLUMNS = ['店舗名', '品目', '規格', '入数(unit)', '箱数(boxes)', '端数(remainder)', '合計数量']
+EDITOR_DTYPES = {'店舗名': object, '品目': object, '規格': object, '入数(unit)': 'int64',
+                 '箱数(boxes)': 'int64', '端数(remainder)': 'int64', '合計数量': 'int64'}
 
 # ページ設定
 st.set_page_config(
@@ -64,283 +90,90 @@ if 'email_config' not in st.session_state:
     st.session_state.email_config = load_email_config(secrets_obj)
 if 'email_password' not in st.session_state:
     st.session_state.email_password = ""
-
-# デフォルト入数の初期化（初回起動時のみ）
-if 'default_units_initialized' not in st.session_state:
-    initialize_default_units()
-    # 品目設定のデフォルト値も初期化
-    item_settings = load_item_settings()
-    # 長ねぎ・長ねぎバラが確実に50本に設定されているか確認
-    for key in ["長ネギ", "長ねぎバラ", "長ネギバラ"]:
-        if key in item_settings:
-            if item_settings[key].get("default_unit") != 50 or item_settings[key].get("unit_type") != "本":
-                set_item_setting(key, 50, "本")
-    if not item_settings:
-        # デフォルト設定を保存
-        save_item_settings(DEFAULT_ITEM_SETTINGS)
-    st.session_state.default_units_initialized = True
-
-
-def safe_int(v):
-    """安全に整数に変換"""
-    if v is None:
-        return 0
-    if isinstance(v, int):
-        return v
-    s = re.sub(r'\D', '', str(v))
-    return int(s) if s else 0
-
-
-def get_known_stores():
-    """店舗名リストを取得（動的）"""
-    return load_stores()
-
-
-def get_item_normalization():
-    """品目名正規化マップを取得（動的）"""
-    return load_items()
-
-
-def normalize_item_name(item_name, auto_learn=True):
-    """品目名を正規化する（動的設定対応）"""
-    if not item_name:
-        return ""
-    item_name = str(item_name).strip()
-    item_normalization = get_item_normalization()
-    
-    for normalized, variants in item_normalization.items():
-        if item_name in variants or any(variant in item_name for variant in variants):
-            return normalized
-    
-    # 見つからない場合、自動学習
-    if auto_learn:
-        return auto_learn_item(item_name)
-    return item_name
+if 'email_profiles' not in st.session_state:
+    # 追加のメールボックス設定（複数アカウント・送信者フィルタ）
+    try:
+        secrets_obj = st.secrets if hasattr(st, 'secrets') else None
+    except Exception:
+        secrets_obj = None
+    st.session_state.email_profiles = load_email_profiles(secrets_obj)
+if 'email_passwords' not in st.session_state:
+    # 追加のメールボックスのパスワード（メールアドレス → パスワード、このセッション中のみ）
+    st.session_state.email_passwords = {}
+if 'email_results' not in st.session_state:
+    # メール取得結果のキャッシュ（{'key', 'fetched_at', 'groups'}）
+    st.session_state.email_results = None
+if 'parsed_by_hash' not in st.session_state:
+    # 解析済み画像の内容ハッシュ → AI解析結果（同じFAXの再送でGeminiを呼ばないため）
+    st.session_state.parsed_by_hash = {}
+if 'editor_df' not in st.session_state:
+    # 解析結果の編集用の表（editor_source の解析結果から作ったもの、再実行のたびに作り直さない）
+    st.session_state.editor_df = None
+    st.session_state.editor_source = None
+    st.session_state.editor_version = 0  # 表を更新するたびに増やす（データエディタのキー）
+if 'pdf_result' not in st.session_state:
+    # 生成済みPDF（{'key', 'pdf_bytes', 'summary_data', 'line_text'}、再実行後もダウンロードできるよう保持）
+    st.session_state.pdf_result = None
+if 'reprint_result' not in st.session_state:
+    # 生成済みの再印刷用PDF（{'key', 'pdf_bytes'}、指定を変えるまでダウンロードできるよう保持）
+    st.session_state.reprint_result = None
+if 'store_zip_result' not in st.session_state:
+    # 生成済みの店舗別PDFのZIP（{'key', 'zip_bytes'}、ボタンを押したときだけ生成する）
+    st.session_state.store_zip_result = None
 
 
-def validate_store_name(store_name, auto_learn=True):
-    """店舗名を検証し、最も近い店舗名を返す（動的設定対応）"""
-    if not store_name:
-        return None
-    store_name = str(store_name).strip()
-    known_stores = get_known_stores()
-    
-    # 完全一致
-    if store_name in known_stores:
-        return store_name
-    # 部分一致
-    for known_store in known_stores:
-        if known_store in store_name or store_name in known_store:
-            return known_store
-    
-    # 見つからない場合、自動学習
-    if auto_learn:
-        return auto_learn_store(store_name)
-    return None
+@st.cache_resource(show_spinner=False)
+def migrate_masters() -> list:
+    """マスターの移行（プロセスの起動時に1回だけ確認し、セッションの開始ではマスターを読み書きしない）"""
+    return run_migrations()
 
 
-def parse_order_image(image: Image.Image, api_key: str) -> list:
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_masters(version) -> dict:
     """
-    Gemini APIで注文書画像を解析（複数店舗対応）
-    
-    Args:
-        image: PIL Imageオブジェクト
-        api_key: Gemini APIキー
-    
-    Returns:
-        解析結果のリスト [{"store":"店舗名","item":"品目名","spec":"規格","unit":数字,"boxes":数字,"remainder":数字}]
+    マスター（店舗・品目・品目設定）をまとめて読み込む
+    （マスターのバージョンごとにキャッシュ、別プロセスでの変更もバージョンで検知する）
     """
-    genai.configure(api_key=api_key)
-    
-    # モデルを初期化（gemini-2.5-flash を優先、利用不可時は 2.0-flash 等にフォールバック）
-    try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-    except Exception:
-        try:
-            model = genai.GenerativeModel('gemini-2.0-flash')
-        except Exception:
-            try:
-                model = genai.GenerativeModel('gemini-1.5-flash')
-            except Exception:
-                try:
-                    model = genai.GenerativeModel('gemini-1.5-pro')
-                except Exception:
-                    model = genai.GenerativeModel('gemini-pro-vision')
-    
-    # 店舗名・品目名リストを取得
-    known_stores = get_known_stores()
-    item_normalization = get_item_normalization()
-    store_list = "、".join(known_stores)
-    item_list = ", ".join(item_normalization.keys())
-    # マスターデータを参照（品目名管理で設定した入数・箱数/総数）
-    item_settings_for_prompt = load_item_settings()
-    box_count_items = get_box_count_items()
-    unit_lines = "\n".join([f"- {name}: {s.get('default_unit', 0)}{s.get('unit_type', '袋')}/コンテナ" for name, s in sorted(item_settings_for_prompt.items()) if s.get("default_unit", 0) > 0])
-    box_count_str = "、".join(box_count_items) if box_count_items else "（なし）"
-    
-    # プロンプト（マスターデータを参照して計算）
-    prompt = f"""
-画像を解析し、以下の厳密なルールに従ってJSONで返してください。
+    return {
+        'stores': load_stores(),
+        'items': load_items(),
+        'item_settings': load_item_settings(),
+    }
 
-【店舗名リスト（参考）】
-{store_list}
-※上記リストにない店舗名も読み取ってください。
 
-【品目名の正規化ルール】
-{json.dumps(item_normalization, ensure_ascii=False, indent=2)}
+def get_masters() -> dict:
+    """現在のマスター（再実行のたびにファイルを読み込まない）"""
+    return load_masters(master_version())
 
-【重要ルール】
-1. 店舗名の後に「:」または改行がある場合、その後の行は全てその店舗の注文です
-2. 品目名がない行（例：「50×1」）は、直前の品目の続きとして処理してください
-3. 「/」で区切られた複数の注文は、同じ店舗・同じ品目として統合してください
-   - 例：「胡瓜バラ100×7 / 50×1」→ 胡瓜バラ100本×7箱 + 端数50本
-4. 「胡瓜バラ」と「胡瓜3本」は別の規格として扱ってください
-5. unit, boxes, remainderには「数字のみ」を入れてください
 
-【計算ルール（事前登録マスターデータ＝1コンテナあたりの入数）】
-メールで送られてくるのは基本的に「総数」です。以下の登録入数を参照して、総数から箱数・端数を逆算してください。
-{unit_lines}
+@st.cache_resource(show_spinner=False)
+def get_label_generator(layout: str) -> LabelPDFGenerator:
+    """用紙ごとのPDF生成器（フォント登録済みのものをセッション間で共有）"""
+    return LabelPDFGenerator(layout=layout, parallel_min_labels=configured_parallel_min_labels())
 
-【最重要：総数 vs 箱数】
-- 「×数字」が総数の品目：boxes = 総数÷unit（切り捨て）, remainder = 総数 - unit×boxes で逆算してください。
-- 「×数字」が箱数の品目（以下のみ）：{box_count_str} → ×数字をそのままboxesにし、unitは上記の値、remainder=0 で出力してください。
 
-【出力JSON形式】
-[{{"store":"店舗名","item":"品目名","spec":"規格","unit":数字,"boxes":数字,"remainder":数字}}]
+@st.cache_resource(show_spinner=False)
+def get_gemini_model(api_key: str):
+    """APIキーごとのGeminiモデル（解析のたびに作り直さない）"""
+    return order_parser.create_gemini_model(api_key)
 
-必ず全ての店舗と品目を漏れなく読み取ってください。
-"""
-    
-    try:
-        response = model.generate_content([prompt, image])
-        # レスポンスからJSONを抽出
-        text = response.text.strip()
-        if '```json' in text:
-            text = text.split('```json')[1].split('```')[0].strip()
-        elif '```' in text:
-            parts = text.split('```')
-            for part in parts:
-                if '{' in part and '[' in part:
-                    text = part.strip()
-                    break
-        
-        # JSONをパース
-        result = json.loads(text)
-        # リストでない場合はリストに変換
-        if isinstance(result, dict):
-            result = [result]
-        return result
-    except json.JSONDecodeError as e:
-        st.error(f"JSON解析エラー: {e}")
-        st.text(f"レスポンス内容: {text[:500]}")
-        return None
-    except Exception as e:
-        st.error(f"画像解析エラー: {e}")
-        return None
 
+# 設定タブ等でマスターが保存されたら、読み込み済みのマスターを破棄
+on_master_change('app.load_masters', load_masters.clear)
+migrate_masters()
 
-def validate_and_fix_order_data(order_data, auto_learn=True):
-    """AIが読み取ったデータを検証し、必要に応じて修正する（自動学習対応）"""
-    if not order_data:
-        return []
-    
-    validated_data = []
-    errors = []
-    learned_stores = []
-    learned_items = []
-    
-    known_stores = get_known_stores()
-    
-    for i, entry in enumerate(order_data):
-        # 必須フィールドのチェック
-        store = entry.get('store', '').strip()
-        item = entry.get('item', '').strip()
-        
-        # 店舗名の検証と修正（自動学習）
-        validated_store = validate_store_name(store, auto_learn=auto_learn)
-        if not validated_store and store:
-            if auto_learn:
-                validated_store = auto_learn_store(store)
-                if validated_store not in learned_stores:
-                    learned_stores.append(validated_store)
-            else:
-                errors.append(f"行{i+1}: 不明な店舗名「{store}」")
-                # 最も近い店舗名を推測
-                for known_store in known_stores:
-                    if any(char in store for char in known_store):
-                        validated_store = known_store
-                        break
-        
-        # 品目名の正規化（自動学習）
-        normalized_item = normalize_item_name(item, auto_learn=auto_learn)
-        if not normalized_item and item:
-            if auto_learn:
-                normalized_item = auto_learn_item(item)
-                if normalized_item not in learned_items:
-                    learned_items.append(normalized_item)
-            else:
-                errors.append(f"行{i+1}: 品目名「{item}」を正規化できませんでした")
-        
-        # 数量の検証
-        unit = safe_int(entry.get('unit', 0))
-        boxes = safe_int(entry.get('boxes', 0))
-        remainder = safe_int(entry.get('remainder', 0))
 
-        # 入数が0の場合、入数マスターから補完（柔軟に変えられる仕組み）
-        if unit <= 0:
-            spec_for_lookup = (entry.get('spec') or '').strip() if entry.get('spec') is not None else ''
-            looked_up = lookup_unit(normalized_item or item, spec_for_lookup, validated_store or store)
-            if looked_up > 0:
-                unit = looked_up
-            else:
-                # 入数マスターにもない場合、品目設定のデフォルト入数を使用
-                item_setting = get_item_setting(normalized_item or item)
-                default_unit = item_setting.get("default_unit", 0)
-                if default_unit > 0:
-                    unit = default_unit
-
-        # 数量が0の場合は警告
-        if unit == 0 and boxes == 0 and remainder == 0:
-            errors.append(f"行{i+1}: 数量が全て0です（店舗: {store}, 品目: {item}）")
-        
-        # 検証済みデータを追加
-        spec_value = entry.get('spec', '')
-        if spec_value is None:
-            spec_value = ''
-        else:
-            spec_value = str(spec_value).strip()
-        
-        # 入数が取得できた場合、入数マスターに自動登録（新規のみ、重複はスキップ）
-        if unit > 0:
-            add_unit_if_new(normalized_item or item, spec_value, validated_store or store, unit)
-
-        validated_entry = {
-            'store': validated_store or store,
-            'item': normalized_item or item,
-            'spec': spec_value,
-            'unit': unit,
-            'boxes': boxes,
-            'remainder': remainder
-        }
-        validated_data.append(validated_entry)
-    
-    # 自動学習の結果を表示
-    if auto_learn:
-        if learned_stores:
-            st.success(f"✨ 新しい店舗名を学習しました: {', '.join(learned_stores)}")
-        if learned_items:
-            st.success(f"✨ 新しい品目名を学習しました: {', '.join(learned_items)}")
-    
-    # エラーがある場合は表示
-    if errors:
-        st.warning("⚠️ 検証で以下の問題が見つかりました:")
-        for error in errors:
-            st.write(f"- {error}")
-    
-    return validated_data
+def parse_order_image(image: Image.Image, api_key: str) -> list:
+    """Gemini APIで注文書画像を解析（エラーは画面に表示）"""
+    return order_parser.parse_order_image(image, api_key, report=st, model=get_gemini_model(api_key))
+
+
+def validate_and_fix_order_data(order_data, auto_learn=True):
+    """AIが読み取ったデータを検証・修正（学習結果・問題点は画面に表示）"""
+    return order_parser.validate_and_fix_order_data(order_data, auto_learn=auto_learn, report=st)
 
 
-def generate_labels_from_data(order_data: list, shipment_date: str) -> list:
+def generate_labels_from_data(order_data: list, shipment_date: str) -> LabelList:
     """
     解析データからラベルリストを生成（店舗ごと）
     
@@ -349,9 +182,13 @@ def generate_labels_from_data(order_data: list, shipment_date: str) -> list:
         shipment_date: 出荷日（YYYY-MM-DD形式）
     
     Returns:
-        ラベル情報のリスト
+        ラベルのリスト（注文1行につき1レコードを持ち、箱ごとのラベルは参照時に作る）
     """
-    labels = []
+    return LabelList(iter_label_lines(order_data, shipment_date))
+
+
+def iter_label_lines(order_data: list, shipment_date: str):
+    """解析データから注文行ごとのラベル情報（LabelLine）を順に返す"""
     dt = datetime.strptime(shipment_date, '%Y-%m-%d')
     shipment_date_display = f"{dt.month}月{dt.day}日"  # 口数「1/6」と区別するため漢字表記（例: 2月10日）
     
@@ -369,166 +206,188 @@ def generate_labels_from_data(order_data: list, shipment_date: str) -> list:
         # 単位を判定（get_unit_label_for_item関数を使用）
         unit_label = get_unit_label_for_item(item, spec)
         
-        # 通常箱のラベル
-        total_boxes = boxes + (1 if remainder > 0 else 0)
-        for i in range(boxes):
-            labels.append({
-                'store': store,
-                'item': item,
-                'spec': spec,
-                'quantity': f"{unit}{unit_label}",
-                'sequence': f"{i+1}/{total_boxes}",
-                'is_fraction': False,
-                'shipment_date': shipment_date_display,
-                'unit': unit,
-                'boxes': boxes,
-                'remainder': remainder
-            })
-        
-        # 端数箱のラベル（余りがある場合）
-        if remainder > 0:
-            labels.append({
-                'store': store,
-                'item': item,
-                'spec': spec,
-                'quantity': f"{remainder}{unit_label}",
-                'sequence': f"{total_boxes}/{total_boxes}",
-                'is_fraction': True,
-                'shipment_date': shipment_date_display,
-                'unit': unit,
-                'boxes': boxes,
-                'remainder': remainder
-            })
-    
-    return labels
+        yield LabelLine(store, item, spec, unit, boxes, remainder, unit_label, shipment_date_display)
 
 
-def get_unit_label_for_item(item: str, spec: str) -> str:
+def generate_summary_table(totals: OrderTotals) -> list:
     """
-    品目名と規格から単位を判定（品目設定を優先）
+    出荷一覧表用のデータを生成
     
     Args:
-        item: 品目名
-        spec: 規格
+        totals: 注文データの集計結果（aggregate_orders）
     
     Returns:
-        単位（'本'、'袋'など）
+        一覧表用のデータリスト
     """
-    # まず品目設定から取得を試みる
-    setting = get_item_setting(item)
-    if setting.get("unit_type"):
-        return setting["unit_type"]
-    
-    # 品目設定がない場合、従来のロジックで判定
-    item_lower = item.lower() if item else ""
-    spec_lower = spec.lower() if spec else ""
-    
-    # 単位を判定（品目名と規格から判定）
-    unit_label = '本'  # デフォルト
-    
-    # 長ねぎバラの判定（品目名に「バラ」が含まれる場合）
-    if '長ねぎバラ' in item or '長ネギバラ' in item or 'ネギバラ' in item or 'ねぎバラ' in item or '長ねぎばら' in item:
-        unit_label = '本'
-    # 長ねぎ（袋）の判定
-    elif ('ネギ' in item or 'ねぎ' in item) and 'バラ' not in item and 'ばら' not in item:
-        unit_label = '袋'
-    # 胡瓜バラの判定（品目名に「バラ」が含まれる場合）
-    elif '胡瓜バラ' in item or 'きゅうりバラ' in item or 'キュウリバラ' in item or '胡瓜ばら' in item:
-        unit_label = '本'
-    # 胡瓜（袋）の判定
-    elif ('胡瓜' in item or 'きゅうり' in item) and 'バラ' not in item and 'ばら' not in item:
-        unit_label = '袋'
-    # 規格で判定（後方互換性のため）
-    elif 'バラ' in spec or 'ばら' in spec_lower:
-        if '胡瓜' in item or 'きゅうり' in item:
-            unit_label = '本'
-        elif 'ネギ' in item or 'ねぎ' in item:
-            unit_label = '本'
-    # その他の品目
-    elif '春菊' in item or '青梗菜' in item or 'チンゲン菜' in item:
-        unit_label = '袋'
-    
-    return unit_label
+    return totals.summary_records()
 
 
-def generate_summary_table(order_data: list) -> list:
+def generate_line_summary(totals: OrderTotals) -> str:
     """
-    出荷一覧表用のデータを生成
+    LINEに貼り付け可能な集計テキストを生成
     
     Args:
-        order_data: 解析結果のリスト
+        totals: 注文データの集計結果（aggregate_orders）
     
     Returns:
-        一覧表用のデータリスト
+        LINE用の集計テキスト
     """
-    summary = []
-    for entry in order_data:
-        store = entry.get('store', '')
-        item = entry.get('item', '')
-        spec = entry.get('spec', '')
-        boxes = safe_int(entry.get('boxes', 0))
-        remainder = safe_int(entry.get('remainder', 0))
-        unit = safe_int(entry.get('unit', 0))
-        
-        rem_box = 1 if remainder > 0 else 0
-        total_packs = boxes + rem_box  # フル箱 + 端数箱 = パック数
-        total_quantity = (unit * boxes) + remainder  # 総数量
-        
-        # 単位を判定
-        unit_label = get_unit_label_for_item(item, spec)
-        # 品目表示名：荷姿(spec)があれば「品目 荷姿」で判別しやすくする（一覧表・総数で使用）
-        item_display = f"{item} {spec}".strip() if spec else item
-        
-        summary.append({
-            'store': store,
-            'item': item,
-            'spec': spec,
-            'item_display': item_display,
-            'boxes': boxes,
-            'rem_box': rem_box,
-            'total_packs': total_packs,
-            'total_quantity': total_quantity,
-            'unit': unit,
-            'unit_label': unit_label  # 単位情報を追加
-        })
+    return totals.line_text()
+
+
+def make_pdf_request_key(label_layout: str) -> str:
+    """
+    PDF生成の要求キー（解析データ・ラベル・出荷日・用紙・マスターのバージョン）
+    出荷一覧表の単位などは生成時のマスターから決まるため、マスターが変わったら作り直す
+    """
+    return make_pdf_cache_key(
+        st.session_state.parsed_data,
+        st.session_state.labels,
+        st.session_state.shipment_date,
+        label_layout,
+        master_version()
+    )
+
+
+@st.cache_data(max_entries=200, show_spinner=False)
+def get_attachment_thumbnail(content_hash: str, _attachment) -> bytes:
+    """添付画像のプレビュー用サムネイル（内容ハッシュごとにキャッシュ）"""
+    return _attachment.thumbnail()
+
+
+@st.cache_data(max_entries=200, show_spinner=False)
+def get_prefetched_thumbnail(content_hash: str, _entry: dict) -> bytes:
+    """事前解析済み注文の元画像サムネイル（内容ハッシュごとにキャッシュ）"""
+    return make_thumbnail(load_prefetched_image_bytes(_entry))
+
+
+def get_cached_email_results(fetch_key: tuple):
+    """
+    セッションにキャッシュしたメール取得結果を返す
+    
+    取得条件が変わった場合や有効期限（EMAIL_CACHE_TTL_MINUTES）切れの場合はNone
+    """
+    cached = st.session_state.email_results
+    if cached is None or cached['key'] != fetch_key:
+        return None
+    if datetime.now() - cached['fetched_at'] > timedelta(minutes=EMAIL_CACHE_TTL_MINUTES):
+        return None
+    return cached
+
+
+def store_email_results(fetch_key: tuple, groups: list) -> dict:
+    """メール取得結果をセッションにキャッシュ（古い結果の一時ファイルは削除）"""
+    previous = st.session_state.email_results
+    if previous is not None:
+        for group in previous['groups']:
+            group.attachment.release()
+    st.session_state.email_results = {
+        'key': fetch_key,
+        'fetched_at': datetime.now(),
+        'groups': groups,
+    }
+    return st.session_state.email_results
+
+
+def parse_attachment_group(group, api_key: str) -> list:
+    """重複統合済みの添付画像を解析（解析済みの画像ならGeminiを呼ばずに結果を再利用）"""
+    cache = st.session_state.parsed_by_hash
+    for content_hash in group.content_hashes:
+        if content_hash in cache:
+            return cache[content_hash]
+    # 解析時にのみフル解像度でデコード
+    order_data = parse_order_image(group.attachment.open_image(), api_key)
+    if order_data:
+        for content_hash in group.content_hashes:
+            cache[content_hash] = order_data
+    return order_data
+
+
+def changed_editor_rows(before: pd.DataFrame, after: pd.DataFrame, columns: list) -> list:
+    """
+    データエディタの編集前後で内容が変わった行（追加された行を含む）のインデックス
     
-    return summary
+    Args:
+        before: 編集前の表（行のインデックスは編集用の表の行番号）
+        after: st.data_editor が返した表（削除された行は含まれない）
+        columns: 比較する列
+    """
+    common = after.index.intersection(before.index)
+    old_values = before.loc[common, columns]
+    new_values = after.loc[common, columns]
+    differs = (old_values != new_values) & ~(old_values.isna() & new_values.isna())
+    changed = set(common[differs.any(axis=1)])
+    return [idx for idx in after.index if idx in changed or idx not in before.index]
 
 
-def generate_line_summary(order_data: list) -> str:
+def build_editor_frame(order_data: list, item_settings: dict) -> pd.DataFrame:
     """
-    LINEに貼り付け可能な集計テキストを生成
+    解析結果の確認・編集用の表を作成
     
     Args:
         order_data: 解析結果のリスト
-    
-    Returns:
-        LINE用の集計テキスト
+        item_settings: 品目設定（入数が0の行は品目設定のデフォルト入数で補完して表示する）
     """
-    summary_packs = defaultdict(int)
-    
+    df_data = []
+    display_default_units = {}  # 品目名 → 品目設定のデフォルト入数（表示用、品目ごとに1回だけ調べる）
     for entry in order_data:
         unit = safe_int(entry.get('unit', 0))
         boxes = safe_int(entry.get('boxes', 0))
         remainder = safe_int(entry.get('remainder', 0))
-        total = (unit * boxes) + remainder
         
-        # キーをitemとspecの組み合わせにする（胡瓜の3本Pとバラを別物として扱う）
-        item = entry.get('item', '不明')
-        spec = entry.get('spec', '').strip()
-        key = (item, spec)  # タプルをキーとして使用
-        summary_packs[key] += total
-    
-    line_text = f"【{datetime.now().strftime('%m/%d')} 出荷・作成総数】\n"
-    # キーをソートして表示（品目名→規格の順）
-    sorted_items = sorted(summary_packs.items(), key=lambda x: (x[0][0], x[0][1]))
-    for (item, spec), total in sorted_items:
-        unit_label = get_unit_label_for_item(item, spec)
-        # 表示形式: 品目名 荷姿（一覧表と統一）
-        display_name = f"{item} {spec}".strip() if spec else item
-        line_text += f"・{display_name}：{total}{unit_label}\n"
+        # 入数が0の場合、品目設定のデフォルト入数を使用（表示用）
+        if unit == 0:
+            item_name = entry.get('item', '')
+            if item_name not in display_default_units:
+                normalized_item = normalize_item_name(item_name)
+                item_setting = get_item_setting(normalized_item or item_name, item_settings)
+                display_default_units[item_name] = item_setting.get("default_unit", 0)
+            default_unit = display_default_units[item_name]
+            if default_unit > 0:
+                unit = default_unit  # 表示用にデフォルト値を設定
+        
+        total_quantity = (unit * boxes) + remainder
+        
+        df_data.append({
+            '店舗名': entry.get('store', ''),
+            '品目': entry.get('item', ''),
+            '規格': entry.get('spec') or '',
+            '入数(unit)': unit,
+            '箱数(boxes)': boxes,
+            '端数(remainder)': remainder,
+            '合計数量': total_quantity
+        })
     
-    return line_text
+    return pd.DataFrame(df_data, columns=EDITOR_COLUMNS).astype(EDITOR_DTYPES)
+
+
+def editor_frame_to_orders(frame: pd.DataFrame) -> list:
+    """編集用の表を解析結果のリストに戻す"""
+    return [
+        {'store': store, 'item': item, 'spec': str(spec).strip(), 'unit': int(unit), 'boxes': int(boxes), 'remainder': int(remainder)}
+        for store, item, spec, unit, boxes, remainder in zip(
+            frame['店舗名'], frame['品目'], frame['規格'],
+            frame['入数(unit)'], frame['箱数(boxes)'], frame['端数(remainder)']
+        )
+    ]
+
+
+def editor_int(value) -> int:
+    """データエディタの数値セルを整数に（追加した行の空欄は0）"""
+    return 0 if pd.isna(value) else int(value)
+
+
+def store_totals(frame: pd.DataFrame) -> pd.DataFrame:
+    """店舗ごとの合計（行数・フル箱・端数箱・総パック数）"""
+    totals = frame.assign(
+        端数箱=(frame['端数(remainder)'] > 0).astype('int64')
+    ).groupby('店舗名', sort=False).agg(
+        行数=('品目', 'size'),
+        フル箱=('箱数(boxes)', 'sum'),
+        端数箱=('端数箱', 'sum'),
+    ).reset_index()
+    totals['総パック数'] = totals['フル箱'] + totals['端数箱']
+    return totals
 
 
 # メインUI
@@ -728,48 +587,93 @@ with tab2:
             }
             st.success("✅ 設定を保存しました（パスワードは保存されません）")
     
-    # ワンクリックでメールチェック
+    # 追加のメールボックス（店舗ごとに違う送信元・別のメールサービスの取引先）
+    with st.expander(f"📚 追加のメールボックス（{len(st.session_state.email_profiles)}件）", expanded=False):
+        st.caption("登録したメールボックスは上の設定と同時にチェックされ、結果はまとめて表示されます。送信者フィルタはカンマ区切りで複数指定できます。")
+        df_profiles = pd.DataFrame(
+            [
+                {
+                    "名前": p["name"],
+                    "メールアドレス": p["email_address"],
+                    "IMAPサーバー": p["imap_server"],
+                    "送信者フィルタ": ", ".join(p["sender_emails"]),
+                    "何日前まで": p["days_back"],
+                }
+                for p in st.session_state.email_profiles
+            ],
+            columns=["名前", "メールアドレス", "IMAPサーバー", "送信者フィルタ", "何日前まで"]
+        )
+        edited_profiles = st.data_editor(
+            df_profiles,
+            use_container_width=True,
+            hide_index=True,
+            num_rows="dynamic",
+            key=f"email_profiles_editor_{st.session_state.get('email_profiles_version', 0)}",
+            column_config={
+                "名前": st.column_config.TextColumn("名前"),
+                "メールアドレス": st.column_config.TextColumn("メールアドレス", required=True),
+                "IMAPサーバー": st.column_config.TextColumn("IMAPサーバー", help="空欄ならメールアドレスから自動判定"),
+                "送信者フィルタ": st.column_config.TextColumn("送信者フィルタ", help="カンマ区切りで複数指定（空欄で全て）"),
+                "何日前まで": st.column_config.NumberColumn("何日前まで", min_value=1, max_value=30, step=1),
+            },
+        )
+        profiles_from_editor = [
+            normalize_profile({
+                "name": row["名前"] if pd.notna(row["名前"]) else "",
+                "email_address": row["メールアドレス"] if pd.notna(row["メールアドレス"]) else "",
+                "imap_server": row["IMAPサーバー"] if pd.notna(row["IMAPサーバー"]) else "",
+                "sender_emails": row["送信者フィルタ"] if pd.notna(row["送信者フィルタ"]) else "",
+                "days_back": row["何日前まで"] if pd.notna(row["何日前まで"]) else 1,
+            })
+            for _, row in edited_profiles.iterrows()
+            if pd.notna(row["メールアドレス"]) and str(row["メールアドレス"]).strip()
+        ]
+        
+        # パスワード（アドレスごと、ファイルには保存しない）
+        for address in dict.fromkeys(p["email_address"] for p in profiles_from_editor):
+            if address == email_address:
+                continue
+            st.session_state.email_passwords[address] = st.text_input(
+                f"パスワード（{address}）",
+                type="password",
+                value=st.session_state.email_passwords.get(address, ""),
+                key=f"email_pass_{address}"
+            )
+        
+        if st.button("💾 追加のメールボックスを保存", key="save_email_profiles"):
+            save_email_profiles(profiles_from_editor)
+            st.session_state.email_profiles = profiles_from_editor
+            # 編集内容を保存済みの一覧に置き換えるため、エディタを作り直す
+            st.session_state.email_profiles_version = st.session_state.get('email_profiles_version', 0) + 1
+            st.success("✅ 保存しました（パスワードは保存されません）")
+            st.rerun()
+    
+    # チェック対象：上の設定 + 追加のメールボックス（同時にチェック）
+    check_profiles = []
+    if email_address:
+        check_profiles.append(normalize_profile({
+            "name": email_address,
+            "email_address": email_address,
+            "imap_server": imap_server,
+            "sender_emails": sender_email,
+            "days_back": days_back,
+        }))
+    check_profiles.extend(profiles_from_editor)
+    check_passwords = {**st.session_state.email_passwords}
+    if email_address:
+        check_passwords[email_address] = email_password
+    
+    # ワンクリックでメールチェック（取得結果はセッションに一定時間キャッシュ）
+    fetch_key = tuple(
+        (p["name"], p["email_address"], p["imap_server"], tuple(p["sender_emails"]), p["days_back"])
+        for p in check_profiles
+    )
+    cached = get_cached_email_results(fetch_key)
+    
     col1, col2 = st.columns([2, 1])
     
     with col1:
-        if st.button("📬 メールをチェック", type="primary", use_container_width=True):
-            if not email_address or not email_password:
-                st.error("メールアドレスとパスワードを入力してください。")
-            else:
-                try:
-                    with st.spinner('メールをチェック中...'):
-                        results = check_email_for_orders(
-                            imap_server=imap_server,
-                            email_address=email_address,
-                            password=email_password,
-                            sender_email=sender_email if sender_email else None,
-                            days_back=days_back
-                        )
-                    
-                    if results:
-                        st.success(f"✅ {len(results)}件のメールから画像を取得しました")
-                        
-                        for idx, result in enumerate(results):
-                            with st.expander(f"📎 {result['filename']} - {result['subject']} ({result['date']})"):
-                                st.image(result['image'], caption=result['filename'], use_container_width=True)
-                                
-                                if st.button(f"🔍 この画像を解析", key=f"parse_{idx}"):
-                                    with st.spinner('解析中...'):
-                                        order_data = parse_order_image(result['image'], api_key)
-                                        if order_data:
-                                            validated_data = validate_and_fix_order_data(order_data)
-                                            st.session_state.parsed_data = validated_data
-                                            st.session_state.labels = []
-                                            st.success(f"✅ {len(validated_data)}件のデータを読み取りました")
-                                            st.rerun()
-                    else:
-                        st.info("新しいメールは見つかりませんでした。")
-                
-                except Exception as e:
-                    st.error(f"メールチェックエラー: {e}")
-                    with st.expander("🔍 詳細なエラー情報"):
-                        st.code(traceback.format_exc(), language="python")
-                    st.info("💡 解決方法: IMAPサーバー設定、メールアドレス、パスワードを確認してください。Gmailの場合はアプリパスワードを使用してください。")
+        check_clicked = st.button("📬 メールをチェック", type="primary", use_container_width=True)
     
     with col2:
         # 設定をリセット
@@ -777,18 +681,153 @@ with tab2:
             st.session_state.email_password = ""
             st.rerun()
     
+    refresh_clicked = False
+    if cached is not None:
+        age_minutes = int((datetime.now() - cached['fetched_at']).total_seconds() // 60)
+        info_col, refresh_col = st.columns([2, 1])
+        with info_col:
+            st.caption(f"🕒 {cached['fetched_at'].strftime('%H:%M')} に取得した結果を表示中（{age_minutes}分前、{EMAIL_CACHE_TTL_MINUTES}分で自動再取得）")
+        with refresh_col:
+            refresh_clicked = st.button("♻️ 最新のメールを再取得", use_container_width=True)
+    
+    if (check_clicked and cached is None) or refresh_clicked:
+        missing_password = [p["name"] for p in check_profiles if not check_passwords.get(p["email_address"])]
+        if not check_profiles or missing_password:
+            st.error("メールアドレスとパスワードを入力してください。" + (f"（未入力: {', '.join(missing_password)}）" if missing_password else ""))
+        else:
+            fetch_errors = {}
+            try:
+                with st.spinner(f'メールをチェック中...（{len(check_profiles)}件のメールボックス）'):
+                    # 全メールボックスを同時にチェックし、1つの結果にまとめる
+                    # 画像はデコードせず一時ファイルに退避したレコードとして受け取る（表示はサムネイル）
+                    # 同じFAXの再送・転送は1件にまとめる
+                    results = dedupe_attachments(iter_profile_attachments(
+                        check_profiles,
+                        check_passwords,
+                        spill_threshold=0,
+                        errors=fetch_errors
+                    ), known_hashes=st.session_state.parsed_by_hash.keys())
+                cached = store_email_results(fetch_key, results)
+            
+            except Exception as e:
+                st.error(f"メールチェックエラー: {e}")
+                with st.expander("🔍 詳細なエラー情報"):
+                    st.code(traceback.format_exc(), language="python")
+            
+            for profile_name, error in fetch_errors.items():
+                st.error(f"メールチェックエラー（{profile_name}）: {error}")
+            if fetch_errors:
+                st.info("💡 解決方法: IMAPサーバー設定、メールアドレス、パスワードを確認してください。Gmailの場合はアプリパスワードを使用してください。")
+    
+    # 取得結果の表示（解析ボタンの再実行でもメールを再取得しない）
+    if cached is not None:
+        results = cached['groups']
+        if results:
+            total_sources = sum(len(group.sources) for group in results)
+            st.success(f"✅ {total_sources}件のメールから画像を取得しました（重複を除いて{len(results)}件）")
+            
+            for idx, group in enumerate(results):
+                result = group.attachment
+                already_parsed = group.is_known(st.session_state.parsed_by_hash.keys())
+                title = f"📎 {result.filename} - {result.subject} ({result.date})"
+                if len(check_profiles) > 1 and result.profile:
+                    title = f"[{result.profile}] " + title
+                if len(group.sources) > 1:
+                    title += f" ×{len(group.sources)}通"
+                if already_parsed:
+                    title += " ✔️解析済み"
+                with st.expander(title):
+                    st.image(
+                        get_attachment_thumbnail(result.content_hash, result),
+                        caption=result.filename,
+                        width=THUMBNAIL_SIZE[0]
+                    )
+                    if len(group.sources) > 1:
+                        st.caption("受信元: " + " / ".join(
+                            f"[{src['profile']}] {src['from']} {src['subject']} ({src['date']})" for src in group.sources
+                        ))
+                    
+                    if st.button("🔍 この画像を解析", key=f"parse_{result.content_hash}"):
+                        with st.spinner('解析中...'):
+                            order_data = parse_attachment_group(group, api_key)
+                            if order_data:
+                                validated_data = validate_and_fix_order_data(order_data)
+                                st.session_state.parsed_data = validated_data
+                                st.session_state.labels = []
+                                st.success(f"✅ {len(validated_data)}件のデータを読み取りました")
+                                st.rerun()
+                            else:
+                                st.error("解析に失敗しました。画像を確認してください。")
+        else:
+            st.info("新しいメールは見つかりませんでした。")
+    
+    # バックグラウンドのメール監視（email_watcher.py）で事前に解析された注文
+    prefetched_orders = load_prefetched_orders()
+    if prefetched_orders:
+        st.markdown("---")
+        st.write(f"**🌙 事前解析済みの注文（{len(prefetched_orders)}件）**")
+        st.caption("メール監視（email_watcher.py）が受信時に解析した結果です。メールの再取得やAI解析を待たずに読み込めます。")
+        for entry in prefetched_orders:
+            content_hash = entry['content_hash']
+            rows = entry.get('validated_data') or []
+            first_source = (entry.get('sources') or [{}])[0]
+            title = f"🌙 {entry.get('filename', '')} - {first_source.get('subject', '')} ({entry.get('received_at', '')})"
+            if len(entry.get('sources') or []) > 1:
+                title += f" ×{len(entry['sources'])}通"
+            title += f" ｜ {len(rows)}件" if entry.get('status') == 'parsed' else " ｜ ⚠️解析失敗"
+            with st.expander(title):
+                st.image(
+                    get_prefetched_thumbnail(content_hash, entry),
+                    caption=entry.get('filename', ''),
+                    width=THUMBNAIL_SIZE[0]
+                )
+                if rows:
+                    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+                load_col, parse_col, delete_col = st.columns(3)
+                with load_col:
+                    if rows and st.button("📥 この結果を読み込む", key=f"load_prefetched_{content_hash}", type="primary"):
+                        # マスターが更新されている可能性があるため読み込み時に再検証
+                        st.session_state.parsed_data = validate_and_fix_order_data(rows)
+                        st.session_state.labels = []
+                        if entry.get('order_data'):
+                            st.session_state.parsed_by_hash[content_hash] = entry['order_data']
+                        st.rerun()
+                with parse_col:
+                    if st.button("🔍 再解析", key=f"reparse_prefetched_{content_hash}"):
+                        with st.spinner('解析中...'):
+                            image = Image.open(io.BytesIO(load_prefetched_image_bytes(entry)))
+                            order_data = parse_order_image(image, api_key)
+                            if order_data:
+                                st.session_state.parsed_by_hash[content_hash] = order_data
+                                st.session_state.parsed_data = validate_and_fix_order_data(order_data)
+                                st.session_state.labels = []
+                                st.rerun()
+                            else:
+                                st.error("解析に失敗しました。画像を確認してください。")
+                with delete_col:
+                    if st.button("🗑️ 削除", key=f"delete_prefetched_{content_hash}"):
+                        remove_prefetched_order(content_hash)
+                        st.rerun()
+    
     # 設定が保存されている場合の表示
     if saved_config.get("email_address"):
         st.success(f"💾 設定が保存されています: **{saved_config.get('email_address')}** ({saved_config.get('imap_server', '自動判定')}) - パスワードのみ入力してください")
 
 # ===== タブ3: 設定管理 =====
-with tab3:
-    st.subheader("⚙️ 設定管理")
-    st.write("店舗名と品目名を動的に管理できます。")
-    
-    # 店舗名管理
-    st.subheader("🏪 店舗名管理")
-    stores = load_stores()
+# 店舗名・マスターデータ・品目一覧はそれぞれ独立したフラグメントにし、操作してもその部分だけ再実行する
+
+def rerun_fragment():
+    """フラグメント内の操作後、そのフラグメントだけ再実行（アプリ全体の実行中ならアプリ全体を再実行）"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+
+@st.fragment
+def render_store_settings():
+    """店舗名管理（追加・削除）"""
+    stores = get_masters()['stores']
     
     col1, col2 = st.columns([3, 1])
     with col1:
@@ -798,7 +837,7 @@ with tab3:
             if new_store and new_store.strip():
                 if add_store(new_store.strip()):
                     st.success(f"✅ 「{new_store.strip()}」を追加しました")
-                    st.rerun()
+                    rerun_fragment()
                 else:
                     st.warning("既に存在する店舗名です")
     
@@ -813,19 +852,17 @@ with tab3:
                 if st.button("削除", key=f"del_store_{store}"):
                     if remove_store(store):
                         st.success(f"✅ 「{store}」を削除しました")
-                        st.rerun()
-    
-    st.divider()
-    
-    # 品目名管理
-    st.subheader("🥬 品目名管理")
-    items = load_items()
-    item_settings = load_item_settings()
+                        rerun_fragment()
+
+
+@st.fragment
+def render_master_data_settings():
+    """マスターデータ（入数・単位・受信方法）の一覧編集"""
+    item_settings = get_masters()['item_settings']
     
     # 登録済みマスターデータ（確認・編集可能、箱数/総数切り替え）
     st.write("**📋 マスターデータ（入数・単位・受信方法）**")
     st.caption("メールの「×数字」は通常は総数です。この入数で箱数・端数を逆算します。「受信方法」を箱数にした品目は、×数字をそのまま箱数として扱います。編集して「マスターデータを保存」を押してください。")
-    box_count_items = get_box_count_items()
     if item_settings:
         master_rows = []
         for name, setting in sorted(item_settings.items()):
@@ -852,16 +889,22 @@ with tab3:
                 },
             )
             if st.button("💾 マスターデータを保存", key="save_master_btn", type="primary"):
+                # 全品目分をまとめて1回で保存（品目ごとに読み書きしない）
+                settings = load_item_settings()
                 for _, row in edited_master.iterrows():
                     name = str(row["品目"]).strip()
                     u = int(row["1コンテナあたりの入数"]) if row["1コンテナあたりの入数"] > 0 else 30
                     t = str(row["単位"]).strip() or "袋"
                     as_boxes = str(row["受信方法"]).strip() == "箱数"
-                    set_item_setting(name, u, t, receive_as_boxes=as_boxes)
+                    settings[name] = {"default_unit": u, "unit_type": t, "receive_as_boxes": as_boxes}
+                save_item_settings(settings)
                 st.success("✅ マスターデータを保存しました。解析時にこの設定が参照されます。")
-                st.rerun()
-    st.divider()
-    
+                rerun_fragment()
+
+
+@st.fragment
+def render_item_settings():
+    """品目の追加と、登録済み品目の一覧（検索・ページ分割）"""
     # 新しい品目を追加（入数・単位を縦並びで確実に表示）
     st.write("**新しい品目を追加**")
     st.caption("💡 品目名、1コンテナあたりの入数、単位を入力して「追加」ボタンを押してください")
@@ -880,8 +923,11 @@ with tab3:
             if add_new_item(item_name):
                 set_item_setting(item_name, int(new_item_unit), new_item_unit_type)
                 st.session_state[f"item_expanded_{item_name}"] = True
+                # 追加した品目が一覧に表示されるように検索・ページを合わせる
+                st.session_state["item_search"] = item_name
+                st.session_state["item_page"] = 1
                 st.success(f"✅ 「{item_name}」を追加しました（入数: {new_item_unit}{new_item_unit_type}/コンテナ）")
-                st.rerun()
+                rerun_fragment()
             else:
                 st.warning("既に存在する品目名です")
         else:
@@ -889,12 +935,35 @@ with tab3:
     
     st.divider()
     
-    # 登録済み品目名一覧（編集・削除可能）
+    masters = get_masters()
+    items = masters['items']
+    item_settings = masters['item_settings']
+    
+    # 登録済み品目名一覧（編集・削除可能、検索・ページ分割して表示中のページの品目だけ描画）
     if items:
         st.write("**登録済み品目名**（各品目の **1コンテナあたりの入数** と **単位** は、下の▼をクリックして開き、中で確認・編集できます）")
-        for normalized, variants in items.items():
+        col_search, col_page = st.columns([3, 1])
+        with col_search:
+            item_query = st.text_input("品目名・表記で検索", placeholder="例: 胡瓜", key="item_search")
+        query = item_query.strip().lower()
+        matched_items = [
+            (normalized, variants) for normalized, variants in items.items()
+            if not query or query in normalized.lower() or any(query in variant.lower() for variant in variants)
+        ]
+        page_count = max(1, (len(matched_items) + SETTINGS_ITEMS_PER_PAGE - 1) // SETTINGS_ITEMS_PER_PAGE)
+        if st.session_state.get("item_page", 1) > page_count:
+            st.session_state["item_page"] = page_count  # 検索で件数が減った場合
+        with col_page:
+            item_page = st.number_input("ページ", min_value=1, max_value=page_count, step=1, key="item_page")
+        page_start = (item_page - 1) * SETTINGS_ITEMS_PER_PAGE
+        page_items = matched_items[page_start:page_start + SETTINGS_ITEMS_PER_PAGE]
+        if page_items:
+            st.caption(f"{len(matched_items)}件中 {page_start + 1}〜{page_start + len(page_items)}件目（{item_page}/{page_count}ページ）")
+        else:
+            st.caption("該当する品目がありません")
+        for normalized, variants in page_items:
             # 品目設定を取得
-            setting = get_item_setting(normalized)
+            setting = get_item_setting(normalized, item_settings)
             default_unit = setting.get("default_unit", 0)
             unit_type = setting.get("unit_type", "袋")
             receive_as_boxes = setting.get("receive_as_boxes", False)
@@ -932,7 +1001,7 @@ with tab3:
                         if new_variant and new_variant.strip():
                             add_item_variant(normalized, new_variant.strip())
                             st.success(f"✅ 「{new_variant.strip()}」を追加しました")
-                            st.rerun()
+                            rerun_fragment()
                 
                 st.divider()
                 
@@ -966,7 +1035,7 @@ with tab3:
                     if st.button("保存", key=f"save_setting_{normalized}", use_container_width=True):
                         set_item_setting(normalized, int(edit_unit), edit_unit_type, receive_as_boxes=(edit_receive == "箱数"))
                         st.success(f"✅ 「{normalized}」の設定を保存しました")
-                        st.rerun()
+                        rerun_fragment()
                 
                 st.divider()
                 
@@ -975,54 +1044,78 @@ with tab3:
                     if remove_item(normalized):
                         remove_item_setting(normalized)
                         st.success(f"✅ 「{normalized}」を削除しました")
-                        st.rerun()
+                        rerun_fragment()
+
+
+with tab3:
+    st.subheader("⚙️ 設定管理")
+    st.write("店舗名と品目名を動的に管理できます。")
+    
+    # 店舗名管理
+    st.subheader("🏪 店舗名管理")
+    render_store_settings()
+    
+    st.divider()
+    
+    # 品目名管理
+    st.subheader("🥬 品目名管理")
+    render_master_data_settings()
+    st.divider()
+    render_item_settings()
 
 # ===== 共通: 解析結果の表示と編集 =====
+# 直前の実行で編集を反映した場合の通知（表示は1回だけ）
+editor_saved = st.session_state.pop('editor_saved', False)
 if st.session_state.parsed_data:
     st.markdown("---")
     st.header("📊 解析結果の確認・編集")
     st.write("以下のテーブルでデータを確認・編集できます。編集後は「ラベルを生成」ボタンを押してください。")
+    if editor_saved:
+        st.info("✅ データを更新しました。入数マスターにも反映済み。PDFを生成する場合は下のボタンを押してください。")
     
-    # 編集可能なデータフレーム
-    df_data = []
-    for entry in st.session_state.parsed_data:
-        unit = safe_int(entry.get('unit', 0))
-        boxes = safe_int(entry.get('boxes', 0))
-        remainder = safe_int(entry.get('remainder', 0))
-        
-        # 入数が0の場合、品目設定のデフォルト入数を使用（表示用）
-        if unit == 0:
-            item_name = entry.get('item', '')
-            normalized_item = normalize_item_name(item_name)
-            item_setting = get_item_setting(normalized_item or item_name)
-            default_unit = item_setting.get("default_unit", 0)
-            if default_unit > 0:
-                unit = default_unit  # 表示用にデフォルト値を設定
-        
-        total_quantity = (unit * boxes) + remainder
-        
-        df_data.append({
-            '店舗名': entry.get('store', ''),
-            '品目': entry.get('item', ''),
-            '規格': entry.get('spec', ''),
-            '入数(unit)': unit,
-            '箱数(boxes)': boxes,
-            '端数(remainder)': remainder,
-            '合計数量': total_quantity
-        })
-    
-    df = pd.DataFrame(df_data)
-    
-    # データエディタ
+    # 編集用の表はセッションに保持し、解析結果が差し替えられたときだけ作り直す
+    masters = get_masters()
+    if st.session_state.editor_source is not st.session_state.parsed_data:
+        st.session_state.editor_df = build_editor_frame(st.session_state.parsed_data, masters['item_settings'])
+        st.session_state.editor_source = st.session_state.parsed_data
+    editor_df = st.session_state.editor_df
+    
+    # 店舗ごとの合計
+    with st.expander(f"🏪 店舗ごとの合計（{editor_df['店舗名'].nunique()}店舗・{len(editor_df)}行）"):
+        st.dataframe(store_totals(editor_df), use_container_width=True, hide_index=True)
+    
+    # 店舗で絞り込み、ページごとに表示（大量の行を一度に描画しない）
+    store_options = ["（すべて）"] + list(dict.fromkeys(editor_df['店舗名']))
+    if st.session_state.get("editor_store") not in store_options:
+        st.session_state["editor_store"] = "（すべて）"  # 編集で店舗がなくなった場合
+    col_store, col_page = st.columns([3, 1])
+    with col_store:
+        editor_store = st.selectbox(
+            "店舗で絞り込み", store_options, key="editor_store",
+            on_change=lambda: st.session_state.update(editor_page=1)  # 店舗を切り替えたら1ページ目から
+        )
+    view_df = editor_df if editor_store == "（すべて）" else editor_df[editor_df['店舗名'] == editor_store]
+    page_count = max(1, (len(view_df) + EDITOR_ROWS_PER_PAGE - 1) // EDITOR_ROWS_PER_PAGE)
+    if st.session_state.get("editor_page", 1) > page_count:
+        st.session_state["editor_page"] = page_count  # 編集で行数が減った場合
+    with col_page:
+        editor_page = st.number_input("ページ", min_value=1, max_value=page_count, step=1, key="editor_page")
+    page_start = (editor_page - 1) * EDITOR_ROWS_PER_PAGE
+    page_df = view_df.iloc[page_start:page_start + EDITOR_ROWS_PER_PAGE]
+    if page_count > 1:
+        st.caption(f"{len(view_df)}行中 {page_start + 1}〜{page_start + len(page_df)}行目（{editor_page}/{page_count}ページ）")
+    
+    # データエディタ（表を更新するたびにキーを変え、反映済みの編集が再適用されないようにする）
     edited_df = st.data_editor(
-        df,
+        page_df,
         use_container_width=True,
         num_rows="dynamic",
+        key=f"order_editor_{st.session_state.editor_version}_{editor_store}_{editor_page}",
         column_config={
             '店舗名': st.column_config.SelectboxColumn(
                 '店舗名',
                 help='店舗名を選択してください',
-                options=get_known_stores(),
+                options=masters['stores'],
                 required=True
             ),
             '品目': st.column_config.TextColumn('品目', required=True),
@@ -1034,15 +1127,16 @@ if st.session_state.parsed_data:
         }
     )
     
-    # 編集後のデータを更新
-    edited_df['合計数量'] = edited_df['入数(unit)'] * edited_df['箱数(boxes)'] + edited_df['端数(remainder)']
-    
-    # データが変更されたかチェック
-    df_for_compare = df.drop(columns=['合計数量'])
-    edited_df_for_compare = edited_df.drop(columns=['合計数量'])
-    if not df_for_compare.equals(edited_df_for_compare):
-        updated_data = []
-        for _, row in edited_df.iterrows():
+    # 変更された行だけ正規化・入数マスターへの反映を行い、保持している表に書き戻す
+    compare_columns = [column for column in EDITOR_COLUMNS if column != '合計数量']
+    changed_rows = changed_editor_rows(page_df, edited_df, compare_columns)
+    removed_rows = page_df.index.difference(edited_df.index)
+    if changed_rows or len(removed_rows):
+        editor_df = editor_df.drop(index=removed_rows)
+        next_row_id = int(st.session_state.editor_df.index.max()) + 1 if len(st.session_state.editor_df) else 0
+        unit_updates = []
+        for idx in changed_rows:
+            row = edited_df.loc[idx]
             normalized_item = normalize_item_name(row['品目'])
             validated_store = validate_store_name(row['店舗名']) or row['店舗名']
             try:
@@ -1053,19 +1147,29 @@ if st.session_state.parsed_data:
                     spec_value = str(spec_value).strip()
             except (KeyError, TypeError):
                 spec_value = ''
-            unit_val = int(row['入数(unit)'])
+            unit_val = editor_int(row['入数(unit)'])
+            boxes_val = editor_int(row['箱数(boxes)'])
+            remainder_val = editor_int(row['端数(remainder)'])
             if unit_val > 0:
-                set_unit(normalized_item or row['品目'], spec_value, validated_store, unit_val)
-            updated_data.append({
-                'store': validated_store,
-                'item': normalized_item,
-                'spec': spec_value,
-                'unit': unit_val,
-                'boxes': int(row['箱数(boxes)']),
-                'remainder': int(row['端数(remainder)'])
-            })
+                unit_updates.append((normalized_item or row['品目'], spec_value, validated_store, unit_val))
+            # 追加された行は、他のページの行と重ならない新しい番号で末尾に追加
+            if idx not in page_df.index:
+                idx, next_row_id = next_row_id, next_row_id + 1
+            editor_df.loc[idx, EDITOR_COLUMNS] = [
+                validated_store, normalized_item, spec_value,
+                unit_val, boxes_val, remainder_val, unit_val * boxes_val + remainder_val
+            ]
+        # 入数マスターへの反映は変更された行の分をまとめて1回で保存
+        set_units(unit_updates)
+        editor_df = editor_df.astype(EDITOR_DTYPES)
+        updated_data = editor_frame_to_orders(editor_df)
+        st.session_state.editor_df = editor_df
+        st.session_state.editor_source = updated_data
+        st.session_state.editor_version += 1
         st.session_state.parsed_data = updated_data
-        st.info("✅ データを更新しました。入数マスターにも反映済み。PDFを生成する場合は下のボタンを押してください。")
+        # 新しいキーのデータエディタで描画し直す（古いエディタが残ると次の編集が失われる）
+        st.session_state.editor_saved = True
+        st.rerun()
     st.divider()
     
     # ラベル生成
@@ -1091,57 +1195,157 @@ if st.session_state.labels and st.session_state.parsed_data:
     st.markdown("---")
     st.header("📄 PDF生成")
     
+    # ラベル用紙（面付け）の選択
+    label_layout = st.selectbox(
+        "ラベル用紙",
+        list(LABEL_LAYOUTS),
+        format_func=lambda name: LABEL_LAYOUTS[name].description,
+        key="label_layout"
+    )
+    
+    # 同じ内容（解析データ・ラベル・出荷日・用紙・マスター）で生成済みなら、検証・描画をやり直さずに再利用
+    pdf_request_key = make_pdf_request_key(label_layout)
+    
     if st.button("🖨️ PDFを生成", type="primary", use_container_width=True, key="pdf_gen_main"):
-        try:
-            # 最終的な検証
-            final_data = validate_and_fix_order_data(st.session_state.parsed_data)
-            
-            # 一時ファイルにPDFを生成
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                pdf_path = tmp_file.name
+        pdf_result = st.session_state.pdf_result
+        if not pdf_result or pdf_result['key'] != pdf_request_key:
+            try:
+                # 最終的な検証
+                final_data = validate_and_fix_order_data(st.session_state.parsed_data)
+                # 検証での自動学習でマスターが更新された場合は、更新後のマスターで生成したものとして記録
+                pdf_request_key = make_pdf_request_key(label_layout)
                 
-                # 出荷一覧表データを生成
-                summary_data = generate_summary_table(final_data)
+                # 出荷一覧表・LINE用集計・総数を1回の集計から作る
+                totals = aggregate_orders(final_data)
+                summary_data = generate_summary_table(totals)
                 
-                generator = LabelPDFGenerator()
-                generator.generate_pdf(
+                # PDFをメモリ上で生成（一時ファイルを使わない、同じ内容ならキャッシュから返す）
+                generator = get_label_generator(label_layout)
+                pdf_bytes = generator.render_bytes(
                     st.session_state.labels,
                     summary_data,
                     st.session_state.shipment_date,
-                    pdf_path
-                )
-                
-                # PDFファイルを読み込んでダウンロードボタンを表示
-                with open(pdf_path, 'rb') as f:
-                    pdf_bytes = f.read()
-                
-                st.download_button(
-                    label="📥 PDFをダウンロード (一覧表付き)",
-                    data=pdf_bytes,
-                    file_name=f"出荷ラベル_{st.session_state.shipment_date.replace('-', '')}.pdf",
-                    mime="application/pdf"
+                    workers=PDF_RENDER_WORKERS,
+                    cache=PDF_CACHE
                 )
                 
-                # 一時ファイルを削除
-                try:
-                    os.unlink(pdf_path)
-                except (PermissionError, OSError):
-                    pass
-                
-                st.success("✅ PDFが生成されました！")
+                st.session_state.pdf_result = {
+                    'key': pdf_request_key,
+                    'pdf_bytes': pdf_bytes,
+                    'summary_data': summary_data,  # 店舗別PDF（ZIP）の生成用
+                    'line_text': generate_line_summary(totals),
+                }
             
-            # LINE用集計の表示
-            st.subheader("📋 LINE用集計（コピー用）")
-            line_text = generate_line_summary(final_data)
-            st.code(line_text, language="text")
-            st.write("↑ タップしてコピーし、LINEに貼り付けてください。")
+            except Exception as e:
+                st.error("❌ PDF生成エラーが発生しました")
+                st.error(f"エラー詳細: {str(e)}")
+                with st.expander("🔍 詳細なエラー情報（開発者用）"):
+                    st.code(traceback.format_exc(), language="python")
+                st.info("💡 解決方法: データを確認し、数値が正しく入力されているか確認してください。")
+    
+    # 生成済みのPDFは再実行後もダウンロードボタンを表示し続ける（内容が変わったら消える）
+    pdf_result = st.session_state.pdf_result
+    if pdf_result and pdf_result['key'] == pdf_request_key:
+        st.download_button(
+            label="📥 PDFをダウンロード (一覧表付き)",
+            data=pdf_result['pdf_bytes'],
+            file_name=f"出荷ラベル_{st.session_state.shipment_date.replace('-', '')}.pdf",
+            mime="application/pdf"
+        )
+        
+        # 店舗ごとのPDF（店舗別の出荷一覧表 + ラベル）のZIPは、必要なときだけボタンで生成する
+        if st.button("🗂️ 店舗別PDF (ZIP) を作成", key="store_zip_gen"):
+            try:
+                store_zip_bytes = get_label_generator(label_layout).render_store_zip(
+                    st.session_state.labels,
+                    pdf_result['summary_data'],
+                    st.session_state.shipment_date,
+                    workers=PDF_RENDER_WORKERS,
+                    cache=PDF_CACHE
+                )
+                st.session_state.store_zip_result = {'key': pdf_request_key, 'zip_bytes': store_zip_bytes}
+            except Exception as e:
+                st.error(f"❌ 店舗別PDFの生成エラー: {e}")
+        store_zip_result = st.session_state.store_zip_result
+        if store_zip_result and store_zip_result['key'] == pdf_request_key:
+            st.download_button(
+                label="🗂️ 店舗別PDFをダウンロード (ZIP)",
+                data=store_zip_result['zip_bytes'],
+                file_name=f"出荷ラベル_店舗別_{st.session_state.shipment_date.replace('-', '')}.zip",
+                mime="application/zip"
+            )
         
-        except Exception as e:
-            st.error(f"❌ PDF生成エラーが発生しました")
-            st.error(f"エラー詳細: {str(e)}")
-            with st.expander("🔍 詳細なエラー情報（開発者用）"):
-                st.code(traceback.format_exc(), language="python")
-            st.info("💡 解決方法: データを確認し、数値が正しく入力されているか確認してください。")
+        st.success("✅ PDFが生成されました！")
+        
+        # LINE用集計の表示
+        st.subheader("📋 LINE用集計（コピー用）")
+        st.code(pdf_result['line_text'], language="text")
+        st.write("↑ タップしてコピーし、LINEに貼り付けてください。")
+    
+    # 再印刷（紙詰まり等で一部のページ・ラベルだけ刷り直す）
+    with st.expander("🔁 一部だけ再印刷（ページ・店舗・品目を指定）"):
+        st.caption("全体を生成した場合と同じ配置で出力するので、刷り直したシートもそのまま重ねられます。")
+        reprint_labels = st.session_state.labels
+        reprint_pages_text = st.text_input(
+            "ラベルのページ番号（出荷一覧表のページを除いて1から。例: 7 / 3-5 / 1,4,9-11）",
+            key="reprint_pages"
+        )
+        # 選択肢は注文行から作る（箱ごとのラベルを全件たどらない）
+        reprint_stores = sorted({line.store for line in reprint_labels.lines if line.store})
+        reprint_items = sorted({line.item for line in reprint_labels.lines if line.item})
+        col_store, col_item = st.columns(2)
+        with col_store:
+            reprint_store = st.selectbox("店舗", ["（すべて）"] + reprint_stores, key="reprint_store")
+        with col_item:
+            reprint_item = st.selectbox("品目", ["（すべて）"] + reprint_items, key="reprint_item")
+        col_from, col_to = st.columns(2)
+        with col_from:
+            reprint_box_from = st.number_input("箱番号（から）", min_value=0, value=0, step=1, key="reprint_box_from",
+                                               help="0の場合は指定なし")
+        with col_to:
+            reprint_box_to = st.number_input("箱番号（まで）", min_value=0, value=0, step=1, key="reprint_box_to",
+                                             help="0の場合は指定なし")
+        reprint_summary = st.checkbox("出荷一覧表も含める", value=False, key="reprint_summary")
+        # 同じ注文・用紙・指定なら生成済みの再印刷用PDFを表示し続ける
+        reprint_request_key = (pdf_request_key, reprint_pages_text.strip(), reprint_store, reprint_item,
+                               int(reprint_box_from), int(reprint_box_to), reprint_summary)
+        
+        if st.button("🖨️ 再印刷用PDFを生成", key="reprint_pdf"):
+            try:
+                reprint_pages = parse_page_ranges(reprint_pages_text) if reprint_pages_text.strip() else None
+                use_filter = (reprint_store != "（すべて）" or reprint_item != "（すべて）" or
+                              reprint_box_from > 0 or reprint_box_to > 0)
+                label_filter = make_label_filter(
+                    store=reprint_store if reprint_store != "（すべて）" else None,
+                    item=reprint_item if reprint_item != "（すべて）" else None,
+                    box_from=int(reprint_box_from) if reprint_box_from > 0 else None,
+                    box_to=int(reprint_box_to) if reprint_box_to > 0 else None,
+                ) if use_filter else None
+                if reprint_pages is None and label_filter is None:
+                    st.warning("⚠️ ページ番号か、店舗・品目・箱番号のいずれかを指定してください。")
+                else:
+                    final_data = validate_and_fix_order_data(st.session_state.parsed_data)
+                    reprint_bytes = get_label_generator(label_layout).render_bytes(
+                        reprint_labels,
+                        generate_summary_table(aggregate_orders(final_data)),
+                        st.session_state.shipment_date,
+                        pages=reprint_pages,
+                        label_filter=label_filter,
+                        include_summary=reprint_summary
+                    )
+                    st.session_state.reprint_result = {'key': reprint_request_key, 'pdf_bytes': reprint_bytes}
+            except ValueError as e:
+                st.error(f"❌ {e}")
+        
+        reprint_result = st.session_state.reprint_result
+        if reprint_result and reprint_result['key'] == reprint_request_key:
+            st.download_button(
+                label="📥 再印刷用PDFをダウンロード",
+                data=reprint_result['pdf_bytes'],
+                file_name=f"出荷ラベル_再印刷_{st.session_state.shipment_date.replace('-', '')}.pdf",
+                mime="application/pdf",
+                key="reprint_download"
+            )
 
 # フッター
 st.markdown("---")
@@ -0,0 +1,155 @@
+"""
+ラベルPDFの並列描画（generate_pdf の workers）のベンチマーク
+ラベル枚数・プロセス数ごとに1プロセス描画と比べ、処理時間とPDFのサイズを表示する
+（LabelPDFGenerator.PARALLEL_MIN_LABELS はこの結果から決める）
+計測の前に、並列描画で結合したPDF・店舗別ZIPの各PDFが1プロセスの出力とページごとに一致するか確認する
+（ページ数・用紙サイズ・各ページの文字。チャンクごとにフォントを埋め込むためバイト列は比べない）
+
+使い方:
+    python benchmarks/bench_parallel_pdf.py [ラベル枚数 ...]
+"""
+import io
+import os
+import random
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pypdf import PdfReader
+
+from label_records import LabelLine, LabelList
+from pdf_generator import LabelPDFGenerator
+
+STORES = ["鎌ケ谷", "五香", "八柱", "青葉台", "咲が丘", "習志野台", "八千代台", "新鎌ケ谷駅前"]
+ITEMS = [("胡瓜", "", 30, "袋"), ("胡瓜バラ", "", 100, "本"), ("長ネギ", "", 50, "本"),
+         ("春菊", "", 30, "袋"), ("青梗菜", "", 20, "袋"), ("胡瓜", "3本P", 30, "袋")]
+SHIPMENT_DATE = "2025-02-10"
+CHECK_LABELS = 600  # 出力を照合するラベル枚数（文字の抽出が遅いため計測より少なくする）
+
+
+def build_labels(count: int, seed: int = 1) -> LabelList:
+    """店舗×品目の注文行を、ラベルが count 枚以上になるまで作る"""
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < count:
+        store = rng.choice(STORES)
+        item, spec, unit, unit_label = rng.choice(ITEMS)
+        boxes = rng.randint(1, 8)
+        remainder = rng.choice([0, 0, rng.randint(1, unit - 1)])
+        line = LabelLine(store, item, spec, unit, boxes, remainder, unit_label, "2月10日")
+        lines.append(line)
+        total += line.box_total
+    return LabelList(lines)
+
+
+def build_summary(labels: LabelList) -> list:
+    """出荷一覧表用のデータ（店舗×品目ごと）"""
+    summary = []
+    for line in labels.lines:
+        summary.append({
+            'store': line.store, 'item': line.item, 'spec': line.spec,
+            'boxes': line.boxes, 'rem_box': 1 if line.remainder > 0 else 0,
+            'total_packs': line.box_total, 'total_quantity': line.unit * line.boxes + line.remainder,
+            'unit': line.unit, 'unit_label': line.unit_label,
+        })
+    return summary
+
+
+def render(generator: LabelPDFGenerator, labels, summary, workers: int):
+    """PDFを描画して (秒, バイト数) を返す"""
+    buffer = io.BytesIO()
+    start = time.perf_counter()
+    generator.generate_pdf(labels, summary, SHIPMENT_DATE, buffer, workers=workers)
+    return time.perf_counter() - start, len(buffer.getvalue())
+
+
+def page_contents(pdf_bytes: bytes) -> list:
+    """PDFの各ページの (用紙サイズ, 文字) のリスト"""
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    return [(tuple(float(v) for v in page.mediabox), page.extract_text()) for page in reader.pages]
+
+
+def check_parallel_output(generator: LabelPDFGenerator, labels, summary, workers: int) -> list:
+    """並列描画の結合結果を1プロセスの出力とページごとに比べ、一致しないページ番号（1から）を返す"""
+    serial = page_contents(generator.render_bytes(labels, summary, SHIPMENT_DATE))
+    parallel = page_contents(generator.render_bytes(labels, summary, SHIPMENT_DATE, workers=workers))
+    if len(serial) != len(parallel):
+        print(f"ページ数が一致しません: 1プロセス {len(serial)} / {workers}プロセス {len(parallel)}")
+    return mismatched_pages(serial, parallel)
+
+
+def mismatched_pages(serial: list, parallel: list) -> list:
+    """page_contents の結果を比べ、一致しないページ番号（1から）を返す"""
+    return [i + 1 for i in range(max(len(serial), len(parallel)))
+            if i >= len(serial) or i >= len(parallel) or serial[i] != parallel[i]]
+
+
+def check_parallel_zip(generator: LabelPDFGenerator, labels, summary, workers: int) -> dict:
+    """店舗別ZIPを並列生成した結果を1プロセスの結果と比べ、{ファイル名: 一致しないページ番号} を返す"""
+    archives = []
+    for w in (1, workers):
+        with zipfile.ZipFile(io.BytesIO(generator.render_store_zip(labels, summary, SHIPMENT_DATE, workers=w))) as zf:
+            archives.append({name: page_contents(zf.read(name)) for name in zf.namelist()})
+    serial, parallel = archives
+    if list(serial) != list(parallel):
+        print(f"ZIPのファイルが一致しません: 1プロセス {list(serial)} / {workers}プロセス {list(parallel)}")
+    mismatched = {}
+    for name in dict.fromkeys(list(serial) + list(parallel)):
+        pages = mismatched_pages(serial.get(name, []), parallel.get(name, []))
+        if pages:
+            mismatched[name] = pages
+    return mismatched
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [400, 1100, 3000, 10000]
+    cpu_count = os.cpu_count() or 1
+    worker_counts = sorted({2, 4, cpu_count} - {1})
+
+    # 閾値に関係なく並列描画を試す
+    generator = LabelPDFGenerator(parallel_min_labels=0)
+    # フォントの登録などの初回コストを除く
+    warmup = build_labels(10)
+    render(generator, warmup, build_summary(warmup), 1)
+
+    print(f"CPU: {cpu_count}コア / フォント: {generator._get_font_name()}")
+    check_labels = build_labels(CHECK_LABELS)
+    check_summary = build_summary(check_labels)
+    mismatched = {}
+    for workers in worker_counts:
+        pages = check_parallel_output(generator, check_labels, check_summary, workers)
+        if pages:
+            mismatched[workers] = pages
+        print(f"照合 {len(check_labels)}枚 {workers}プロセス: {'不一致 ' + str(pages) if pages else '一致'}")
+        zip_pages = check_parallel_zip(generator, check_labels, check_summary, workers)
+        if zip_pages:
+            mismatched[f"zip-{workers}"] = zip_pages
+        print(f"照合 店舗別ZIP {workers}プロセス: {'不一致 ' + str(zip_pages) if zip_pages else '一致'}")
+    if mismatched:
+        sys.exit("並列描画の出力が1プロセスの出力と一致しません")
+
+    print(f"{'ラベル':>7} {'プロセス':>7} {'時間(秒)':>9} {'対1プロセス':>10} {'サイズ(MB)':>10}")
+    fastest_parallel = None
+    for count in counts:
+        labels = build_labels(count)
+        summary = build_summary(labels)
+        serial_time, serial_size = render(generator, labels, summary, 1)
+        print(f"{len(labels):>7} {1:>7} {serial_time:>9.2f} {1.0:>10.2f} {serial_size / 1e6:>10.2f}")
+        for workers in worker_counts:
+            parallel_time, parallel_size = render(generator, labels, summary, workers)
+            print(f"{len(labels):>7} {workers:>7} {parallel_time:>9.2f} "
+                  f"{serial_time / parallel_time:>10.2f} {parallel_size / 1e6:>10.2f}")
+            if parallel_time < serial_time and fastest_parallel is None:
+                fastest_parallel = len(labels)
+
+    if fastest_parallel is None:
+        print("並列描画が1プロセスより速くなる枚数はありませんでした")
+    else:
+        print(f"並列描画が1プロセスより速くなった最小の枚数: {fastest_parallel}")
+
+
+if __name__ == '__main__':
+    main()
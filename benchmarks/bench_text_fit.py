@@ -0,0 +1,95 @@
+"""
+テキストのフィッティング（_draw_text_in_quadrant）のマイクロベンチマーク
+約600枚分の現実的なラベルで、従来の1ptずつ縮小する方式と fit_text を比較する
+
+使い方:
+    python benchmarks/bench_text_fit.py [ラベル枚数]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.pdfbase import pdfmetrics
+
+import pdf_generator
+from pdf_generator import LabelPDFGenerator, fit_text
+
+STORES = ["鎌ケ谷", "五香", "八柱", "青葉台", "咲が丘", "習志野台", "八千代台", "新鎌ケ谷駅前"]
+ITEMS = [("胡瓜", 30, "袋"), ("胡瓜バラ", 100, "本"), ("長ネギ", 50, "本"),
+         ("春菊", 30, "袋"), ("青梗菜", 20, "袋"), ("胡瓜 3本P", 30, "袋")]
+
+
+def build_labels(count: int, seed: int = 1) -> list:
+    """店舗×品目の組み合わせで、口数・入り数つきのラベルを作る"""
+    rng = random.Random(seed)
+    labels = []
+    while len(labels) < count:
+        store = rng.choice(STORES)
+        item, unit, unit_label = rng.choice(ITEMS)
+        boxes = rng.randint(1, 8)
+        remainder = rng.choice([0, 0, rng.randint(1, unit - 1)])
+        total_boxes = boxes + (1 if remainder > 0 else 0)
+        for i in range(total_boxes):
+            quantity = remainder if i == boxes else unit
+            labels.append({
+                'store': store,
+                'item': item,
+                'sequence': f"{i+1}/{total_boxes}",
+                'quantity': f"{quantity}{unit_label}",
+            })
+    return labels[:count]
+
+
+def legacy_fit(text, font_name, max_font_size, box_width, box_height):
+    """従来の方式（1ptずつ縮小しながら毎回文字幅を計算）"""
+    font_size = max_font_size
+    text_width = pdfmetrics.stringWidth(text, font_name, font_size)
+    text_height = font_size * 0.7
+    while (text_width > box_width * 0.9 or
+           text_height > box_height * 0.9) and font_size > 8:
+        font_size -= 1
+        text_width = pdfmetrics.stringWidth(text, font_name, font_size)
+        text_height = font_size * 0.7
+    return font_size, text_width, text_height
+
+
+def run(fit, labels, font_name, q_width, q_height) -> list:
+    """1ラベルあたり4領域分のフィッティングを実行"""
+    results = []
+    for label in labels:
+        results.append(fit(label['store'], font_name, 50, q_width, q_height))
+        results.append(fit(label['sequence'], font_name, 40, q_width, q_height))
+        results.append(fit(label['item'], font_name, 50, q_width, q_height))
+        results.append(fit(label['quantity'], font_name, 30, q_width, q_height))
+    return results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    generator = LabelPDFGenerator()
+    font_name = generator._get_font_name()
+    q_width = generator.LABEL_WIDTH / 2
+    q_height = generator.LABEL_HEIGHT / 2
+    labels = build_labels(count)
+
+    start = time.perf_counter()
+    expected = run(legacy_fit, labels, font_name, q_width, q_height)
+    legacy_time = time.perf_counter() - start
+
+    pdf_generator._text_fit_cache.clear()
+    start = time.perf_counter()
+    actual = run(fit_text, labels, font_name, q_width, q_height)
+    fit_time = time.perf_counter() - start
+
+    assert actual == expected, "fit_text の結果が従来の方式と一致しません"
+    print(f"フォント: {font_name} / ラベル: {len(labels)}枚 ({len(labels) * 4}回)")
+    print(f"従来（1ptずつ縮小）: {legacy_time * 1000:.1f} ms")
+    print(f"fit_text（直接計算+メモ）: {fit_time * 1000:.1f} ms")
+    print(f"高速化: {legacy_time / fit_time:.1f}倍")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@
 """
 import json
 import os
+from contextlib import contextmanager
 from pathlib import Path
 from typing import List, Dict, Optional
 
@@ -12,6 +13,8 @@ STORES_FILE = CONFIG_DIR / "stores.json"
 ITEMS_FILE = CONFIG_DIR / "items.json"
 UNITS_FILE = CONFIG_DIR / "units.json"  # 入数マスター: 品目|規格|店舗 → 入数
 ITEM_SETTINGS_FILE = CONFIG_DIR / "item_settings.json"  # 品目設定: 品目 → {default_unit, unit_type}
+SCHEMA_FILE = CONFIG_DIR / "schema.json"  # マスターのスキーマバージョン（実行済みの移行の番号）
+MIGRATION_LOCK_FILE = CONFIG_DIR / ".migration.lock"  # 移行を複数のプロセスで同時に実行しないためのロック
 
 # デフォルト値
 DEFAULT_STORES = ["鎌ケ谷", "五香", "八柱", "青葉台", "咲が丘", "習志野台", "八千代台"]
@@ -27,10 +30,79 @@ DEFAULT_ITEMS = {
 }
 
 
+# マスターを保存するたびに増える番号（同じプロセス内の変更を更新時刻の精度によらず検知する）
+_master_revision = 0
+
+# マスターが変更されたときに呼ぶ関数（名前 → 関数、キャッシュの破棄などに使う）
+_master_change_hooks = {}
+
+# ファイルから作った検索用の索引（ファイル → (バージョン, 索引)、ファイルが変わるまで読み直さない）
+_index_cache = {}
+
+
 def ensure_config_dir():
     """設定ディレクトリが存在することを確認"""
     CONFIG_DIR.mkdir(exist_ok=True)
 
+def on_master_change(name: str, callback) -> None:
+    """
+    マスターが保存されたときに呼ぶ関数を登録（同じ名前で登録し直すと置き換える）
+    
+    Args:
+        name: 登録名（Streamlitの再実行ごとに登録しても重複しないように）
+        callback: 引数なしの関数
+    """
+    _master_change_hooks[name] = callback
+
+
+def _bump_master_revision():
+    """マスターの変更を記録し、登録された関数を呼ぶ"""
+    global _master_revision
+    _master_revision += 1
+    for callback in list(_master_change_hooks.values()):
+        callback()
+
+
+def master_version() -> tuple:
+    """
+    マスター（店舗・品目・入数・品目設定）のバージョン
+    保存回数と各ファイルの更新時刻・サイズの組（別プロセスでの変更も検知する）
+    """
+    stats = []
+    for path in (STORES_FILE, ITEMS_FILE, UNITS_FILE, ITEM_SETTINGS_FILE):
+        try:
+            stat = path.stat()
+            stats.append((path.name, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stats.append((path.name, None, None))
+    return (_master_revision, tuple(stats))
+
+def _file_token(path: Path) -> tuple:
+    """索引のバージョン（保存回数とファイルの更新時刻・サイズ）"""
+    try:
+        stat = path.stat()
+        return (_master_revision, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return (_master_revision, None, None)
+
+
+def _cached_index(path: Path, build):
+    """
+    ファイルから作った索引を取得（ファイルが変わっていなければ前回の索引を返す）
+    
+    Args:
+        path: 索引の元になるファイル
+        build: 索引を作る関数（引数なし）
+    """
+    token = _file_token(path)
+    cached = _index_cache.get(path)
+    if cached is not None and cached[0] == token:
+        return cached[1]
+    index = build()
+    # 作る途中でファイルが保存されることがあるため、バージョンは作った後に取り直す
+    _index_cache[path] = (_file_token(path), index)
+    return index
+
 def load_stores() -> List[str]:
     """店舗名リストを読み込む"""
     ensure_config_dir()
@@ -51,6 +123,7 @@ def save_stores(stores: List[str]):
     ensure_config_dir()
     with open(STORES_FILE, 'w', encoding='utf-8') as f:
         json.dump({'stores': stores}, f, ensure_ascii=False, indent=2)
+    _bump_master_revision()
 
 def add_store(store_name: str) -> bool:
     """新しい店舗名を追加"""
@@ -93,6 +166,7 @@ def save_items(items: Dict[str, List[str]]):
     ensure_config_dir()
     with open(ITEMS_FILE, 'w', encoding='utf-8') as f:
         json.dump(items, f, ensure_ascii=False, indent=2)
+    _bump_master_revision()
 
 def add_item_variant(normalized_name: str, variant: str):
     """品目のバリアント（表記ゆれ）を追加"""
@@ -156,13 +230,18 @@ def auto_learn_item(item_name: str) -> str:
 # 入数マスター（柔軟に編集可能、GASの入数マスターと同様の役割）
 # - 編集した入数は次回解析時に反映され、合計数量の自動計算に使用されます
 # - GASの入数マスターと同期する場合は、スプレッドシートからCSV出力して units.json に手動反映
+# - 入数は 品目|規格|店舗 → 品目|規格|（全店舗共通）→ 品目設定のデフォルト入数 の順に探す
+#   （units.json には上位と違う入数だけを保存し、店舗が増えてもファイルは大きくならない）
 # ==========================================
 
+def _units_part(value: str) -> str:
+    """入数マスターのキーの各部分（前後の空白・途中の空白を除く）"""
+    return (value or "").strip().replace(" ", "")
+
+
 def _units_key(item: str, spec: str, store: str) -> str:
     """入数マスター用のキー生成"""
-    def n(v):
-        return (v or "").strip().replace(" ", "")
-    return f"{n(item)}|{n(spec)}|{n(store)}"
+    return f"{_units_part(item)}|{_units_part(spec)}|{_units_part(store)}"
 
 
 def load_units() -> Dict[str, int]:
@@ -185,19 +264,47 @@ def save_units(units: Dict[str, int]):
     ensure_config_dir()
     with open(UNITS_FILE, 'w', encoding='utf-8') as f:
         json.dump(units, f, ensure_ascii=False, indent=2)
+    _bump_master_revision()
+
+
+def _units_index() -> Dict[str, int]:
+    """入数マスターの索引（読み取り専用、units.json が変わるまで読み直さない）"""
+    return _cached_index(UNITS_FILE, load_units)
+
+
+def _default_units_index() -> Dict[str, int]:
+    """品目 → 品目設定のデフォルト入数の索引（読み取り専用）"""
+    def build():
+        return {
+            _units_part(item): int(setting.get("default_unit") or 0)
+            for item, setting in load_item_settings().items()
+        }
+    return _cached_index(ITEM_SETTINGS_FILE, build)
+
+
+def _inherited_unit(units: Dict[str, int], item: str, spec: str, store: str) -> int:
+    """店舗ごとの入数がない場合に使われる入数（全店舗共通 → 品目設定のデフォルト、0ならなし）"""
+    if _units_part(store):
+        common = units.get(_units_key(item, spec, ""))
+        if common:
+            return common
+    return _default_units_index().get(_units_part(item), 0)
 
 
 def lookup_unit(item: str, spec: str, store: str) -> int:
-    """入数マスターから入数を検索（0なら未登録）"""
-    units = load_units()
-    key = _units_key(item, spec, store)
-    return units.get(key, 0)
+    """
+    入数を検索（品目|規格|店舗 → 品目|規格|（全店舗共通）→ 品目設定のデフォルト入数、0なら未登録）
+    """
+    units = _units_index()
+    return units.get(_units_key(item, spec, store)) or _inherited_unit(units, item, spec, store)
 
 
 def add_unit_if_new(item: str, spec: str, store: str, unit: int) -> bool:
-    """入数マスターに登録（既存なら上書きしない、新規のみ追加）"""
+    """入数マスターに登録（既存なら上書きしない、上位の入数と同じなら登録しない）"""
     if unit <= 0:
         return False
+    if lookup_unit(item, spec, store) == unit:
+        return False  # 店舗ごと・全店舗共通・品目設定のいずれかで同じ入数になる
     units = load_units()
     key = _units_key(item, spec, store)
     if key in units:
@@ -207,18 +314,51 @@ def add_unit_if_new(item: str, spec: str, store: str, unit: int) -> bool:
     return True
 
 
+def _put_unit(units: Dict[str, int], item: str, spec: str, store: str, unit: int) -> bool:
+    """
+    入数マスター（dict）の入数を設定（上位の入数と同じなら店舗ごとの入数は削除）
+    
+    Returns:
+        units を変更したか
+    """
+    key = _units_key(item, spec, store)
+    if unit == _inherited_unit(units, item, spec, store):
+        return units.pop(key, None) is not None
+    if units.get(key) == unit:
+        return False
+    units[key] = unit
+    return True
+
+
 def set_unit(item: str, spec: str, store: str, unit: int) -> None:
     """入数マスターの入数を設定（既存は上書き＝柔軟に変えられる）"""
     if unit <= 0:
         return
     units = load_units()
-    key = _units_key(item, spec, store)
-    units[key] = unit
-    save_units(units)
+    if _put_unit(units, item, spec, store, unit):
+        save_units(units)
+
+
+def set_units(entries: List[tuple]) -> None:
+    """入数マスターの入数をまとめて設定（(品目, 規格, 店舗, 入数) のリスト、保存は1回だけ）"""
+    if not entries:
+        return
+    units = load_units()
+    updated = False
+    for item, spec, store, unit in entries:
+        if unit <= 0:
+            continue
+        if _put_unit(units, item, spec, store, unit):
+            updated = True
+    if updated:
+        save_units(units)
 
 
 def initialize_default_units():
-    """デフォルト入数を初期化（全店舗共通のデフォルト値）"""
+    """
+    デフォルト入数を初期化（全店舗共通のデフォルト値）
+    実行済みの移行 v1 の処理のため変更しない（展開した入数は v2 で上位と同じものが削除される）
+    """
     units = load_units()
     updated = False
     
@@ -281,8 +421,9 @@ def load_item_settings() -> Dict[str, Dict[str, any]]:
                             **merged[key],
                             "receive_as_boxes": merged[key].get("receive_as_boxes", DEFAULT_ITEM_SETTINGS.get(key, {}).get("receive_as_boxes", False)),
                         }
-                    # マージした結果を保存（デフォルト値が確実に含まれる）
-                    save_item_settings(merged)
+                    # マージした結果を保存（デフォルト値が確実に含まれる、変わらなければ書き込まない）
+                    if merged != data:
+                        save_item_settings(merged)
                     return merged
                 return DEFAULT_ITEM_SETTINGS.copy()
         except Exception:
@@ -300,11 +441,19 @@ def save_item_settings(settings: Dict[str, Dict[str, any]]):
     ensure_config_dir()
     with open(ITEM_SETTINGS_FILE, 'w', encoding='utf-8') as f:
         json.dump(settings, f, ensure_ascii=False, indent=2)
+    _bump_master_revision()
 
 
-def get_item_setting(item: str) -> Dict[str, any]:
-    """品目の設定を取得（デフォルト値あり）"""
-    settings = load_item_settings()
+def get_item_setting(item: str, settings: Optional[Dict[str, Dict[str, any]]] = None) -> Dict[str, any]:
+    """
+    品目の設定を取得（デフォルト値あり）
+    
+    Args:
+        item: 品目名
+        settings: 読み込み済みの品目設定（Noneの場合はファイルから読み込む）
+    """
+    if settings is None:
+        settings = load_item_settings()
     if item in settings:
         s = settings[item].copy()
         s.setdefault("receive_as_boxes", False)
@@ -346,3 +495,102 @@ def remove_item_setting(item: str):
     if item in settings:
         del settings[item]
         save_item_settings(settings)
+
+
+# ==========================================
+# マスターの移行（スキーマバージョンごとに1回だけ実行）
+# - 実行済みのバージョンは schema.json に記録し、起動のたびにマスターを書き換えない
+# - 複数のプロセス（アプリ・メール監視）が同時に起動してもロックで1つだけが実行する
+# ==========================================
+
+@contextmanager
+def _file_lock(path: Path):
+    """ファイルによるプロセス間の排他ロック（Windowsは msvcrt、それ以外は fcntl）"""
+    ensure_config_dir()
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK は約10秒で諦めるため、取れるまで待ち直す
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def load_schema_version() -> int:
+    """実行済みの移行のバージョン（未記録なら0）"""
+    try:
+        with open(SCHEMA_FILE, 'r', encoding='utf-8') as f:
+            return int(json.load(f).get('version', 0))
+    except Exception:
+        return 0
+
+
+def _save_schema_version(version: int):
+    """実行済みの移行のバージョンを記録"""
+    ensure_config_dir()
+    with open(SCHEMA_FILE, 'w', encoding='utf-8') as f:
+        json.dump({'version': version}, f, ensure_ascii=False, indent=2)
+
+
+def _migrate_default_masters():
+    """v1: デフォルト入数・品目設定を登録（従来はセッションの開始ごとに行っていた初期化）"""
+    initialize_default_units()
+    # 品目設定はデフォルト値のマージと長ねぎ・長ねぎバラの50本をファイルに書き込む
+    load_item_settings()
+
+
+def _migrate_prune_units():
+    """v2: 入数マスターから上位（全店舗共通・品目設定）と同じ店舗ごとの入数を削除"""
+    units = load_units()
+    pruned = dict(units)
+    for key, unit in units.items():
+        item, spec, store = (key.split("|") + ["", ""])[:3]
+        if store and unit == _inherited_unit(pruned, item, spec, store):
+            del pruned[key]
+    if pruned != units:
+        save_units(pruned)
+
+
+# (バージョン, 移行処理) の一覧（バージョンの昇順、追加するときは末尾に。実行済みの移行は変更しない）
+MIGRATIONS = [
+    (1, _migrate_default_masters),
+    (2, _migrate_prune_units),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def run_migrations() -> List[int]:
+    """
+    未実行の移行を実行（実行済みならschema.jsonを読むだけ）
+    
+    Returns:
+        今回実行した移行のバージョンのリスト
+    """
+    if load_schema_version() >= SCHEMA_VERSION:
+        return []
+    applied = []
+    with _file_lock(MIGRATION_LOCK_FILE):
+        # ロックを待つ間に他のプロセスが移行した分は実行しない
+        version = load_schema_version()
+        for target, migrate in MIGRATIONS:
+            if target <= version:
+                continue
+            migrate()
+            _save_schema_version(target)
+            applied.append(target)
+    return applied
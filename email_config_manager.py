@@ -5,7 +5,7 @@
 import json
 import os
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
 CONFIG_DIR = Path("config")
 EMAIL_CONFIG_FILE = CONFIG_DIR / "email_config.json"
@@ -104,6 +104,85 @@ def save_email_config(imap_server: str, email_address: str, sender_email: str, d
         "days_back": days_back
         # パスワードは保存しない
     }
+    # 追加のメールボックス設定は保持する
+    profiles = load_email_profiles()
+    if profiles:
+        config["profiles"] = profiles
+    
+    with open(EMAIL_CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+
+# ==========================================
+# 複数メールボックス（プロファイル）
+# - 店舗ごとに送信元アドレスが違う、別のメールサービスを使う取引先がある場合に使用
+# - 各プロファイルは {name, email_address, imap_server, sender_emails, days_back}
+# ==========================================
+
+def _split_senders(value) -> List[str]:
+    """送信者フィルタをリストに正規化（カンマ・改行区切りの文字列も可）"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.replace("\n", ",").split(",")
+    return [str(v).strip() for v in value if str(v).strip()]
+
+
+def normalize_profile(profile: Dict) -> Dict:
+    """プロファイルの欠けている項目を補完（IMAPサーバーはアドレスから自動判定）"""
+    email_address = str(profile.get("email_address", "") or "").strip()
+    senders = _split_senders(profile.get("sender_emails"))
+    if not senders:
+        senders = _split_senders(profile.get("sender_email"))
+    return {
+        "name": str(profile.get("name", "") or "").strip() or email_address,
+        "email_address": email_address,
+        "imap_server": str(profile.get("imap_server", "") or "").strip() or detect_imap_server(email_address),
+        "sender_emails": senders,
+        "days_back": int(profile.get("days_back", 1) or 1),
+    }
+
+
+def load_email_profiles(st_secrets=None) -> List[Dict]:
+    """
+    追加のメールボックス設定（プロファイル）を読み込む（Secrets優先、次にファイル）
+    
+    Secretsの場合:
+        [[email.profiles]]
+        name = "本部"
+        email_address = "orders@example.com"
+        sender_emails = ["store1@example.com", "store2@example.com"]
+    """
+    profiles = []
+    if st_secrets is not None:
+        try:
+            profiles = list(st_secrets.get("email", {}).get("profiles", []) or [])
+        except Exception:
+            profiles = []
+    
+    if not profiles:
+        ensure_config_dir()
+        if EMAIL_CONFIG_FILE.exists():
+            try:
+                with open(EMAIL_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    profiles = json.load(f).get("profiles", []) or []
+            except Exception:
+                profiles = []
+    
+    return [normalize_profile(dict(p)) for p in profiles if p and p.get("email_address")]
+
+
+def save_email_profiles(profiles: List[Dict]):
+    """追加のメールボックス設定を保存（パスワードは保存しない、既存の設定は保持）"""
+    ensure_config_dir()
+    config = {}
+    if EMAIL_CONFIG_FILE.exists():
+        try:
+            with open(EMAIL_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except Exception:
+            config = {}
+    config["profiles"] = [normalize_profile(p) for p in profiles if p.get("email_address")]
     
     with open(EMAIL_CONFIG_FILE, 'w', encoding='utf-8') as f:
         json.dump(config, f, ensure_ascii=False, indent=2)
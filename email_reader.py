@@ -7,11 +7,279 @@ import email
 from email.header import decode_header
 from email.utils import parsedate_to_datetime
 import re
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from PIL import Image
 import io
+import os
+import queue
 import base64
+import hashlib
+import tempfile
+import weakref
+
+# この大きさを超える添付はメモリに保持せず一時ファイルへ退避する
+SPILL_THRESHOLD_BYTES = 1024 * 1024
+# プレビュー用サムネイルの最大サイズ（ピクセル）
+THUMBNAIL_SIZE = (480, 480)
+# 知覚ハッシュ（dHash）の一辺のサイズ（16 → 256ビット）
+DHASH_SIZE = 16
+# この距離（異なるビット数）以下なら同じFAXの再送・転送とみなす
+# 注文書は同じ書式で似通うため、誤統合を避けて小さめにしている
+DHASH_MAX_DISTANCE = 6
+# 立っているビットがこれ未満のハッシュ（ほぼ無地の画像）は近似一致の対象にしない
+DHASH_MIN_BITS = DHASH_SIZE
+
+
+def _remove_spill_file(path: str):
+    """退避した一時ファイルを削除（既に無ければ何もしない）"""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def make_thumbnail(image_data: bytes, size: Tuple[int, int] = THUMBNAIL_SIZE) -> bytes:
+    """画像データからプレビュー用の縮小PNGを作成"""
+    image = Image.open(io.BytesIO(image_data))
+    # JPEGはデコード時に縮小できる（フル解像度で展開しない）
+    image.draft('RGB', size)
+    image.thumbnail(size)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class EmailAttachment:
+    """
+    メール添付画像の軽量レコード
+    
+    画像はデコードせずにバイト列（大きい場合は一時ファイルのパス）だけを保持し、
+    open_image() / thumbnail() が呼ばれたときに初めてデコードする。
+    """
+    
+    __slots__ = ('email_id', 'subject', 'from_addr', 'date', 'filename', 'profile',
+                 'size', 'content_hash', '_phash', '_data', '_path', '_finalizer', '__weakref__')
+    
+    def __init__(self, email_id: str, subject: str, from_addr: str, date: Optional[datetime],
+                 filename: str, data: bytes, spill_dir: Optional[str] = None,
+                 spill_threshold: int = SPILL_THRESHOLD_BYTES, profile: Optional[str] = None):
+        self.email_id = email_id
+        self.subject = subject
+        self.from_addr = from_addr
+        self.date = date
+        self.filename = filename
+        self.profile = profile  # 取得したメールボックス設定（プロファイル）の名前
+        self.size = len(data)
+        self.content_hash = hashlib.sha256(data).hexdigest()
+        self._phash = None
+        self._data = None
+        self._path = None
+        self._finalizer = None
+        
+        if spill_threshold is not None and self.size > spill_threshold:
+            # 大きな添付は一時ファイルへ退避（メモリ使用量を一定に保つ）
+            fd, path = tempfile.mkstemp(prefix='order_', suffix='.img', dir=spill_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self._path = path
+            self._finalizer = weakref.finalize(self, _remove_spill_file, path)
+        else:
+            self._data = data
+    
+    @property
+    def data(self) -> bytes:
+        """添付の生データ（退避済みならファイルから読み込む）"""
+        if self._data is not None:
+            return self._data
+        with open(self._path, 'rb') as f:
+            return f.read()
+    
+    @property
+    def spill_path(self) -> Optional[str]:
+        """一時ファイルへ退避している場合はそのパス"""
+        return self._path
+    
+    def open_image(self) -> Image.Image:
+        """画像をデコードして返す（呼び出しごとに新しいImage）"""
+        image = Image.open(io.BytesIO(self.data))
+        image.load()
+        return image
+    
+    def thumbnail(self, size: Tuple[int, int] = THUMBNAIL_SIZE) -> bytes:
+        """プレビュー用の縮小PNGを返す"""
+        return make_thumbnail(self.data, size)
+    
+    def perceptual_hash(self) -> int:
+        """知覚ハッシュ（dHash）を返す（初回のみ縮小デコードして計算）"""
+        if self._phash is None:
+            image = Image.open(io.BytesIO(self.data))
+            image.draft('L', (DHASH_SIZE * 8, DHASH_SIZE * 8))
+            self._phash = dhash(image)
+        return self._phash
+    
+    def source(self) -> Dict:
+        """重複統合時に記録する送信元情報"""
+        return {
+            'email_id': self.email_id,
+            'subject': self.subject,
+            'from': self.from_addr,
+            'date': self.date,
+            'filename': self.filename,
+            'profile': self.profile
+        }
+    
+    def release(self):
+        """退避した一時ファイルを削除"""
+        if self._finalizer is not None:
+            self._finalizer()
+    
+    def to_dict(self) -> Dict:
+        """check_email_for_orders() 互換の辞書（画像をデコードする）"""
+        return {
+            'email_id': self.email_id,
+            'subject': self.subject,
+            'from': self.from_addr,
+            'date': self.date,
+            'image': self.open_image(),
+            'filename': self.filename
+        }
+
+def dhash(image: Image.Image, hash_size: int = DHASH_SIZE) -> int:
+    """差分ハッシュ（dHash）：隣り合う画素の明暗関係をビット列にしたもの"""
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """2つのハッシュの異なるビット数"""
+    return bin(a ^ b).count('1')
+
+
+def find_near_duplicate(phash: Optional[int], candidates, max_distance: int = DHASH_MAX_DISTANCE):
+    """
+    知覚ハッシュが近似一致する候補を探す（メールタブとメール監視で共通の判定）
+    
+    Args:
+        phash: 調べる画像のdHash（Noneなら一致なし）
+        candidates: (dHash, 値) のイテラブル
+        max_distance: 近似一致とみなす最大ハミング距離（負なら近似一致を使わない）
+    
+    Returns:
+        最初に一致した候補の値（なければNone）
+    """
+    # ほぼ無地の画像はハッシュがほとんど0になり、別の画像と誤って一致するため除外
+    def usable(value: Optional[int]) -> bool:
+        return value is not None and bin(value).count('1') >= DHASH_MIN_BITS
+    
+    if max_distance < 0 or not usable(phash):
+        return None
+    for candidate_phash, value in candidates:
+        if usable(candidate_phash) and hamming_distance(candidate_phash, phash) <= max_distance:
+            return value
+    return None
+
+
+class AttachmentGroup:
+    """
+    同じ画像（完全一致または再送・転送による近似一致）をまとめたエントリ
+    
+    attachment が代表の画像で、sources に受信した全てのメールが並ぶ。
+    """
+    
+    __slots__ = ('attachment', 'sources', 'content_hashes', 'phash')
+    
+    def __init__(self, attachment: EmailAttachment, phash: Optional[int] = None):
+        self.attachment = attachment
+        self.sources = [attachment.source()]
+        self.content_hashes = {attachment.content_hash}
+        self.phash = phash
+    
+    @property
+    def content_hash(self) -> str:
+        """代表画像の内容ハッシュ（解析結果のキャッシュキー）"""
+        return self.attachment.content_hash
+    
+    def add(self, attachment: EmailAttachment):
+        """重複した添付の送信元を追加（画像自体は保持しない）"""
+        self.sources.append(attachment.source())
+        self.content_hashes.add(attachment.content_hash)
+        attachment.release()
+    
+    def is_known(self, known_hashes) -> bool:
+        """グループ内のいずれかの画像の内容ハッシュが known_hashes（解析済みなど）に含まれるか"""
+        return not self.content_hashes.isdisjoint(known_hashes)
+
+
+class AttachmentDeduplicator:
+    """
+    添付画像の重複を内容ハッシュ（SHA-256）と知覚ハッシュ（dHash）で統合する
+    
+    内容ハッシュが既知の添付はデコードせずに統合する。
+    known_hashes に含まれる内容ハッシュ（解析済みなど）の添付はデコードせず、近似一致の比較もしない。
+    """
+    
+    def __init__(self, max_distance: int = DHASH_MAX_DISTANCE, known_hashes=None):
+        self.max_distance = max_distance
+        self.known_hashes = set(known_hashes or ())
+        self.groups: List[AttachmentGroup] = []
+        self._by_content: Dict[str, AttachmentGroup] = {}
+    
+    def add(self, attachment: EmailAttachment) -> Tuple[AttachmentGroup, bool]:
+        """
+        添付を登録する
+        
+        Returns:
+            (所属するグループ, 新しいグループかどうか)
+        """
+        # 完全一致（デコード不要）
+        group = self._by_content.get(attachment.content_hash)
+        if group is not None:
+            group.add(attachment)
+            return group, False
+        
+        # 近似一致（縮小デコードしてdHashを比較、解析済みの画像はそのまま使うのでデコードしない）
+        phash = None
+        if attachment.content_hash not in self.known_hashes:
+            try:
+                phash = attachment.perceptual_hash()
+            except Exception as e:
+                print(f"知覚ハッシュ計算エラー: {e}")
+        candidate = find_near_duplicate(phash, ((g.phash, g) for g in self.groups), self.max_distance)
+        if candidate is not None:
+            candidate.add(attachment)
+            self._by_content[attachment.content_hash] = candidate
+            return candidate, False
+        
+        group = AttachmentGroup(attachment, phash)
+        self.groups.append(group)
+        self._by_content[attachment.content_hash] = group
+        return group, True
+
+
+def dedupe_attachments(attachments, max_distance: int = DHASH_MAX_DISTANCE, known_hashes=None) -> List[AttachmentGroup]:
+    """
+    添付画像の重複・近似重複を統合し、送信元をまとめたグループのリストを返す
+    
+    Args:
+        attachments: EmailAttachment のイテラブル
+        max_distance: 近似一致とみなすdHashの最大ハミング距離
+        known_hashes: 解析済みの内容ハッシュ（該当する添付は知覚ハッシュを計算しない）
+    """
+    deduplicator = AttachmentDeduplicator(max_distance=max_distance, known_hashes=known_hashes)
+    for attachment in attachments:
+        deduplicator.add(attachment)
+    return deduplicator.groups
+
 
 def decode_mime_words(s):
     """MIMEエンコードされた文字列をデコード"""
@@ -29,10 +297,18 @@ def decode_mime_words(s):
             decoded_str += fragment
     return decoded_str
 
-def extract_images_from_email(msg) -> List[Dict]:
-    """メールから画像を抽出"""
-    images = []
-    
+def _is_readable_image(image_data: bytes) -> bool:
+    """画像として開けるか（ヘッダーのみ確認、ピクセルはデコードしない）"""
+    try:
+        with Image.open(io.BytesIO(image_data)):
+            return True
+    except Exception as e:
+        print(f"画像読み込みエラー: {e}")
+        return False
+
+
+def iter_image_parts(msg) -> Iterator[Tuple[str, bytes]]:
+    """メールから画像パートを (ファイル名, 生データ) として順に返す（デコードしない）"""
     if msg.is_multipart():
         for part in msg.walk():
             content_type = part.get_content_type()
@@ -44,132 +320,277 @@ def extract_images_from_email(msg) -> List[Dict]:
                 if filename:
                     filename = decode_mime_words(filename)
                     image_data = part.get_payload(decode=True)
-                    if image_data:
-                        try:
-                            image = Image.open(io.BytesIO(image_data))
-                            images.append({
-                                'filename': filename,
-                                'image': image,
-                                'data': image_data
-                            })
-                        except Exception as e:
-                            print(f"画像読み込みエラー: {e}")
+                    if image_data and _is_readable_image(image_data):
+                        yield filename, image_data
             
             # インライン画像も探す
             elif "image" in content_type:
                 image_data = part.get_payload(decode=True)
-                if image_data:
-                    try:
-                        image = Image.open(io.BytesIO(image_data))
-                        images.append({
-                            'filename': part.get_filename() or 'inline_image',
-                            'image': image,
-                            'data': image_data
-                        })
-                    except Exception as e:
-                        print(f"画像読み込みエラー: {e}")
+                if image_data and _is_readable_image(image_data):
+                    yield part.get_filename() or 'inline_image', image_data
     else:
         # シンプルなメールの場合
         content_type = msg.get_content_type()
         if "image" in content_type:
             image_data = msg.get_payload(decode=True)
-            if image_data:
-                try:
-                    image = Image.open(io.BytesIO(image_data))
-                    images.append({
-                        'filename': msg.get_filename() or 'image',
-                        'image': image,
-                        'data': image_data
-                    })
-                except Exception as e:
-                    print(f"画像読み込みエラー: {e}")
-    
+            if image_data and _is_readable_image(image_data):
+                yield msg.get_filename() or 'image', image_data
+
+
+def extract_images_from_email(msg) -> List[Dict]:
+    """メールから画像を抽出"""
+    images = []
+    for filename, image_data in iter_image_parts(msg):
+        images.append({
+            'filename': filename,
+            'image': Image.open(io.BytesIO(image_data)),
+            'data': image_data
+        })
     return images
 
-def check_email_for_orders(
+
+def build_search_criteria(sender_email: Union[str, List[str], None] = None, days_back: int = 1) -> str:
+    """IMAP検索条件を作成（送信者は複数指定可、いずれかに一致）"""
+    since_date = (datetime.now() - timedelta(days=days_back)).strftime("%d-%b-%Y")
+    senders = [sender_email] if isinstance(sender_email, str) else list(sender_email or [])
+    senders = [s for s in senders if s]
+    if not senders:
+        return f'(SINCE {since_date})'
+    # IMAPのORは2項演算子なので入れ子にする: OR FROM "a" (OR FROM "b" FROM "c")
+    sender_criteria = f'FROM "{senders[-1]}"'
+    for sender in reversed(senders[:-1]):
+        sender_criteria = f'OR FROM "{sender}" ({sender_criteria})'
+    return f'({sender_criteria} SINCE {since_date})'
+
+
+def search_order_messages(mail, sender_email: Union[str, List[str], None] = None, days_back: int = 1,
+                          use_uid: bool = False) -> List[bytes]:
+    """
+    選択中のメールボックスから条件に合うメールのID（use_uid=TrueならUID）を返す
+    """
+    search_criteria = build_search_criteria(sender_email, days_back)
+    if use_uid:
+        status, messages = mail.uid('SEARCH', None, search_criteria)
+    else:
+        status, messages = mail.search(None, search_criteria)
+    if status != "OK" or not messages or not messages[0]:
+        return []
+    return messages[0].split()
+
+
+def fetch_message_attachments(mail, email_id: bytes, use_uid: bool = False,
+                              spill_dir: Optional[str] = None,
+                              spill_threshold: int = SPILL_THRESHOLD_BYTES,
+                              profile: Optional[str] = None) -> List[EmailAttachment]:
+    """
+    1通のメールを取得して画像添付を EmailAttachment のリストで返す（画像はデコードしない）
+    """
+    # メール取得
+    if use_uid:
+        status, msg_data = mail.uid('FETCH', email_id, "(RFC822)")
+    else:
+        status, msg_data = mail.fetch(email_id, "(RFC822)")
+    if status != "OK" or not msg_data or not isinstance(msg_data[0], tuple):
+        return []
+    
+    # メール解析
+    msg = email.message_from_bytes(msg_data[0][1])
+    del msg_data
+    
+    # メール情報
+    subject = decode_mime_words(msg["Subject"] or "")
+    from_addr = decode_mime_words(msg["From"] or "")
+    date_str = msg["Date"]
+    date = parsedate_to_datetime(date_str) if date_str else None
+    
+    # 画像抽出（デコードは利用側で必要になったときに行う）
+    return [
+        EmailAttachment(
+            email_id=email_id.decode() if isinstance(email_id, bytes) else str(email_id),
+            subject=subject,
+            from_addr=from_addr,
+            date=date,
+            filename=filename,
+            data=image_data,
+            spill_dir=spill_dir,
+            spill_threshold=spill_threshold,
+            profile=profile
+        )
+        for filename, image_data in iter_image_parts(msg)
+    ]
+
+
+def iter_email_attachments(
     imap_server: str,
     email_address: str,
     password: str,
-    sender_email: Optional[str] = None,
-    days_back: int = 1
-) -> List[Dict]:
+    sender_email: Union[str, List[str], None] = None,
+    days_back: int = 1,
+    spill_dir: Optional[str] = None,
+    spill_threshold: int = SPILL_THRESHOLD_BYTES,
+    profile: Optional[str] = None
+) -> Iterator[EmailAttachment]:
     """
-    メールをチェックして注文メールを取得
+    メールをチェックして注文画像を1件ずつ返すジェネレーター
+    
+    メールは1通ずつ取得し、画像はデコードせずに EmailAttachment として返すため、
+    該当メールの件数に関係なくメモリ使用量はほぼ一定になる。
     
     Args:
         imap_server: IMAPサーバー（例: 'imap.gmail.com'）
         email_address: メールアドレス
         password: パスワードまたはアプリパスワード
-        sender_email: 送信者メールアドレス（フィルタ用、Noneの場合は全て）
+        sender_email: 送信者メールアドレス（フィルタ用、リストなら複数、Noneの場合は全て）
         days_back: 何日前まで遡るか
+        spill_dir: 大きな添付を退避する一時ディレクトリ（Noneの場合はOS既定）
+        spill_threshold: この大きさ（バイト）を超える添付は一時ファイルへ退避
+        profile: 結果に付けるプロファイル名
     
-    Returns:
-        画像とメール情報のリスト
+    Yields:
+        EmailAttachment
     """
-    results = []
-    
     try:
         # IMAP接続
         mail = imaplib.IMAP4_SSL(imap_server)
         mail.login(email_address, password)
+    except Exception as e:
+        print(f"メールチェックエラー: {e}")
+        raise
+    
+    try:
         mail.select("inbox")
         
-        # 検索条件
-        since_date = (datetime.now() - timedelta(days=days_back)).strftime("%d-%b-%Y")
-        search_criteria = f'(SINCE {since_date})'
-        
-        if sender_email:
-            search_criteria = f'(FROM "{sender_email}" SINCE {since_date})'
-        
         # メール検索
-        status, messages = mail.search(None, search_criteria)
-        
-        if status != "OK":
-            return results
-        
-        email_ids = messages[0].split()
-        
-        for email_id in email_ids:
+        for email_id in search_order_messages(mail, sender_email, days_back):
             try:
-                # メール取得
-                status, msg_data = mail.fetch(email_id, "(RFC822)")
-                if status != "OK":
-                    continue
-                
-                # メール解析
-                msg = email.message_from_bytes(msg_data[0][1])
-                
-                # メール情報
-                subject = decode_mime_words(msg["Subject"] or "")
-                from_addr = decode_mime_words(msg["From"] or "")
-                date_str = msg["Date"]
-                date = parsedate_to_datetime(date_str) if date_str else None
-                
-                # 画像抽出
-                images = extract_images_from_email(msg)
-                
-                for img_info in images:
-                    results.append({
-                        'email_id': email_id.decode(),
-                        'subject': subject,
-                        'from': from_addr,
-                        'date': date,
-                        'image': img_info['image'],
-                        'filename': img_info['filename']
-                    })
-            
+                attachments = fetch_message_attachments(
+                    mail, email_id, spill_dir=spill_dir, spill_threshold=spill_threshold,
+                    profile=profile
+                )
             except Exception as e:
                 print(f"メール処理エラー (ID: {email_id}): {e}")
                 continue
+            
+            yield from attachments
         
         mail.close()
-        mail.logout()
     
     except Exception as e:
         print(f"メールチェックエラー: {e}")
         raise
     
-    return results
+    finally:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+
+def iter_profile_attachments(
+    profiles: List[Dict],
+    passwords: Dict[str, str],
+    spill_dir: Optional[str] = None,
+    spill_threshold: int = SPILL_THRESHOLD_BYTES,
+    errors: Optional[Dict[str, Exception]] = None,
+    max_workers: int = 4
+) -> Iterator[EmailAttachment]:
+    """
+    複数のメールボックス設定（プロファイル）を同時にチェックし、結果を1つの流れにまとめて返す
+    
+    各結果の profile にプロファイル名が入る。取り出し待ちのキューは上限付きのため、
+    プロファイルが増えてもメモリ使用量はほぼ一定。
+    
+    Args:
+        profiles: normalize_profile() 済みのプロファイルのリスト
+        passwords: メールアドレス → パスワード
+        spill_dir: 大きな添付を退避する一時ディレクトリ
+        spill_threshold: この大きさ（バイト）を超える添付は一時ファイルへ退避
+        errors: 指定するとプロファイル名 → 発生した例外 を記録（1つ失敗しても他は続行）
+        max_workers: 同時に接続するメールボックス数
+    
+    Yields:
+        EmailAttachment（profile付き）
+    """
+    results: "queue.Queue" = queue.Queue(maxsize=max_workers * 2)
+    done = object()
+    cancelled = False
+    
+    def worker(profile: Dict):
+        try:
+            for attachment in iter_email_attachments(
+                imap_server=profile['imap_server'],
+                email_address=profile['email_address'],
+                password=passwords.get(profile['email_address'], ''),
+                sender_email=profile.get('sender_emails') or None,
+                days_back=profile.get('days_back', 1),
+                spill_dir=spill_dir,
+                spill_threshold=spill_threshold,
+                profile=profile['name']
+            ):
+                if cancelled:
+                    attachment.release()
+                    break
+                results.put(attachment)
+        except Exception as e:
+            if errors is not None:
+                errors[profile['name']] = e
+        finally:
+            results.put(done)
+    
+    if not profiles:
+        return
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for profile in profiles:
+            executor.submit(worker, profile)
+        remaining = len(profiles)
+        try:
+            while remaining:
+                item = results.get()
+                if item is done:
+                    remaining -= 1
+                else:
+                    yield item
+        finally:
+            # 途中で打ち切られた場合はワーカーを止め、キューを空けて終了を待つ
+            cancelled = True
+            while remaining:
+                item = results.get()
+                if item is done:
+                    remaining -= 1
+                else:
+                    item.release()
+
+
+def check_email_for_orders(
+    imap_server: str,
+    email_address: str,
+    password: str,
+    sender_email: Optional[str] = None,
+    days_back: int = 1
+) -> List[Dict]:
+    """
+    メールをチェックして注文メールを取得
+    
+    全画像をデコードしてリストで返す。件数が多い場合は iter_email_attachments() を使うこと。
+    
+    Args:
+        imap_server: IMAPサーバー（例: 'imap.gmail.com'）
+        email_address: メールアドレス
+        password: パスワードまたはアプリパスワード
+        sender_email: 送信者メールアドレス（フィルタ用、Noneの場合は全て）
+        days_back: 何日前まで遡るか
+    
+    Returns:
+        画像とメール情報のリスト
+    """
+    return [
+        attachment.to_dict()
+        for attachment in iter_email_attachments(
+            imap_server, email_address, password,
+            sender_email=sender_email, days_back=days_back
+        )
+    ]
 
 def mark_email_as_read(imap_server: str, email_address: str, password: str, email_id: str):
     """メールを既読にする"""
@@ -0,0 +1,408 @@
+"""
+メール監視モジュール
+IMAP IDLE（非対応サーバーではポーリング）で新着の注文メールを待ち受け、
+画像の取得・AI解析・検証までをバックグラウンドで済ませてローカルに保存する
+保存した結果はアプリの「メール自動読み取り」タブから確認・読み込みできる
+
+使い方:
+    EMAIL_PASSWORD=... GEMINI_API_KEY=... python email_watcher.py
+    （メールアドレス等は config/email_config.json の設定を使用）
+"""
+import argparse
+import imaplib
+import json
+import os
+import select
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Optional
+
+from config_manager import run_migrations
+from email_config_manager import load_email_config, detect_imap_server
+from email_reader import search_order_messages, fetch_message_attachments, find_near_duplicate
+from order_parser import parse_order_image, validate_and_fix_order_data, CONSOLE_REPORT
+
+PREFETCH_DIR = Path("prefetched_orders")
+PREFETCH_STATE_FILE = PREFETCH_DIR / "state.json"
+
+# RFC 2177ではサーバーが30分でIDLEを切る可能性があるため、それより短い間隔で張り直す
+IDLE_TIMEOUT_SECONDS = 10 * 60
+# IDLE非対応サーバーのポーリング間隔
+POLL_INTERVAL_SECONDS = 5 * 60
+# 接続エラー時の再接続待ち
+RECONNECT_DELAY_SECONDS = 60
+
+
+# ==========================================
+# 事前解析結果の保存（1画像 = 1 JSON + 画像ファイル）
+# ==========================================
+
+def ensure_prefetch_dir():
+    """保存ディレクトリが存在することを確認"""
+    PREFETCH_DIR.mkdir(exist_ok=True)
+
+
+def _write_json_atomic(path: Path, data):
+    """アプリが読み込み中でも壊れたJSONが見えないよう、一時ファイル経由で書き込む"""
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def _entry_path(content_hash: str) -> Path:
+    return PREFETCH_DIR / f"{content_hash}.json"
+
+
+def load_prefetched_orders() -> List[Dict]:
+    """事前解析済みの注文を新しい順に読み込む"""
+    if not PREFETCH_DIR.exists():
+        return []
+    entries = []
+    for path in PREFETCH_DIR.glob('*.json'):
+        if path == PREFETCH_STATE_FILE:
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries.append(json.load(f))
+        except Exception:
+            continue
+    entries.sort(key=lambda e: e.get('received_at') or '', reverse=True)
+    return entries
+
+
+def load_prefetched_image_bytes(entry: Dict) -> bytes:
+    """事前解析済み注文の元画像を読み込む"""
+    with open(PREFETCH_DIR / entry['image_file'], 'rb') as f:
+        return f.read()
+
+
+def save_prefetched_order(attachment, phash: Optional[int], order_data, validated_data) -> Dict:
+    """解析結果と元画像を保存"""
+    ensure_prefetch_dir()
+    image_file = f"{attachment.content_hash}.img"
+    with open(PREFETCH_DIR / image_file, 'wb') as f:
+        f.write(attachment.data)
+    entry = {
+        'content_hash': attachment.content_hash,
+        'phash': format(phash, 'x') if phash is not None else None,
+        'filename': attachment.filename,
+        'sources': [attachment.source()],
+        'received_at': attachment.date.isoformat() if attachment.date else datetime.now().isoformat(),
+        'parsed_at': datetime.now().isoformat(),
+        'status': 'parsed' if order_data else 'failed',
+        'order_data': order_data,
+        'validated_data': validated_data,
+        'image_file': image_file,
+    }
+    _write_json_atomic(_entry_path(attachment.content_hash), entry)
+    return entry
+
+
+def add_prefetched_source(content_hash: str, source: Dict):
+    """既に保存済みの画像（再送・転送）に受信元を追加"""
+    path = _entry_path(content_hash)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except Exception:
+        return
+    entry.setdefault('sources', []).append(source)
+    _write_json_atomic(path, entry)
+
+
+def remove_prefetched_order(content_hash: str):
+    """事前解析済みの注文を削除（読み込み済み・不要になったもの）"""
+    for path in (_entry_path(content_hash), PREFETCH_DIR / f"{content_hash}.img"):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def _load_state() -> Dict:
+    if PREFETCH_STATE_FILE.exists():
+        try:
+            with open(PREFETCH_STATE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            pass
+    return {}
+
+
+def _save_state(state: Dict):
+    ensure_prefetch_dir()
+    _write_json_atomic(PREFETCH_STATE_FILE, state)
+
+
+# ==========================================
+# IMAP IDLE
+# ==========================================
+
+def supports_idle(mail) -> bool:
+    """サーバーがIDLE（RFC 2177）に対応しているか"""
+    return 'IDLE' in getattr(mail, 'capabilities', ())
+
+
+def _has_pending_data(mail) -> bool:
+    pending = getattr(mail.sock, 'pending', None)
+    return bool(pending and pending())
+
+
+def idle_wait(mail, timeout: float) -> Optional[bool]:
+    """
+    IDLEで新着を待つ
+    imaplib はIDLEに対応していないため内部API（_new_tag・send・readline）を使う。使うのはこの関数だけ
+    
+    Returns:
+        新着（EXISTS）を受信したらTrue、timeout秒経過したらFalse、
+        IDLEを開始できなかった場合はNone（呼び出し側はポーリングに切り替える）
+    """
+    try:
+        tag = mail._new_tag()
+        mail.send(tag + b' IDLE\r\n')
+        response = mail.readline()
+    except (AttributeError, TypeError) as e:
+        # imaplib の内部APIが変わった場合
+        print(f"IDLEを使用できません: {e}")
+        return None
+    if not response.startswith(b'+'):
+        print(f"IDLEを開始できません: {response!r}")
+        return None
+    
+    got_new = False
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not _has_pending_data(mail):
+                readable, _, _ = select.select([mail.sock], [], [], remaining)
+                if not readable:
+                    break
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("IDLE中に接続が切断されました")
+            if line.rstrip().endswith(b'EXISTS'):
+                got_new = True
+                break
+    finally:
+        mail.send(b'DONE\r\n')
+        # IDLEコマンドの完了応答まで読み捨てる
+        while True:
+            line = mail.readline()
+            if not line or line.startswith(tag):
+                break
+    return got_new
+
+
+# ==========================================
+# 監視本体
+# ==========================================
+
+class OrderMailWatcher:
+    """新着の注文メールを監視し、画像の取得・解析・検証を済ませて保存する"""
+    
+    def __init__(self, imap_server: str, email_address: str, password: str, api_key: str,
+                 sender_email: Optional[str] = None, days_back: int = 1, mailbox: str = "inbox",
+                 use_idle: bool = True, imap_factory=None, report=None):
+        """
+        初期化
+        
+        Args:
+            imap_server: IMAPサーバー
+            email_address: メールアドレス
+            password: パスワードまたはアプリパスワード
+            api_key: Gemini APIキー
+            sender_email: 送信者メールアドレス（フィルタ用、Noneの場合は全て）
+            days_back: 何日前まで遡るか（初回起動時の取得範囲）
+            mailbox: 監視するメールボックス
+            use_idle: FalseならIDLE対応サーバーでもポーリングする
+            imap_factory: IMAP接続を作る関数（Noneの場合はIMAP4_SSL、テスト用に差し替え可能）
+            report: 解析・検証メッセージの表示先（Noneの場合はコンソール）
+        """
+        self.imap_server = imap_server
+        self.email_address = email_address
+        self.password = password
+        self.api_key = api_key
+        self.sender_email = sender_email or None
+        self.days_back = days_back
+        self.mailbox = mailbox
+        self.use_idle = use_idle
+        self.imap_factory = imap_factory or imaplib.IMAP4_SSL
+        self.report = report or CONSOLE_REPORT
+        self._stop_event = threading.Event()
+    
+    @property
+    def state_key(self) -> str:
+        """処理済み位置を記録するキー（アカウント・メールボックスごと）"""
+        return f"{self.email_address}@{self.imap_server}/{self.mailbox}"
+    
+    def stop(self):
+        """監視ループを終了する（IDLE・ポーリングの待機が明けた時点で停止）"""
+        self._stop_event.set()
+    
+    def connect(self):
+        """IMAPに接続してメールボックスを選択"""
+        mail = self.imap_factory(self.imap_server)
+        mail.login(self.email_address, self.password)
+        mail.select(self.mailbox)
+        return mail
+    
+    def _uidvalidity(self, mail) -> Optional[str]:
+        try:
+            _, data = mail.response('UIDVALIDITY')
+        except Exception:
+            return None
+        if data and data[0]:
+            value = data[0]
+            return value.decode() if isinstance(value, bytes) else str(value)
+        return None
+    
+    def process_new_messages(self, mail) -> int:
+        """
+        前回以降の新着メールを処理する
+        
+        Returns:
+            新しく解析した画像の数
+        """
+        state = _load_state()
+        account_state = state.get(self.state_key, {})
+        uidvalidity = self._uidvalidity(mail)
+        last_uid = account_state.get('last_uid', 0)
+        if uidvalidity and account_state.get('uidvalidity') not in (None, uidvalidity):
+            # UIDが振り直された場合は取得範囲内を再確認（保存済みの画像は内容ハッシュで除外される）
+            last_uid = 0
+        
+        uids = sorted(
+            (uid for uid in search_order_messages(mail, self.sender_email, self.days_back, use_uid=True)
+             if int(uid) > last_uid),
+            key=int
+        )
+        if not uids:
+            return 0
+        
+        entries = load_prefetched_orders()
+        known_hashes = {entry['content_hash'] for entry in entries}
+        parsed_count = 0
+        
+        for uid in uids:
+            try:
+                attachments = fetch_message_attachments(mail, uid, use_uid=True)
+            except Exception as e:
+                # 処理済み位置を進めず、このメール以降は次回の確認で取得し直す
+                print(f"メール処理エラー (UID: {uid}): {e}")
+                break
+            
+            for attachment in attachments:
+                # 完全一致：デコードもAI解析もしない
+                if attachment.content_hash in known_hashes:
+                    add_prefetched_source(attachment.content_hash, attachment.source())
+                    continue
+                
+                # 近似一致（再送・転送）：AI解析しない
+                try:
+                    phash = attachment.perceptual_hash()
+                except Exception:
+                    phash = None
+                duplicate_of = find_near_duplicate(
+                    phash,
+                    ((int(entry['phash'], 16), entry['content_hash']) for entry in entries if entry.get('phash'))
+                )
+                if duplicate_of:
+                    add_prefetched_source(duplicate_of, attachment.source())
+                    continue
+                
+                order_data = parse_order_image(attachment.open_image(), self.api_key, report=self.report)
+                validated_data = validate_and_fix_order_data(order_data, report=self.report) if order_data else []
+                entry = save_prefetched_order(attachment, phash, order_data, validated_data)
+                entries.append(entry)
+                known_hashes.add(attachment.content_hash)
+                parsed_count += 1
+                print(f"解析済み: {attachment.filename}（{len(validated_data)}件）")
+            
+            # 1通ごとに処理済み位置を記録（途中で止まっても二重に解析しない）
+            state[self.state_key] = {'last_uid': int(uid), 'uidvalidity': uidvalidity}
+            _save_state(state)
+        
+        return parsed_count
+    
+    def run_once(self) -> int:
+        """1回だけ新着を確認して終了"""
+        mail = self.connect()
+        try:
+            return self.process_new_messages(mail)
+        finally:
+            try:
+                mail.logout()
+            except Exception:
+                pass
+    
+    def run_forever(self):
+        """stop() が呼ばれるまで新着を監視し続ける（切断時は再接続）"""
+        while not self._stop_event.is_set():
+            mail = None
+            try:
+                mail = self.connect()
+                idle = self.use_idle and supports_idle(mail)
+                print(f"メール監視を開始しました（{'IDLE' if idle else 'ポーリング'}）: {self.state_key}")
+                while not self._stop_event.is_set():
+                    self.process_new_messages(mail)
+                    if idle and idle_wait(mail, IDLE_TIMEOUT_SECONDS) is None:
+                        print(f"ポーリングに切り替えます: {self.state_key}")
+                        idle = False
+                    if not idle:
+                        if self._stop_event.wait(POLL_INTERVAL_SECONDS):
+                            break
+                        mail.noop()
+            except Exception as e:
+                print(f"メール監視エラー: {e}")
+                self._stop_event.wait(RECONNECT_DELAY_SECONDS)
+            finally:
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="注文メールを監視して事前に解析する")
+    parser.add_argument('--once', action='store_true', help="1回だけ確認して終了")
+    parser.add_argument('--poll', action='store_true', help="IDLEを使わずポーリングする")
+    args = parser.parse_args()
+    
+    config = load_email_config()
+    email_address = os.environ.get('EMAIL_ADDRESS') or config.get('email_address', '')
+    password = os.environ.get('EMAIL_PASSWORD', '')
+    api_key = os.environ.get('GEMINI_API_KEY', '')
+    if not email_address or not password or not api_key:
+        parser.error("メールアドレス（config/email_config.json または EMAIL_ADDRESS）、EMAIL_PASSWORD、GEMINI_API_KEY が必要です")
+    
+    # アプリより先に起動した場合も、マスターを移行済みの状態にしてから解析する
+    run_migrations()
+    
+    watcher = OrderMailWatcher(
+        imap_server=config.get('imap_server') or detect_imap_server(email_address),
+        email_address=email_address,
+        password=password,
+        api_key=api_key,
+        sender_email=config.get('sender_email') or None,
+        days_back=config.get('days_back', 1),
+        use_idle=not args.poll,
+    )
+    if args.once:
+        count = watcher.run_once()
+        print(f"{count}件の画像を解析しました")
+        return
+    try:
+        watcher.run_forever()
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+出荷ラベルのコンパクトな表現
+注文の1行（店舗×品目）を1つのレコードとして持ち、箱ごとのラベルは参照されたときに作る
+（箱の数だけdictを作ってセッションに置かないため、大量の注文でもメモリを使わない）
+"""
+from bisect import bisect_right
+from collections.abc import Sequence
+from typing import Dict, Iterable, Iterator
+
+
+class LabelLine:
+    """注文1行分（店舗×品目）のラベル情報"""
+    
+    __slots__ = ('store', 'item', 'spec', 'unit', 'boxes', 'remainder', 'unit_label', 'shipment_date')
+    
+    def __init__(self, store: str, item: str, spec: str, unit: int, boxes: int,
+                 remainder: int, unit_label: str, shipment_date: str):
+        """
+        Args:
+            store: 店舗名
+            item: 品目名
+            spec: 規格
+            unit: 入数（1箱あたり）
+            boxes: フル箱の数
+            remainder: 端数（0なら端数箱なし）
+            unit_label: 単位（'本'、'袋'など）
+            shipment_date: 表示用の出荷日（例: 2月10日）
+        """
+        self.store = store
+        self.item = item
+        self.spec = spec
+        self.unit = unit
+        self.boxes = boxes
+        self.remainder = remainder
+        self.unit_label = unit_label
+        self.shipment_date = shipment_date
+    
+    @property
+    def box_total(self) -> int:
+        """総箱数（フル箱 + 端数箱）"""
+        return self.boxes + (1 if self.remainder > 0 else 0)
+    
+    def cache_token(self) -> tuple:
+        """内容を表すタプル（キャッシュキー用）"""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+class Label:
+    """
+    1箱分のラベル（注文行と箱番号だけを持ち、表示用の文字列は描画時に作る）
+    従来のラベルdictと同じく label.get('store') / label['quantity'] で値を取り出せる
+    """
+    
+    __slots__ = ('line', 'box_no')
+    
+    FIELDS = ('store', 'item', 'spec', 'quantity', 'sequence', 'box_no', 'box_total',
+              'is_fraction', 'shipment_date', 'unit', 'boxes', 'remainder')
+    
+    def __init__(self, line: LabelLine, box_no: int):
+        self.line = line
+        self.box_no = box_no
+    
+    store = property(lambda self: self.line.store)
+    item = property(lambda self: self.line.item)
+    spec = property(lambda self: self.line.spec)
+    unit = property(lambda self: self.line.unit)
+    boxes = property(lambda self: self.line.boxes)
+    remainder = property(lambda self: self.line.remainder)
+    shipment_date = property(lambda self: self.line.shipment_date)
+    box_total = property(lambda self: self.line.box_total)
+    
+    @property
+    def is_fraction(self) -> bool:
+        """端数箱（余りがある注文の最後の1箱）か"""
+        return self.line.remainder > 0 and self.box_no == self.line.box_total
+    
+    @property
+    def quantity(self) -> str:
+        """入り数の表示（例: 30袋）"""
+        count = self.line.remainder if self.is_fraction else self.line.unit
+        return f"{count}{self.line.unit_label}"
+    
+    @property
+    def sequence(self) -> str:
+        """通し番号の表示（例: 3/6）"""
+        return f"{self.box_no}/{self.line.box_total}"
+    
+    def get(self, key: str, default=None):
+        """dictと同じ取り出し方（存在しないキーはdefault）"""
+        if key in self.FIELDS:
+            return getattr(self, key)
+        return default
+    
+    def __getitem__(self, key: str):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def to_dict(self) -> Dict:
+        """従来形式のラベルdict"""
+        return {name: getattr(self, name) for name in self.FIELDS}
+    
+    def cache_token(self) -> tuple:
+        """内容を表すタプル（キャッシュキー用）"""
+        return self.line.cache_token() + (self.box_no,)
+
+
+class LabelList(Sequence):
+    """
+    全ラベルの読み取り専用リスト
+    注文行ごとの先頭インデックスだけを持ち、labels[i] で i 番目の箱のラベルをその場で作る
+    """
+    
+    def __init__(self, lines: Iterable[LabelLine]):
+        self.lines = []
+        self._starts = []  # 各注文行の最初のラベルのインデックス
+        total = 0
+        for line in lines:
+            if line.box_total <= 0:
+                continue
+            self.lines.append(line)
+            self._starts.append(total)
+            total += line.box_total
+        self._total = total
+    
+    def __len__(self) -> int:
+        return self._total
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._total))]
+        if index < 0:
+            index += self._total
+        if not 0 <= index < self._total:
+            raise IndexError("label index out of range")
+        line_idx = bisect_right(self._starts, index) - 1
+        return Label(self.lines[line_idx], index - self._starts[line_idx] + 1)
+    
+    def __iter__(self) -> Iterator[Label]:
+        for line in self.lines:
+            for box_no in range(1, line.box_total + 1):
+                yield Label(line, box_no)
+    
+    def cache_token(self) -> list:
+        """内容を表すリスト（キャッシュキー用、注文行の数に比例）"""
+        return [line.cache_token() for line in self.lines]
@@ -0,0 +1,15 @@
+"""
+数値の変換
+外部ライブラリに依存しないため、PDF描画やメール監視のプロセスからも読み込める
+"""
+import re
+
+
+def safe_int(v):
+    """安全に整数に変換"""
+    if v is None:
+        return 0
+    if isinstance(v, int):
+        return v
+    s = re.sub(r'\D', '', str(v))
+    return int(s) if s else 0
@@ -0,0 +1,451 @@
+"""
+注文データ解析モジュール
+Gemini APIによる注文書画像の解析と、解析結果の検証・正規化
+（Streamlitアプリとバックグラウンドのメール監視の両方から使用）
+"""
+import google.generativeai as genai
+from PIL import Image
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from config_manager import (
+    load_stores, load_items, auto_learn_store, auto_learn_item,
+    lookup_unit, add_unit_if_new, load_item_settings, get_item_setting, get_box_count_items,
+    master_version
+)
+from numeric_utils import safe_int  # 従来どおり order_parser からも使えるように再エクスポート
+
+# 検証結果のキャッシュ（行の内容のハッシュ → 検証結果、マスターのバージョンが変わったら破棄）
+VALIDATION_CACHE_SIZE = 2048
+_validation_lock = threading.Lock()
+_validation_cache = {'version': None, 'rows': OrderedDict()}
+
+# Gemini APIに設定済みのキー（同じキーで設定し直すと接続が作り直されるため）
+_gemini_lock = threading.Lock()
+_configured_api_key = None
+
+
+class ConsoleReport:
+    """解析・検証メッセージの表示先（Streamlit外ではコンソールに出力）"""
+    
+    def error(self, message):
+        print(f"エラー: {message}")
+    
+    def warning(self, message):
+        print(f"警告: {message}")
+    
+    def success(self, message):
+        print(message)
+    
+    def text(self, message):
+        print(message)
+    
+    def write(self, message):
+        print(message)
+
+
+CONSOLE_REPORT = ConsoleReport()
+
+
+def get_known_stores():
+    """店舗名リストを取得（動的）"""
+    return load_stores()
+
+
+def get_item_normalization():
+    """品目名正規化マップを取得（動的）"""
+    return load_items()
+
+
+def normalize_item_name(item_name, auto_learn=True):
+    """品目名を正規化する（動的設定対応）"""
+    if not item_name:
+        return ""
+    item_name = str(item_name).strip()
+    item_normalization = get_item_normalization()
+    
+    for normalized, variants in item_normalization.items():
+        if item_name in variants or any(variant in item_name for variant in variants):
+            return normalized
+    
+    # 見つからない場合、自動学習
+    if auto_learn:
+        return auto_learn_item(item_name)
+    return item_name
+
+
+def validate_store_name(store_name, auto_learn=True):
+    """店舗名を検証し、最も近い店舗名を返す（動的設定対応）"""
+    if not store_name:
+        return None
+    store_name = str(store_name).strip()
+    known_stores = get_known_stores()
+    
+    # 完全一致
+    if store_name in known_stores:
+        return store_name
+    # 部分一致
+    for known_store in known_stores:
+        if known_store in store_name or store_name in known_store:
+            return known_store
+    
+    # 見つからない場合、自動学習
+    if auto_learn:
+        return auto_learn_store(store_name)
+    return None
+
+
+def configure_gemini(api_key: str):
+    """Gemini APIのキーを設定（前回と同じキーなら設定し直さず、接続を使い回す）"""
+    global _configured_api_key
+    with _gemini_lock:
+        if api_key != _configured_api_key:
+            genai.configure(api_key=api_key)
+            _configured_api_key = api_key
+
+
+def create_gemini_model(api_key: str):
+    """Geminiのモデルを作成（gemini-2.5-flash を優先、利用不可時は 2.0-flash 等にフォールバック）"""
+    configure_gemini(api_key)
+    try:
+        return genai.GenerativeModel('gemini-2.5-flash')
+    except Exception:
+        try:
+            return genai.GenerativeModel('gemini-2.0-flash')
+        except Exception:
+            try:
+                return genai.GenerativeModel('gemini-1.5-flash')
+            except Exception:
+                try:
+                    return genai.GenerativeModel('gemini-1.5-pro')
+                except Exception:
+                    return genai.GenerativeModel('gemini-pro-vision')
+
+
+def parse_order_image(image: Image.Image, api_key: str, report=None, model=None) -> list:
+    """
+    Gemini APIで注文書画像を解析（複数店舗対応）
+    
+    Args:
+        image: PIL Imageオブジェクト
+        api_key: Gemini APIキー
+        report: エラー表示先（Noneの場合はコンソールに出力）
+        model: 作成済みのモデル（Noneの場合は create_gemini_model で作成）
+    
+    Returns:
+        解析結果のリスト [{"store":"店舗名","item":"品目名","spec":"規格","unit":数字,"boxes":数字,"remainder":数字}]
+    """
+    report = report or CONSOLE_REPORT
+    if model is None:
+        model = create_gemini_model(api_key)
+    else:
+        configure_gemini(api_key)
+    
+    # 店舗名・品目名リストを取得
+    known_stores = get_known_stores()
+    item_normalization = get_item_normalization()
+    store_list = "、".join(known_stores)
+    item_list = ", ".join(item_normalization.keys())
+    # マスターデータを参照（品目名管理で設定した入数・箱数/総数）
+    item_settings_for_prompt = load_item_settings()
+    box_count_items = get_box_count_items()
+    unit_lines = "\n".join([f"- {name}: {s.get('default_unit', 0)}{s.get('unit_type', '袋')}/コンテナ" for name, s in sorted(item_settings_for_prompt.items()) if s.get("default_unit", 0) > 0])
+    box_count_str = "、".join(box_count_items) if box_count_items else "（なし）"
+    
+    # プロンプト（マスターデータを参照して計算）
+    prompt = f"""
+画像を解析し、以下の厳密なルールに従ってJSONで返してください。
+
+【店舗名リスト（参考）】
+{store_list}
+※上記リストにない店舗名も読み取ってください。
+
+【品目名の正規化ルール】
+{json.dumps(item_normalization, ensure_ascii=False, indent=2)}
+
+【重要ルール】
+1. 店舗名の後に「:」または改行がある場合、その後の行は全てその店舗の注文です
+2. 品目名がない行（例：「50×1」）は、直前の品目の続きとして処理してください
+3. 「/」で区切られた複数の注文は、同じ店舗・同じ品目として統合してください
+   - 例：「胡瓜バラ100×7 / 50×1」→ 胡瓜バラ100本×7箱 + 端数50本
+4. 「胡瓜バラ」と「胡瓜3本」は別の規格として扱ってください
+5. unit, boxes, remainderには「数字のみ」を入れてください
+
+【計算ルール（事前登録マスターデータ＝1コンテナあたりの入数）】
+メールで送られてくるのは基本的に「総数」です。以下の登録入数を参照して、総数から箱数・端数を逆算してください。
+{unit_lines}
+
+【最重要：総数 vs 箱数】
+- 「×数字」が総数の品目：boxes = 総数÷unit（切り捨て）, remainder = 総数 - unit×boxes で逆算してください。
+- 「×数字」が箱数の品目（以下のみ）：{box_count_str} → ×数字をそのままboxesにし、unitは上記の値、remainder=0 で出力してください。
+
+【出力JSON形式】
+[{{"store":"店舗名","item":"品目名","spec":"規格","unit":数字,"boxes":数字,"remainder":数字}}]
+
+必ず全ての店舗と品目を漏れなく読み取ってください。
+"""
+    
+    try:
+        response = model.generate_content([prompt, image])
+        # レスポンスからJSONを抽出
+        text = response.text.strip()
+        if '```json' in text:
+            text = text.split('```json')[1].split('```')[0].strip()
+        elif '```' in text:
+            parts = text.split('```')
+            for part in parts:
+                if '{' in part and '[' in part:
+                    text = part.strip()
+                    break
+        
+        # JSONをパース
+        result = json.loads(text)
+        # リストでない場合はリストに変換
+        if isinstance(result, dict):
+            result = [result]
+        return result
+    except json.JSONDecodeError as e:
+        report.error(f"JSON解析エラー: {e}")
+        report.text(f"レスポンス内容: {text[:500]}")
+        return None
+    except Exception as e:
+        report.error(f"画像解析エラー: {e}")
+        return None
+
+
+class ValidatedOrders(list):
+    """
+    検証済みの注文データ（validate_and_fix_order_data の戻り値）
+    行の内容・マスターのバージョンから作ったフィンガープリントを持ち、
+    変更がなければ再検証しない
+    """
+    
+    def __init__(self, rows, fingerprint: str, errors: list):
+        super().__init__(rows)
+        self.fingerprint = fingerprint
+        self.errors = errors  # 検証で見つかった問題（再検証を省略した場合も表示する）
+
+
+def _row_hash(entry) -> str:
+    """注文1行の内容のハッシュ"""
+    payload = json.dumps(entry, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def validation_fingerprint(rows, auto_learn=True, version=None) -> str:
+    """行の内容 + マスターのバージョン（+ 自動学習の有無）のフィンガープリント"""
+    digest = hashlib.sha256(repr((version or master_version(), auto_learn)).encode('utf-8'))
+    for entry in rows:
+        digest.update(_row_hash(entry).encode('ascii'))
+    return digest.hexdigest()
+
+
+def _validate_entry(entry, auto_learn, known_stores):
+    """
+    注文1行を検証・修正
+    
+    Returns:
+        (検証済みの行, 問題点のリスト（行番号なし）, 学習した店舗名, 学習した品目名)
+    """
+    errors = []
+    learned_store = learned_item = None
+    
+    # 必須フィールドのチェック
+    store = entry.get('store', '').strip()
+    item = entry.get('item', '').strip()
+    
+    # 店舗名の検証と修正（自動学習）
+    validated_store = validate_store_name(store, auto_learn=auto_learn)
+    if not validated_store and store:
+        if auto_learn:
+            validated_store = auto_learn_store(store)
+            learned_store = validated_store
+        else:
+            errors.append(f"不明な店舗名「{store}」")
+            # 最も近い店舗名を推測
+            for known_store in known_stores:
+                if any(char in store for char in known_store):
+                    validated_store = known_store
+                    break
+    
+    # 品目名の正規化（自動学習）
+    normalized_item = normalize_item_name(item, auto_learn=auto_learn)
+    if not normalized_item and item:
+        if auto_learn:
+            normalized_item = auto_learn_item(item)
+            learned_item = normalized_item
+        else:
+            errors.append(f"品目名「{item}」を正規化できませんでした")
+    
+    # 数量の検証
+    unit = safe_int(entry.get('unit', 0))
+    boxes = safe_int(entry.get('boxes', 0))
+    remainder = safe_int(entry.get('remainder', 0))
+
+    # 入数が0の場合、入数マスターから補完（店舗ごと → 全店舗共通 → 品目設定のデフォルト入数）
+    if unit <= 0:
+        spec_for_lookup = (entry.get('spec') or '').strip() if entry.get('spec') is not None else ''
+        looked_up = lookup_unit(normalized_item or item, spec_for_lookup, validated_store or store)
+        if looked_up > 0:
+            unit = looked_up
+
+    # 数量が0の場合は警告
+    if unit == 0 and boxes == 0 and remainder == 0:
+        errors.append(f"数量が全て0です（店舗: {store}, 品目: {item}）")
+    
+    # 検証済みデータを追加
+    spec_value = entry.get('spec', '')
+    if spec_value is None:
+        spec_value = ''
+    else:
+        spec_value = str(spec_value).strip()
+    
+    # 入数が取得できた場合、入数マスターに自動登録（新規のみ、重複はスキップ）
+    if unit > 0:
+        add_unit_if_new(normalized_item or item, spec_value, validated_store or store, unit)
+
+    validated_entry = {
+        'store': validated_store or store,
+        'item': normalized_item or item,
+        'spec': spec_value,
+        'unit': unit,
+        'boxes': boxes,
+        'remainder': remainder
+    }
+    return validated_entry, errors, learned_store, learned_item
+
+
+def validate_and_fix_order_data(order_data, auto_learn=True, report=None):
+    """
+    AIが読み取ったデータを検証し、必要に応じて修正する（自動学習対応）
+    
+    学習結果や検証で見つかった問題は report（Noneの場合はコンソール）に表示する。
+    行の内容とマスターが前回と同じなら再検証せず、変わった行だけ検証し直す
+    （マスターが変わった場合は全行を検証し直す）。
+    """
+    report = report or CONSOLE_REPORT
+    if not order_data:
+        return []
+    
+    version = master_version()
+    if (isinstance(order_data, ValidatedOrders) and
+            order_data.fingerprint == validation_fingerprint(order_data, auto_learn, version)):
+        validated, learned_stores, learned_items = order_data, [], []
+    else:
+        validated, learned_stores, learned_items = _validate_rows(order_data, auto_learn, version)
+    
+    # 自動学習の結果を表示
+    if auto_learn:
+        if learned_stores:
+            report.success(f"✨ 新しい店舗名を学習しました: {', '.join(learned_stores)}")
+        if learned_items:
+            report.success(f"✨ 新しい品目名を学習しました: {', '.join(learned_items)}")
+    
+    # エラーがある場合は表示
+    if validated.errors:
+        report.warning("⚠️ 検証で以下の問題が見つかりました:")
+        for error in validated.errors:
+            report.write(f"- {error}")
+    
+    return validated
+
+
+def _validate_rows(order_data, auto_learn, version):
+    """
+    検証済みの行を再利用しながら全行を検証
+    （行のキャッシュはマスターのバージョンごと。検証済みの行そのものも検証済みとして登録する）
+    
+    Returns:
+        (ValidatedOrders, 学習した店舗名のリスト, 学習した品目名のリスト)
+    """
+    with _validation_lock:
+        if _validation_cache['version'] != version:
+            _validation_cache['version'] = version
+            _validation_cache['rows'].clear()
+        cached_rows = _validation_cache['rows']
+    
+    validated_data = []
+    errors = []
+    learned_stores = []
+    learned_items = []
+    new_rows = {}
+    known_stores = None
+    
+    for i, entry in enumerate(order_data):
+        key = (_row_hash(entry), auto_learn)
+        cached = cached_rows.get(key)
+        if cached is None:
+            if known_stores is None:
+                known_stores = get_known_stores()
+            validated_entry, row_errors, learned_store, learned_item = _validate_entry(entry, auto_learn, known_stores)
+            if learned_store and learned_store not in learned_stores:
+                learned_stores.append(learned_store)
+            if learned_item and learned_item not in learned_items:
+                learned_items.append(learned_item)
+            cached = (validated_entry, row_errors)
+            new_rows[key] = cached
+            new_rows[(_row_hash(validated_entry), auto_learn)] = cached
+        validated_entry, row_errors = cached
+        validated_data.append(dict(validated_entry))
+        errors.extend(f"行{i+1}: {error}" for error in row_errors)
+    
+    # 検証中の自動学習・入数登録でマスターが変わった場合は、変更前のバージョンで登録する
+    # （次回は変更後のマスターで全行を検証し直す）
+    with _validation_lock:
+        if _validation_cache['version'] == version:
+            cached_rows.update(new_rows)
+            while len(cached_rows) > VALIDATION_CACHE_SIZE:
+                cached_rows.popitem(last=False)  # 古いものから破棄
+    
+    validated = ValidatedOrders(validated_data, validation_fingerprint(validated_data, auto_learn, version), errors)
+    return validated, learned_stores, learned_items
+
+
+def get_unit_label_for_item(item: str, spec: str) -> str:
+    """
+    品目名と規格から単位を判定（品目設定を優先）
+    
+    Args:
+        item: 品目名
+        spec: 規格
+    
+    Returns:
+        単位（'本'、'袋'など）
+    """
+    # まず品目設定から取得を試みる
+    setting = get_item_setting(item)
+    if setting.get("unit_type"):
+        return setting["unit_type"]
+    
+    # 品目設定がない場合、従来のロジックで判定
+    item_lower = item.lower() if item else ""
+    spec_lower = spec.lower() if spec else ""
+    
+    # 単位を判定（品目名と規格から判定）
+    unit_label = '本'  # デフォルト
+    
+    # 長ねぎバラの判定（品目名に「バラ」が含まれる場合）
+    if '長ねぎバラ' in item or '長ネギバラ' in item or 'ネギバラ' in item or 'ねぎバラ' in item or '長ねぎばら' in item:
+        unit_label = '本'
+    # 長ねぎ（袋）の判定
+    elif ('ネギ' in item or 'ねぎ' in item) and 'バラ' not in item and 'ばら' not in item:
+        unit_label = '袋'
+    # 胡瓜バラの判定（品目名に「バラ」が含まれる場合）
+    elif '胡瓜バラ' in item or 'きゅうりバラ' in item or 'キュウリバラ' in item or '胡瓜ばら' in item:
+        unit_label = '本'
+    # 胡瓜（袋）の判定
+    elif ('胡瓜' in item or 'きゅうり' in item) and 'バラ' not in item and 'ばら' not in item:
+        unit_label = '袋'
+    # 規格で判定（後方互換性のため）
+    elif 'バラ' in spec or 'ばら' in spec_lower:
+        if '胡瓜' in item or 'きゅうり' in item:
+            unit_label = '本'
+        elif 'ネギ' in item or 'ねぎ' in item:
+            unit_label = '本'
+    # その他の品目
+    elif '春菊' in item or '青梗菜' in item or 'チンゲン菜' in item:
+        unit_label = '袋'
+    
+    return unit_label
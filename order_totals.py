@@ -0,0 +1,124 @@
+"""
+注文データの集計
+出荷一覧表・LINE用集計・PDFの品目別総数を、同じ集計結果（pandasでまとめて計算）から作る
+"""
+from datetime import datetime
+from typing import Dict, List, Union
+
+import pandas as pd
+
+from numeric_utils import safe_int
+
+ORDER_COLUMNS = ['store', 'item', 'spec', 'unit', 'boxes', 'remainder']
+ROW_COLUMNS = ['store', 'item', 'spec', 'item_display', 'boxes', 'rem_box',
+               'total_packs', 'total_quantity', 'unit', 'unit_label']
+
+
+def _display_name(item: pd.Series, spec: pd.Series) -> pd.Series:
+    """品目表示名：荷姿(spec)があれば「品目 荷姿」（一覧表・総数で共通）"""
+    return (item + ' ' + spec).str.strip().where(spec != '', item)
+
+
+def _int_column(values: pd.Series) -> pd.Series:
+    """数値列を整数にそろえる（文字列の混じった列だけ safe_int で1件ずつ変換）"""
+    if pd.api.types.is_integer_dtype(values):
+        return values.astype('int64')
+    if pd.api.types.is_float_dtype(values):  # 欠損値(None)があると数値列は小数になる
+        return values.fillna(0).astype('int64')
+    return values.map(safe_int).astype('int64')
+
+
+def item_totals(rows: Union[pd.DataFrame, List[Dict]]) -> pd.DataFrame:
+    """
+    品目（品目+荷姿）ごとの総数
+    
+    Args:
+        rows: 行ごとの集計（total_quantity・unit_label を含む）。出荷一覧表用のデータのリストでも可
+    
+    Returns:
+        item, spec, item_display, total_quantity, unit_label の DataFrame（品目名→規格の順）
+    """
+    if not isinstance(rows, pd.DataFrame):
+        rows = pd.DataFrame.from_records(list(rows), columns=['item', 'spec', 'total_quantity', 'unit_label'])
+    frame = pd.DataFrame({
+        'item': rows['item'].fillna('').astype(str),
+        # キーをitemとspecの組み合わせにする（胡瓜の3本Pとバラを別物として扱う）
+        'spec': rows['spec'].fillna('').astype(str).str.strip(),
+        'total_quantity': _int_column(rows['total_quantity'].fillna(0)),
+        'unit_label': rows['unit_label'].fillna('').astype(str),
+    })
+    totals = frame.groupby(['item', 'spec'], sort=True).agg(
+        total_quantity=('total_quantity', 'sum'),
+        unit_label=('unit_label', 'last'),
+    ).reset_index()
+    totals.insert(2, 'item_display', _display_name(totals['item'], totals['spec']))
+    return totals
+
+
+class OrderTotals:
+    """注文データの集計結果（行ごと・店舗ごと・品目ごと）"""
+    
+    def __init__(self, rows: pd.DataFrame, by_store: pd.DataFrame, by_item: pd.DataFrame):
+        """
+        Args:
+            rows: 注文1行ごとの集計（ROW_COLUMNS）
+            by_store: 店舗ごとの合計（store, boxes, rem_box, total_packs）
+            by_item: 品目（品目+荷姿）ごとの総数（item_totals を参照）
+        """
+        self.rows = rows
+        self.by_store = by_store
+        self.by_item = by_item
+    
+    def summary_records(self) -> List[Dict]:
+        """出荷一覧表用のデータリスト（LabelPDFGenerator に渡す形式）"""
+        return self.rows.to_dict('records')
+    
+    def line_text(self) -> str:
+        """LINEに貼り付け可能な集計テキスト"""
+        line_text = f"【{datetime.now().strftime('%m/%d')} 出荷・作成総数】\n"
+        for display_name, total, unit_label in zip(self.by_item['item_display'],
+                                                   self.by_item['total_quantity'],
+                                                   self.by_item['unit_label']):
+            line_text += f"・{display_name}：{total}{unit_label}\n"
+        return line_text
+
+
+def aggregate_orders(order_data: List[Dict]) -> OrderTotals:
+    """
+    検証済みの注文データを集計
+    
+    Args:
+        order_data: 解析結果のリスト [{"store","item","spec","unit","boxes","remainder"}]
+    
+    Returns:
+        OrderTotals（単位の判定は品目+規格の組み合わせごとに1回だけ行う）
+    """
+    # order_parser は Gemini SDK を読み込むため、PDF描画用のプロセスでは読み込まないよう遅延import
+    from order_parser import get_unit_label_for_item
+    
+    orders = pd.DataFrame.from_records(list(order_data), columns=ORDER_COLUMNS)
+    rows = pd.DataFrame({
+        'store': orders['store'].fillna('').astype(str),
+        'item': orders['item'].fillna('').astype(str),
+        'spec': orders['spec'].fillna('').astype(str),
+        'unit': _int_column(orders['unit']),
+        'boxes': _int_column(orders['boxes']),
+        'remainder': _int_column(orders['remainder']),
+    })
+    
+    rows['item_display'] = _display_name(rows['item'], rows['spec'])
+    rows['rem_box'] = (rows['remainder'] > 0).astype('int64')
+    rows['total_packs'] = rows['boxes'] + rows['rem_box']  # フル箱 + 端数箱 = パック数
+    rows['total_quantity'] = rows['unit'] * rows['boxes'] + rows['remainder']  # 総数量
+    
+    # 単位を判定（品目+規格の組み合わせごとに1回）
+    pairs = rows[['item', 'spec']].drop_duplicates()
+    unit_labels = pd.Series(
+        [get_unit_label_for_item(item, spec) for item, spec in zip(pairs['item'], pairs['spec'])],
+        index=pd.MultiIndex.from_frame(pairs), dtype=object
+    )
+    rows['unit_label'] = unit_labels.reindex(pd.MultiIndex.from_frame(rows[['item', 'spec']])).to_numpy()
+    rows = rows[ROW_COLUMNS]
+    
+    by_store = rows.groupby('store', sort=False)[['boxes', 'rem_box', 'total_packs']].sum().reset_index()
+    return OrderTotals(rows, by_store, item_totals(rows))
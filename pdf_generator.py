@@ -9,8 +9,462 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.units import mm
 from reportlab.lib.colors import black, gray, white, HexColor
 from reportlab.platypus import Table, TableStyle
-from typing import List, Dict
+from typing import List, Dict, Optional, Union, BinaryIO, Callable, Iterator, Tuple
+from pathlib import Path
+from collections import OrderedDict
+import hashlib
+import io
+import json
+import math
 import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from order_totals import item_totals
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pypdf が無い環境では並列描画を使わない
+    PdfReader = PdfWriter = None
+
+
+# ==========================================
+# フォント登録（プロセス内で1回だけ）
+# - TTFの解析は重いため、解決・登録した結果をプロセス全体で共有する
+# - パスは環境変数 → config/fonts.json → 既定の候補 の順で探す
+# ==========================================
+
+FONT_PATH_ENV = "LABEL_FONT_PATH"  # 通常フォント（ipaexg.ttf）のパス
+BOLD_FONT_PATH_ENV = "LABEL_BOLD_FONT_PATH"  # 太字フォント（ipaexgb.ttf）のパス
+FONT_CONFIG_FILE = Path("config") / "fonts.json"  # {"regular": "...", "bold": "..."}
+
+DEFAULT_FONT_PATHS = [
+    'ipaexg.ttf',
+    'fonts/ipaexg.ttf',
+    'C:/Windows/Fonts/ipaexg.ttf',
+    '/usr/share/fonts/ipaexg.ttf',
+]
+DEFAULT_BOLD_FONT_PATHS = [
+    'ipaexgb.ttf',
+    'fonts/ipaexgb.ttf',
+    'C:/Windows/Fonts/ipaexgb.ttf',
+    '/usr/share/fonts/ipaexgb.ttf',
+]
+
+FONT_NAME = 'IPAGothic'
+BOLD_FONT_NAME = 'IPAGothic-Bold'
+
+_font_lock = threading.Lock()
+_font_registry: Dict[Optional[str], Dict] = {}
+
+
+def _font_candidates(kind: str) -> List[str]:
+    """フォントパスの候補（環境変数 → 設定ファイル → 既定の候補）"""
+    env_name, defaults = {
+        'regular': (FONT_PATH_ENV, DEFAULT_FONT_PATHS),
+        'bold': (BOLD_FONT_PATH_ENV, DEFAULT_BOLD_FONT_PATHS),
+    }[kind]
+    candidates = []
+    if os.environ.get(env_name):
+        candidates.append(os.environ[env_name])
+    if FONT_CONFIG_FILE.exists():
+        try:
+            with open(FONT_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                configured = json.load(f).get(kind)
+            if configured:
+                candidates.append(configured)
+        except Exception:
+            pass
+    return candidates + defaults
+
+
+def find_font_path(kind: str = 'regular') -> Optional[str]:
+    """存在するフォントファイルのパスを返す（見つからなければNone）"""
+    for path in _font_candidates(kind):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _font_version(path: Optional[str]) -> str:
+    """フォントファイルの識別子（差し替えを検知するため、サイズと更新日時）"""
+    if not path:
+        return ""
+    try:
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        return path
+
+
+def register_fonts(font_path: str = None) -> Dict:
+    """
+    日本語フォントを登録して結果を返す（プロセス内で1回だけ、スレッドセーフ）
+    
+    Args:
+        font_path: 通常フォントのパス（Noneの場合は候補から検索）
+    
+    Returns:
+        {font_path, font_available, bold_font_available, version}
+    """
+    fonts = _font_registry.get(font_path)
+    if fonts is not None:
+        return fonts
+    
+    with _font_lock:
+        fonts = _font_registry.get(font_path)
+        if fonts is not None:
+            return fonts
+        
+        resolved = font_path or find_font_path('regular') or 'ipaexg.ttf'
+        fonts = {
+            'font_path': resolved,
+            'font_available': False,
+            'bold_font_available': False,
+            'version': _font_version(resolved),
+        }
+        try:
+            if os.path.exists(resolved):
+                pdfmetrics.registerFont(TTFont(FONT_NAME, resolved))
+                _text_fit_cache.clear()
+                fonts['font_available'] = True
+                # 太字フォント（ipaexgb.ttf）があれば登録
+                bold_path = find_font_path('bold')
+                if bold_path:
+                    pdfmetrics.registerFont(TTFont(BOLD_FONT_NAME, bold_path))
+                    fonts['bold_font_available'] = True
+                    fonts['version'] += "|" + _font_version(bold_path)
+            else:
+                print(f"警告: フォントファイルが見つかりません: {resolved}")
+        except Exception as e:
+            print(f"フォント登録エラー: {e}")
+            fonts['font_available'] = False
+        
+        _font_registry[font_path] = fonts
+        return fonts
+
+
+# ==========================================
+# テキストのフィッティング
+# - 文字幅はフォントサイズに比例するので、1ptあたりの幅から直接サイズを求める
+# - 店舗名・品目は同じ文字列が何百回も出るため、結果をメモしておく
+# ==========================================
+
+MIN_FIT_FONT_SIZE = 8
+TEXT_FIT_CACHE_SIZE = 4096
+
+_text_fit_cache: Dict[tuple, tuple] = {}
+
+
+def fit_text(text: str, font_name: str, max_font_size: int,
+             box_width: float, box_height: float) -> tuple:
+    """
+    領域の9割に収まる最大のフォントサイズを求める
+    （1ptずつ縮小していた従来の結果と完全に一致させる）
+    
+    Returns:
+        (font_size, text_width, text_height) のタプル
+    """
+    key = (text, font_name, max_font_size, box_width, box_height)
+    cached = _text_fit_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    max_width = box_width * 0.9
+    max_height = box_height * 0.9
+    
+    def fits(size):
+        return (pdfmetrics.stringWidth(text, font_name, size) <= max_width and
+                size * 0.7 <= max_height)
+    
+    # 比例関係からおおよそのサイズを求め、前後1ptを実測で確認する
+    font_size = max_font_size
+    unit_width = pdfmetrics.stringWidth(text, font_name, 1)
+    if unit_width > 0:
+        font_size = min(font_size, int(max_width / unit_width))
+    font_size = min(font_size, int(max_height / 0.7))
+    font_size = max(font_size, MIN_FIT_FONT_SIZE)
+    while font_size < max_font_size and fits(font_size + 1):
+        font_size += 1
+    while font_size > MIN_FIT_FONT_SIZE and not fits(font_size):
+        font_size -= 1
+    if font_size > max_font_size:
+        font_size = max_font_size
+    
+    result = (font_size, pdfmetrics.stringWidth(text, font_name, font_size), font_size * 0.7)
+    if len(_text_fit_cache) >= TEXT_FIT_CACHE_SIZE:
+        _text_fit_cache.clear()
+    _text_fit_cache[key] = result
+    return result
+
+
+# ==========================================
+# 再印刷用のページ・ラベル指定
+# ==========================================
+
+def parse_page_ranges(text: str) -> List[int]:
+    """
+    「7」「3-5」「1,4,9-11」のようなページ指定をページ番号のリストに変換
+    
+    Raises:
+        ValueError: 数字・範囲として読めない場合
+    """
+    pages = []
+    text = re.sub(r'\s*([-〜~])\s*', r'\1', text.strip())  # 「3 - 5」も範囲として読む
+    for part in re.split(r'[,、\s]+', text):
+        if not part:
+            continue
+        m = re.fullmatch(r'(\d+)[-〜~](\d+)', part)
+        if m:
+            first, last = int(m.group(1)), int(m.group(2))
+            if first > last:
+                first, last = last, first
+            pages.extend(range(first, last + 1))
+        elif part.isdigit():
+            pages.append(int(part))
+        else:
+            raise ValueError(f"ページ指定を読み取れません: {part}")
+    return pages
+
+
+def label_box_numbers(label: Dict) -> Tuple[Optional[int], Optional[int]]:
+    """ラベルの (箱番号, 総箱数) を返す（持たないラベルは None）"""
+    return label.get('box_no'), label.get('box_total')
+
+
+def is_fraction_label(label: Dict) -> bool:
+    """端数ラベルとして描くか（is_fractionフラグ、または2箱以上の最後の箱）"""
+    if label.get('is_fraction', False):
+        return True
+    box_no, box_total = label_box_numbers(label)
+    return box_total is not None and box_no == box_total and box_total > 1
+
+
+def make_label_filter(store: str = None, item: str = None,
+                      box_from: int = None, box_to: int = None) -> Callable[[Dict], bool]:
+    """
+    店舗・品目・箱番号（通し番号「3/6」の3）の範囲でラベルを選ぶ関数を作る
+    （指定しなかった条件は絞り込まない）
+    """
+    def label_filter(label: Dict) -> bool:
+        if store and label.get('store') != store:
+            return False
+        if item and label.get('item') != item:
+            return False
+        if box_from is not None or box_to is not None:
+            box_no = label_box_numbers(label)[0]
+            if box_no is None:
+                return False
+            if box_from is not None and box_no < box_from:
+                return False
+            if box_to is not None and box_no > box_to:
+                return False
+        return True
+    return label_filter
+
+
+# ==========================================
+# ラベル用紙のレイアウト
+# - 用紙サイズ・列数・段数・余白・ラベル間の隙間から、各スロットの座標を1回だけ計算する
+# - スロット番号は左上から右へ、段ごとに下へ（2列x4段なら 左上=0, 右上=1, 左2段目=2 ...）
+# ==========================================
+
+class LabelSheetLayout:
+    """ラベル用紙のレイアウト（スロット座標は作成時に計算済み）"""
+    
+    # ラベル内の文字サイズ等の基準にするラベルサイズ（2列x4段のA4）
+    BASE_LABEL_WIDTH = 105 * mm
+    BASE_LABEL_HEIGHT = 74.25 * mm
+    
+    def __init__(self, name: str, columns: int, rows: int,
+                 page_width: float = 210 * mm, page_height: float = 297 * mm,
+                 margin_left: float = 0, margin_right: float = 0,
+                 margin_top: float = 0, margin_bottom: float = 0,
+                 gutter_x: float = 0, gutter_y: float = 0, description: str = ""):
+        """
+        Args:
+            name: レイアウト名（例: "2x4"）
+            columns: 列数
+            rows: 段数
+            page_width, page_height: 用紙サイズ（pt）
+            margin_*: 用紙の余白（pt）
+            gutter_x, gutter_y: ラベル間の隙間（pt）
+            description: 画面表示用の説明
+        """
+        self.name = name
+        self.columns = columns
+        self.rows = rows
+        self.page_width = page_width
+        self.page_height = page_height
+        self.margin_left = margin_left
+        self.margin_top = margin_top
+        self.gutter_x = gutter_x
+        self.gutter_y = gutter_y
+        self.description = description
+        self.labels_per_page = columns * rows
+        self.label_width = (page_width - margin_left - margin_right - gutter_x * (columns - 1)) / columns
+        self.label_height = (page_height - margin_top - margin_bottom - gutter_y * (rows - 1)) / rows
+        # 文字サイズ等の縮尺（2列x4段を1.0とする）
+        self.scale = min(self.label_width / self.BASE_LABEL_WIDTH, self.label_height / self.BASE_LABEL_HEIGHT, 1.0)
+        
+        # スロットごとの (列, 段, ラベル左下のx, ラベル左下のy)
+        self.slots = []
+        for slot in range(self.labels_per_page):
+            col, row = slot % columns, slot // columns
+            x = margin_left + col * (self.label_width + gutter_x)
+            y = page_height - margin_top - (row + 1) * self.label_height - row * gutter_y
+            self.slots.append((col, row, x, y))
+
+
+LABEL_LAYOUTS = {
+    '2x4': LabelSheetLayout('2x4', 2, 4, description="A4 2列x4段（8面・標準）"),
+    '2x5': LabelSheetLayout('2x5', 2, 5, description="A4 2列x5段（10面）"),
+    '3x8': LabelSheetLayout('3x8', 3, 8, description="A4 3列x8段（24面）"),
+}
+DEFAULT_LABEL_LAYOUT = '2x4'
+
+
+def get_label_layout(layout: Union[str, LabelSheetLayout, None] = None) -> LabelSheetLayout:
+    """レイアウト名（またはLabelSheetLayout）からレイアウトを取得（Noneは標準の2列x4段）"""
+    if isinstance(layout, LabelSheetLayout):
+        return layout
+    name = layout or DEFAULT_LABEL_LAYOUT
+    if name not in LABEL_LAYOUTS:
+        raise ValueError(f"未対応のラベルレイアウトです: {name}（{', '.join(LABEL_LAYOUTS)}）")
+    return LABEL_LAYOUTS[name]
+
+
+# ==========================================
+# 生成済みPDFのキャッシュ
+# - ラベル・出荷一覧表・出荷日・レイアウト・フォントのハッシュをキーにする
+# - 同じ内容なら描画せずに保存済みのバイト列を返す（メモリ上 + 任意でディスクにLRUで保持）
+# ==========================================
+
+PDF_CACHE_DIR_ENV = "LABEL_PDF_CACHE_DIR"  # 指定するとディスクにもキャッシュする
+
+
+def _cache_key_default(value):
+    """JSONにできない値の変換（cache_token() を持つラベル等はその内容、それ以外は文字列）"""
+    cache_token = getattr(value, 'cache_token', None)
+    if callable(cache_token):
+        return cache_token()
+    return str(value)
+
+
+def make_pdf_cache_key(*parts) -> str:
+    """キャッシュキー（JSONにした内容のSHA-256）"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=_cache_key_default)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PDFCache:
+    """生成済みPDFのLRUキャッシュ（スレッドセーフ）"""
+    
+    def __init__(self, max_items: int = 16, cache_dir: str = None, max_disk_items: int = 200):
+        """
+        Args:
+            max_items: メモリ上に保持する件数
+            cache_dir: ディスクキャッシュのディレクトリ（Noneの場合はメモリのみ）
+            max_disk_items: ディスク上に保持する件数
+        """
+        self.max_items = max_items
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_disk_items = max_disk_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[bytes]:
+        """キャッシュ済みのバイト列（無ければNone）"""
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                return data
+        
+        if self.cache_dir:
+            path = self.cache_dir / f"{key}.bin"
+            try:
+                data = path.read_bytes()
+                os.utime(path)  # 最終利用日時を更新（LRUの順序に使う）
+            except OSError:
+                return None
+            self._remember(key, data)
+            return data
+        return None
+    
+    def put(self, key: str, data: bytes):
+        """バイト列をキャッシュに保存"""
+        self._remember(key, data)
+        if self.cache_dir:
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.cache_dir / f"{key}.tmp"
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, self.cache_dir / f"{key}.bin")
+                self._evict_disk()
+            except OSError as e:
+                print(f"PDFキャッシュの保存エラー: {e}")
+    
+    def clear(self):
+        """メモリ上のキャッシュを消去"""
+        with self._lock:
+            self._items.clear()
+    
+    def _remember(self, key: str, data: bytes):
+        with self._lock:
+            self._items[key] = data
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+    
+    def _evict_disk(self):
+        """ディスク上の古いもの（最終利用日時が古い順）から削除"""
+        files = sorted(self.cache_dir.glob("*.bin"), key=lambda f: f.stat().st_mtime)
+        for f in files[:max(0, len(files) - self.max_disk_items)]:
+            try:
+                f.unlink()
+            except OSError:
+                pass
+
+
+# アプリ全体で共有するキャッシュ（Streamlitの再実行でも消えないようモジュールに置く）
+PDF_CACHE = PDFCache(cache_dir=os.environ.get(PDF_CACHE_DIR_ENV) or None)
+
+
+# ==========================================
+# 並列描画の設定
+# - 既定では使わない（benchmarks/bench_parallel_pdf.py の計測では1プロセスの方が速い）
+# - 環境変数で明示したときだけ使う（結合結果はベンチマークで1プロセスの出力とページごとに照合できる）
+# ==========================================
+
+PDF_WORKERS_ENV = "LABEL_PDF_WORKERS"  # 2以上を指定すると並列描画を使う
+PDF_PARALLEL_MIN_LABELS_ENV = "LABEL_PDF_PARALLEL_MIN_LABELS"  # 並列描画を使う最小ラベル数
+
+
+def _env_int(env_name: str) -> Optional[int]:
+    """環境変数の整数値（未指定・不正な値はNone）"""
+    value = os.environ.get(env_name, '').strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        print(f"{env_name} の値が整数ではないため無視します: {value}")
+        return None
+
+
+def configured_render_workers() -> int:
+    """環境変数で指定された描画プロセス数（未指定は1、CPUのコア数を上限にする）"""
+    workers = _env_int(PDF_WORKERS_ENV) or 1
+    return max(1, min(workers, os.cpu_count() or 1))
+
+
+def configured_parallel_min_labels() -> Optional[int]:
+    """環境変数で指定された並列描画の最小ラベル数（未指定はNone = LabelPDFGenerator.PARALLEL_MIN_LABELS）"""
+    return _env_int(PDF_PARALLEL_MIN_LABELS_ENV)
 
 
 class LabelPDFGenerator:
@@ -20,121 +474,216 @@ class LabelPDFGenerator:
     A4_WIDTH = 210 * mm
     A4_HEIGHT = 297 * mm
     
-    # ラベルサイズ（2列x4段）
+    # 標準レイアウト（2列x4段）のラベルサイズ
+    # 実際の寸法はレイアウトに合わせてインスタンスの label_width 等を使う
     LABEL_WIDTH = 105 * mm  # 210 / 2
     LABEL_HEIGHT = 74.25 * mm  # 297 / 4
     
-    # 1ページあたりのラベル数
+    # 標準レイアウトの1ページあたりのラベル数
     LABELS_PER_PAGE = 8
     
-    def __init__(self, font_path: str = None):
+    # 出荷一覧表の下マージン（これより下には表・総数を描かない）
+    SUMMARY_BOTTOM_MARGIN = 15 * mm
+    
+    # 並列描画（generate_pdfのworkers）を使う最小ラベル数の既定値と、1プロセスあたりのチャンク数
+    # benchmarks/bench_parallel_pdf.py では約1万枚まで1プロセスの方が速く（プロセス起動とPDFの結合、
+    # チャンクごとのフォント埋め込みの分だけ遅くなりサイズも増える）、測った範囲より多い場合だけ並列にする
+    # （呼び出し側がworkersを2以上にしたときだけ使う。閾値はparallel_min_labelsで変えられる）
+    PARALLEL_MIN_LABELS = 20000
+    PARALLEL_CHUNKS_PER_WORKER = 2
+    
+    # Form XObjectの描画範囲の余白（ラベル端の線が切れないように）
+    FORM_MARGIN = 5
+    
+    def __init__(self, font_path: str = None, layout: Union[str, LabelSheetLayout] = None,
+                 parallel_min_labels: int = None):
         """
         初期化
         
         Args:
-            font_path: IPAexGothicフォントのパス（Noneの場合はデフォルトパスを試行）
+            font_path: IPAexGothicフォントのパス（Noneの場合は環境変数・設定ファイル・既定パスを試行）
+            layout: ラベル用紙のレイアウト（"2x4" / "2x5" / "3x8" またはLabelSheetLayout、Noneは2x4）
+            parallel_min_labels: 並列描画を使う最小ラベル数（NoneはPARALLEL_MIN_LABELS）
         """
-        self.font_path = font_path or self._find_font_path()
+        self.font_path = font_path
+        self.parallel_min_labels = self.PARALLEL_MIN_LABELS if parallel_min_labels is None else parallel_min_labels
         self._register_font()
-    
-    def _find_font_path(self) -> str:
-        """IPAexGothicフォントのパスを検索"""
-        # 一般的なフォントパスを試行
-        possible_paths = [
-            'ipaexg.ttf',
-            'fonts/ipaexg.ttf',
-            'C:/Windows/Fonts/ipaexg.ttf',
-            '/usr/share/fonts/ipaexg.ttf',
-        ]
-        
-        for path in possible_paths:
-            if os.path.exists(path):
-                return path
         
-        # フォントが見つからない場合は警告を出すが、後でエラーハンドリング
-        return 'ipaexg.ttf'
+        self.layout = get_label_layout(layout)
+        self.page_width = self.layout.page_width
+        self.page_height = self.layout.page_height
+        self.label_width = self.layout.label_width
+        self.label_height = self.layout.label_height
+        self.labels_per_page = self.layout.labels_per_page
+    
+    def _font_size(self, size: int) -> int:
+        """2列x4段を基準にしたフォントサイズを、レイアウトの縮尺に合わせる"""
+        return max(1, round(size * self.layout.scale))
     
     def _register_font(self):
-        """IPAexGothicフォントを登録"""
-        self.bold_font_available = False
-        try:
-            if os.path.exists(self.font_path):
-                pdfmetrics.registerFont(TTFont('IPAGothic', self.font_path))
-                self.font_available = True
-                # 太字フォント（ipaexgb.ttf）があれば登録
-                bold_paths = [
-                    'ipaexgb.ttf', 'fonts/ipaexgb.ttf',
-                    'C:/Windows/Fonts/ipaexgb.ttf', '/usr/share/fonts/ipaexgb.ttf',
-                ]
-                for bp in bold_paths:
-                    if os.path.exists(bp):
-                        pdfmetrics.registerFont(TTFont('IPAGothic-Bold', bp))
-                        self.bold_font_available = True
-                        break
-            else:
-                print(f"警告: フォントファイルが見つかりません: {self.font_path}")
-                self.font_available = False
-        except Exception as e:
-            print(f"フォント登録エラー: {e}")
-            self.font_available = False
+        """IPAexGothicフォントを登録（登録済みならプロセス内の結果を再利用）"""
+        fonts = register_fonts(self.font_path)
+        self.font_path = fonts['font_path']
+        self.font_available = fonts['font_available']
+        self.bold_font_available = fonts['bold_font_available']
+        self.font_version = fonts['version']
     
     def _get_font_name(self) -> str:
         """使用するフォント名を返す"""
-        return 'IPAGothic' if self.font_available else 'Helvetica'
+        return FONT_NAME if self.font_available else 'Helvetica'
     
     def _get_font_name_bold(self) -> str:
         """日付等に使う太字フォント名を返す"""
         if self.bold_font_available:
-            return 'IPAGothic-Bold'
+            return BOLD_FONT_NAME
         return 'Helvetica-Bold'  # ReportLab標準の太字
     
-    def _rearrange_labels_for_cut_and_stack(self, labels: List[Dict]) -> List[Dict]:
+    def _cut_and_stack_pages(self, total_labels: int) -> int:
+        """Cut and Stack形式のラベルページ数P（ラベル数をスロット数で割って切り上げ）"""
+        return (total_labels + self.labels_per_page - 1) // self.labels_per_page
+    
+    def _iter_page_slots(self, page_idx: int, total_labels: int, 
+                         total_pages: int) -> Iterator[Tuple[int, int]]:
         """
-        Cut and Stack形式用にラベルを再配置
+        Cut and Stack形式で、ページpage_idxの各スロットに置く元ラベルのインデックスを返す
+        （再配置したリストは作らず、(ページ, スロット) から元のインデックスを計算で求める）
         
         仕様: 各ページnにおいて、各スロットに以下のインデックスのデータを配置
         - 左上（スロット0）: n番目
         - 右上（スロット1）: n + P番目
         - 左2段目（スロット2）: n + 2P番目
         - 右2段目（スロット3）: n + 3P番目
-        - ... (同様に右下まで計8スロット)
+        - ... (同様に右下まで、レイアウトのスロット数（2列x4段なら8）まで)
         
-        変換式:
-        - 元のインデックスiに対して:
-          - slot = i // P (スロット番号: 0-7)
-          - page = i % P (ページ番号: 0から開始)
-        - 再配置後のインデックスj = page * 8 + slot
+        変換式: 元のインデックス i = slot * P + page（i がラベル数以上のスロットは空）
+        
+        Yields:
+            (スロット番号, 元のラベルのインデックス)
+        """
+        for slot in range(self.labels_per_page):
+            i = slot * total_pages + page_idx
+            if i >= total_labels:
+                break  # スロット番号が大きいほどiも大きいので、以降のスロットはすべて空
+            yield slot, i
+    
+    def cache_key(self, kind: str, labels: List[Dict], summary_data: List[Dict], 
+                  shipment_date: str, **options) -> str:
+        """
+        生成結果のキャッシュキー（内容・レイアウト・フォントが同じなら同じキー）
         
         Args:
-            labels: 元のラベルリスト
-            
+            kind: 出力の種類（"pdf" / "zip"）
+            **options: pagesなど出力に影響するオプション
+        """
+        layout = {k: v for k, v in vars(self.layout).items() if k not in ('slots', 'description')}
+        return make_pdf_cache_key(kind, labels, summary_data, shipment_date, layout,
+                                  self.font_version, options)
+    
+    def render_bytes(self, labels: List[Dict], summary_data: List[Dict], 
+                     shipment_date: str, workers: int = 1, 
+                     cache: Optional[PDFCache] = None, **options) -> bytes:
+        """
+        PDFをメモリ上で生成してバイト列で返す（一時ファイルを使わない）
+        
+        Args:
+            labels: ラベル情報のリスト（全ラベル）
+            summary_data: 出荷一覧表用のデータ
+            shipment_date: 出荷日（YYYY-MM-DD形式）
+            workers: 並列描画に使うプロセス数（generate_pdfを参照）
+            cache: 指定した場合、同じ内容の生成済みPDFがあれば描画せずに返す
+                   （label_filterを指定した場合は内容を比較できないため使わない）
+            **options: generate_pdfのpages / label_filter / include_summary
+        
         Returns:
-            再配置されたラベルリスト（空のスロットは空の辞書で埋める）
+            PDFのバイト列
         """
-        total_labels = len(labels)
-        total_pages = (total_labels + self.LABELS_PER_PAGE - 1) // self.LABELS_PER_PAGE
+        key = None
+        if cache is not None and options.get('label_filter') is None:
+            key = self.cache_key('pdf', labels, summary_data, shipment_date, **options)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
         
-        if total_pages == 0:
-            return []
+        buffer = io.BytesIO()
+        self.generate_pdf(labels, summary_data, shipment_date, buffer, workers=workers, **options)
+        pdf_bytes = buffer.getvalue()
+        if key is not None:
+            cache.put(key, pdf_bytes)
+        return pdf_bytes
+    
+    def render_store_zip(self, labels: List[Dict], summary_data: List[Dict], 
+                         shipment_date: str, workers: int = 1,
+                         cache: Optional[PDFCache] = None) -> bytes:
+        """
+        店舗ごとに個別のPDF（その店舗の出荷一覧表 + 店舗内でCut and Stack配置したラベル）を生成し、
+        ZIPにまとめてバイト列で返す（店舗単位の印刷・再印刷用）
+        
+        Args:
+            labels: ラベル情報のリスト（全ラベル）
+            summary_data: 出荷一覧表用のデータ
+            shipment_date: 出荷日（YYYY-MM-DD形式）
+            workers: 2以上の場合、店舗ごとのPDFを複数プロセスで並列に生成
+                     （ラベルがparallel_min_labels枚未満の場合は1プロセスで生成。
+                     CPUのコア数は見ないので、呼び出し側で決めること）
+            cache: 指定した場合、同じ内容の生成済みZIPがあれば描画せずに返す
+        
+        Returns:
+            ZIPのバイト列（出荷ラベル_YYYYMMDD_店舗名.pdf を店舗数分含む）
+        """
+        key = None
+        if cache is not None:
+            key = self.cache_key('zip', labels, summary_data, shipment_date)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
         
-        total_slots = total_pages * self.LABELS_PER_PAGE
+        # 店舗ごとに分ける（店舗の並びは出荷一覧表の順）
+        store_labels = {}
+        store_summary = {}
+        for label in labels:
+            store_labels.setdefault(label.get('store', ''), []).append(label)
+        for entry in summary_data:
+            store_summary.setdefault(entry.get('store', ''), []).append(entry)
+        stores = list(dict.fromkeys(list(store_summary) + list(store_labels)))
         
-        # 再配置後のリストを初期化（空の辞書で埋める）
-        rearranged = [{}] * total_slots
+        jobs = [(self.font_path, self.layout, store_labels.get(store, []), store_summary.get(store, []), shipment_date)
+                for store in stores]
+        store_pdfs = None
+        workers = min(workers, len(jobs))
+        if workers > 1 and len(labels) >= self.parallel_min_labels:
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    store_pdfs = list(executor.map(_render_store_pdf, jobs))
+            except (OSError, BrokenProcessPool) as e:
+                print(f"並列描画に失敗したため1プロセスで描画します: {e}")
+        if store_pdfs is None:
+            store_pdfs = [self.render_bytes(job[2], job[3], shipment_date) for job in jobs]
         
-        # 元のインデックスiを、再配置後のインデックスjに変換
-        for i in range(total_labels):
-            slot = i // total_pages  # スロット番号 (0-7)
-            page = i % total_pages   # ページ番号 (0から開始)
-            # 再配置後のインデックス: ページpageのスロットslotの位置
-            j = page * self.LABELS_PER_PAGE + slot
-            if j < total_slots:
-                rearranged[j] = labels[i]
+        date_str = shipment_date.replace('-', '')
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            used_names = set()
+            for store, pdf_bytes in zip(stores, store_pdfs):
+                # ファイル名に使えない文字を置き換え、同名になった店舗は連番で区別
+                base_name = re.sub(r'[\\/:*?"<>|\s]+', '_', store).strip('_') or '店舗名なし'
+                file_name = f"出荷ラベル_{date_str}_{base_name}.pdf"
+                suffix = 2
+                while file_name in used_names:
+                    file_name = f"出荷ラベル_{date_str}_{base_name}_{suffix}.pdf"
+                    suffix += 1
+                used_names.add(file_name)
+                zf.writestr(file_name, pdf_bytes)
         
-        return rearranged
+        zip_bytes = buffer.getvalue()
+        if key is not None:
+            cache.put(key, zip_bytes)
+        return zip_bytes
     
     def generate_pdf(self, labels: List[Dict], summary_data: List[Dict], 
-                    shipment_date: str, output_path: str):
+                    shipment_date: str, output_path: Union[str, BinaryIO],
+                    workers: int = 1, pages: Optional[List[int]] = None,
+                    label_filter: Optional[Callable[[Dict], bool]] = None,
+                    include_summary: bool = True):
         """
         PDFを生成（複数ページ対応 + 出荷一覧表）
         Cut and Stack形式: 裁断後に重ねるだけで順番が揃う
@@ -143,119 +692,204 @@ class LabelPDFGenerator:
             labels: ラベル情報のリスト（全ラベル）
             summary_data: 出荷一覧表用のデータ
             shipment_date: 出荷日（YYYY-MM-DD形式）
-            output_path: 出力PDFファイルパス
+            output_path: 出力PDFファイルパス、またはバイナリのファイルライクオブジェクト（BytesIO等）
+            workers: 2以上の場合、ラベルページを分割して複数プロセスで並列描画し、1つのPDFに結合する
+                     （ラベルがparallel_min_labels枚未満、またはpypdfが無い場合は通常どおり1プロセスで描画。
+                     CPUのコア数は見ないので、呼び出し側で決めること）
+            pages: 再印刷用。描画するラベルページの番号（出荷一覧表を除いて1から数える）
+            label_filter: 再印刷用。Trueを返したラベルだけを描画（make_label_filterで作成）
+                          該当ラベルを含むページだけを、全体と同じ配置のまま出力する（他のスロットは空白）
+            include_summary: 出荷一覧表のページを含めるか
         """
-        c = canvas.Canvas(output_path, pagesize=(self.A4_WIDTH, self.A4_HEIGHT))
-        font_name = self._get_font_name()
+        if pages is not None or label_filter is not None:
+            self._generate_pdf_subset(labels, summary_data, shipment_date, output_path,
+                                      pages, label_filter, include_summary)
+            return
         
-        # 出荷日を表示用に変換（月/日、ゼロ埋めなし 例: 2/7）
-        from datetime import datetime
-        shipment_date_obj = datetime.strptime(shipment_date, '%Y-%m-%d')
-        shipment_date_display = f"{shipment_date_obj.month}月{shipment_date_obj.day}日"  # 口数と区別するため漢字表記
+        if workers > 1 and len(labels) >= self.parallel_min_labels and PdfWriter is not None:
+            try:
+                self._generate_pdf_parallel(labels, summary_data, shipment_date, output_path, workers)
+                return
+            except (OSError, BrokenProcessPool) as e:
+                print(f"並列描画に失敗したため1プロセスで描画します: {e}")
+                if hasattr(output_path, 'seek'):
+                    output_path.seek(0)
+                    output_path.truncate()
+        
+        c = canvas.Canvas(output_path, pagesize=(self.page_width, self.page_height))
+        font_name = self._get_font_name()
         
         # 1ページ目：出荷一覧表
-        self._draw_summary_page(c, summary_data, shipment_date_display, font_name)
+        self._draw_summary_page(c, summary_data, self._format_shipment_date(shipment_date), font_name)
         
         # 出荷一覧表の後に改ページ（ラベルページと分離）
         c.showPage()
         
-        # Cut and Stack形式に再配置
-        rearranged_labels = self._rearrange_labels_for_cut_and_stack(labels)
+        # Cut and Stack形式でラベルページを描画
+        total_pages = self._cut_and_stack_pages(len(labels))
+        self._draw_label_pages(c, labels, len(labels), range(total_pages), font_name)
+        
+        c.save()
+    
+    def _generate_pdf_subset(self, labels: List[Dict], summary_data: List[Dict], 
+                             shipment_date: str, output_path: Union[str, BinaryIO],
+                             pages: Optional[List[int]], label_filter: Optional[Callable[[Dict], bool]],
+                             include_summary: bool):
+        """
+        指定したページ・条件のラベルだけを描画（再印刷用）
+        配置は全体を生成した場合と同じなので、刷り直したシートもそのまま重ねられる
+        描画するのは選ばれたページだけなので、処理時間は再印刷する枚数に比例する
+        """
         total_labels = len(labels)
-        total_pages = (total_labels + self.LABELS_PER_PAGE - 1) // self.LABELS_PER_PAGE
-        
-        # スロット順序: 左上(0) → 右上(1) → 左2段目(2) → 右2段目(3) → ... → 右4段目(7)
-        slot_to_pos = [
-            (0, 0),  # スロット0: 左上
-            (1, 0),  # スロット1: 右上
-            (0, 1),  # スロット2: 左2段目
-            (1, 1),  # スロット3: 右2段目
-            (0, 2),  # スロット4: 左3段目
-            (1, 2),  # スロット5: 右3段目
-            (0, 3),  # スロット6: 左4段目
-            (1, 3),  # スロット7: 右4段目
-        ]
+        total_pages = self._cut_and_stack_pages(total_labels)
+        
+        page_indices = range(total_pages)
+        if pages is not None:
+            page_indices = sorted({p - 1 for p in pages if 1 <= p <= total_pages})
+        
+        c = canvas.Canvas(output_path, pagesize=(self.page_width, self.page_height))
+        font_name = self._get_font_name()
+        
+        if include_summary:
+            self._draw_summary_page(c, summary_data, self._format_shipment_date(shipment_date), font_name)
+            c.showPage()
+        
+        # 条件に合わないラベルのスロットは空白のまま、該当ラベルを含むページだけを描画
+        drawn_pages = self._draw_label_pages(c, labels, total_labels, page_indices, font_name, label_filter)
+        if not drawn_pages:
+            raise ValueError("指定されたページ・条件に該当するラベルがありません")
+        
+        c.save()
+    
+    def _format_shipment_date(self, shipment_date: str) -> str:
+        """出荷日を表示用に変換（月/日、ゼロ埋めなし 例: 2月7日）"""
+        from datetime import datetime
+        shipment_date_obj = datetime.strptime(shipment_date, '%Y-%m-%d')
+        return f"{shipment_date_obj.month}月{shipment_date_obj.day}日"  # 口数と区別するため漢字表記
+    
+    def _generate_pdf_parallel(self, labels: List[Dict], summary_data: List[Dict], 
+                               shipment_date: str, output_path: Union[str, BinaryIO],
+                               workers: int):
+        """
+        再配置後のラベルページを連続したページ範囲（チャンク）に分け、
+        プロセスプールで並列に描画してから元のページ順で結合する
+        （先頭のチャンクに出荷一覧表を含める）
+        """
+        total_labels = len(labels)
+        total_pages = self._cut_and_stack_pages(total_labels)
+        
+        # 処理時間のばらつきを均すため、プロセス数より多めのチャンクに分ける
+        chunk_count = min(total_pages, workers * self.PARALLEL_CHUNKS_PER_WORKER)
+        pages_per_chunk = math.ceil(total_pages / chunk_count)
+        jobs = []
+        for first_page in range(0, total_pages, pages_per_chunk):
+            chunk_pages = range(first_page, min(total_pages, first_page + pages_per_chunk))
+            # このチャンクのページに載るラベルだけを渡す（元のインデックス → ラベル）
+            chunk_labels = {
+                i: labels[i]
+                for page_idx in chunk_pages
+                for slot, i in self._iter_page_slots(page_idx, total_labels, total_pages)
+            }
+            jobs.append((
+                self.font_path,
+                self.layout,
+                summary_data if first_page == 0 else None,
+                shipment_date,
+                chunk_labels,
+                chunk_pages,
+                total_labels,
+            ))
+        
+        writer = PdfWriter()
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            # mapは投入順に結果を返すので、Cut and Stackのページ順がそのまま保たれる
+            for chunk_pdf in executor.map(_render_pdf_chunk, jobs):
+                writer.append(PdfReader(io.BytesIO(chunk_pdf)))
+        writer.write(output_path)
+    
+    def _draw_label_pages(self, c: canvas.Canvas, labels, total_labels: int, 
+                          page_indices, font_name: str,
+                          label_filter: Optional[Callable[[Dict], bool]] = None) -> int:
+        """
+        Cut and Stack形式でラベルページを描画
+        
+        Args:
+            labels: 元の順序のラベル（labels[i] で取り出せればリスト以外でも可）
+            total_labels: 全体のラベル数
+            page_indices: 描画するページ番号（0から開始）
+            label_filter: 指定した場合、Trueを返したラベルだけを描画し、該当が無いページは飛ばす
+        
+        Returns:
+            描画したページ数
+        """
+        total_pages = self._cut_and_stack_pages(total_labels)
+        drawn_pages = 0
         
         # 各ページを描画
-        for page_idx in range(total_pages):
-            if page_idx > 0:  # 2ページ目以降は改ページ
-                c.showPage()
-            
-            # このページの各スロットを描画
-            for slot in range(self.LABELS_PER_PAGE):
-                # 再配置後のインデックス: ページpage_idxのスロットslotの位置
-                rearranged_idx = page_idx * self.LABELS_PER_PAGE + slot
-                
-                # 空のスロットはスキップ（エラーを防ぐ）
-                if rearranged_idx >= len(rearranged_labels):
+        for page_idx in page_indices:
+            slot_labels = [(slot, labels[i])
+                           for slot, i in self._iter_page_slots(page_idx, total_labels, total_pages)]
+            if label_filter is not None:
+                slot_labels = [(slot, label) for slot, label in slot_labels if label_filter(label)]
+                if not slot_labels:
                     continue
-                
-                label = rearranged_labels[rearranged_idx]
-                
-                # 空の辞書の場合はスキップ
-                if not label or not label.get('store'):
-                    continue
-                
-                # スロット位置から列・行を取得
-                col, row = slot_to_pos[slot]
-                
-                # 座標計算
-                x = col * self.LABEL_WIDTH
-                y = self.A4_HEIGHT - (row + 1) * self.LABEL_HEIGHT
-                
-                # 端数ラベルの判定を改善（is_fractionフラグまたはquantityが満杯でない場合）
-                is_fraction = label.get('is_fraction', False)
-                if not is_fraction:
-                    # sequenceが「X/X」形式（最後の箱）の場合も端数と判定
-                    sequence = label.get('sequence', '')
-                    if '/' in sequence:
-                        parts = sequence.split('/')
-                        if len(parts) == 2:
-                            try:
-                                current = int(parts[0])
-                                total = int(parts[1])
-                                if current == total and total > 1:
-                                    is_fraction = True
-                            except ValueError:
-                                pass
-                
-                # ラベルを描画
-                if is_fraction:
-                    self._draw_fraction_label(c, x, y, label, font_name)
-                else:
-                    self._draw_standard_label(c, x, y, label, font_name)
-                
-                # 切断用ガイド線（再配置後のインデックスを使用）
-                # 最後のラベルかどうかは、再配置後のインデックスとtotal_labelsで判定
-                is_last_label = (rearranged_idx >= total_labels - 1)
-                self._draw_guide_lines(c, x, y, col, row, rearranged_idx, total_labels, is_last_label)
+            if drawn_pages > 0:  # 2ページ目以降は改ページ
+                c.showPage()
+            self._draw_label_page(c, slot_labels, page_idx, total_labels, font_name)
+            drawn_pages += 1
+        return drawn_pages
+    
+    def _draw_label_page(self, c: canvas.Canvas, slot_labels: List[Tuple[int, Dict]], 
+                         page_idx: int, total_labels: int, font_name: str):
+        """
+        1ページ分のラベルを描画
         
-        c.save()
+        Args:
+            slot_labels: このページに置く (スロット番号, ラベル) のリスト
+            page_idx: 全体でのページ番号（0から開始）
+            total_labels: 全体のラベル数（最後のラベルの判定に使用）
+        """
+        # このページの各スロットを描画
+        for slot, label in slot_labels:
+            # 店舗名の無いラベルは描画しない
+            if not label.get('store'):
+                continue
+            
+            # 再配置後のインデックス（全体）: ページpage_idxのスロットslotの位置
+            rearranged_idx = page_idx * self.labels_per_page + slot
+            
+            # スロット位置（列・段・座標）はレイアウトで計算済み
+            col, row, x, y = self.layout.slots[slot]
+            
+            # ラベルを描画
+            if is_fraction_label(label):
+                self._draw_fraction_label(c, x, y, label, font_name)
+            else:
+                self._draw_standard_label(c, x, y, label, font_name)
+            
+            # 切断用ガイド線（再配置後のインデックスを使用）
+            # 最後のラベルかどうかは、再配置後のインデックスとtotal_labelsで判定
+            is_last_label = (rearranged_idx >= total_labels - 1)
+            self._draw_guide_lines(c, x, y, col, row, rearranged_idx, total_labels, is_last_label)
     
     def _draw_summary_page(self, c: canvas.Canvas, summary_data: List[Dict], 
                           shipment_date: str, font_name: str):
-        """出荷一覧表ページを描画（TableオブジェクトとTableStyleを使用）"""
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.platypus import Paragraph
-        
+        """
+        出荷一覧表ページを描画（TableオブジェクトとTableStyleを使用）
+        行数が多い場合は複数ページに分割し、各ページにヘッダー行を繰り返す
+        （行の高さを最初に1回だけ測り、ページ割りは行数から直接計算する）
+        """
         # フォントサイズを調整（A4一枚に確実に収まるように最適化）
         title_font_size = 26
-        header_font_size = 16
-        data_font_size = 14
         summary_title_font_size = 17
         summary_data_font_size = 14
         
-        # タイトル（上マージン最小限に）
-        c.setFont(font_name, title_font_size)
-        c.drawString(10 * mm, self.A4_HEIGHT - 22 * mm, f"【出荷一覧表】 {shipment_date}")
-        
         # テーブルデータの準備
-        table_data = []
         # ヘッダー行
         header_row = ["店舗名", "品目", "フル箱", "端数箱", "総数"]
-        table_data.append(header_row)
         
         # データ行（品目列は品目+荷姿の表示名を使用＝マスターで管理した判別しやすい名称）
+        data_rows = []
         for entry in summary_data:
             store = str(entry.get('store', ''))
             item_display = str(entry.get('item_display', entry.get('item', '')))
@@ -264,16 +898,114 @@ class LabelPDFGenerator:
             total_quantity = entry.get('total_quantity', 0)
             unit_label = entry.get('unit_label', '')
             total_display = f"{total_quantity}{unit_label}" if total_quantity > 0 and unit_label else str(total_quantity)
-            table_data.append([store, item_display, boxes, rem_box, total_display])
+            data_rows.append([store, item_display, boxes, rem_box, total_display])
+        
+        # テーブルを描画する位置（左右マージン10mm）
+        table_x = 10 * mm
+        table_y = self.page_height - 48 * mm
+        bottom_y = self.SUMMARY_BOTTOM_MARGIN
+        
+        # ヘッダー行・データ行の高さを1回だけ測る（1行テキストなので全行同じ高さ）
+        header_height = self._build_summary_table([header_row], font_name).wrap(0, 0)[1]
+        sample_row = data_rows[:1] or [[""] * len(header_row)]
+        data_height = self._build_summary_table([header_row] + sample_row, font_name).wrap(0, 0)[1] - header_height
+        rows_per_page = max(1, int((table_y - bottom_y - header_height) // data_height))
+        
+        # ページごとに行を切り出して描画（ヘッダー行は各ページで繰り返す）
+        page_starts = list(range(0, len(data_rows), rows_per_page)) or [0]
+        for page_no, row_start in enumerate(page_starts):
+            if page_no > 0:
+                c.showPage()
+            self._draw_summary_title(c, f"【出荷一覧表】 {shipment_date}" + ("（続き）" if page_no > 0 else ""),
+                                     font_name, title_font_size)
+            page_rows = data_rows[row_start:row_start + rows_per_page]
+            table = self._build_summary_table(
+                [header_row] + page_rows, font_name,
+                row_heights=[header_height] + [data_height] * len(page_rows),
+                odd_start=row_start % 2 == 1
+            )
+            table_width, table_height = table.wrap(0, 0)  # 行の高さ指定済みのため計算は軽い
+            table.drawOn(c, table_x, table_y - table_height)
+        
+        # 品目ごとの総数セクション用のY座標を更新
+        current_y = table_y - table_height - 10 * mm
+        
+        # 品目ごとの総数セクションを追加
+        # テーブルの下に余白を確保（A4一枚に収まるように調整）
+        summary_start_y = current_y - 8 * mm
+        
+        # 品目（品目+荷姿）ごとに集計（品目名→規格の順、LINE用集計と共通）
+        totals = item_totals(summary_data)
+        sorted_items = list(zip(totals['item_display'], totals['total_quantity'], totals['unit_label']))
+        
+        # 品目ごとの総数を2列で表示（左半分・右半分に分割）
+        row_height = 13 * mm  # 1行あたりの高さ
+        left_x = 10 * mm
+        right_x = self.page_width / 2 + 12 * mm  # 右列は用紙中央 + 余白
+        summary_title = f"【{shipment_date} 出荷・作成総数】"
+        
+        # 表の下に収まらない場合は改ページし、1ページに収まらない分はさらに分割
+        def rows_fitting(start_y):
+            return max(0, math.floor((start_y - 14 * mm - bottom_y) / row_height) + 1)
+        
+        top_y = self.page_height - 22 * mm
+        items_per_page = max(1, len(sorted_items))
+        if summary_start_y < bottom_y or rows_fitting(summary_start_y) * 2 < len(sorted_items):
+            c.showPage()
+            summary_start_y = top_y
+            items_per_page = max(2, rows_fitting(top_y) * 2)
+        
+        item_starts = list(range(0, len(sorted_items), items_per_page)) or [0]
+        for page_no, item_start in enumerate(item_starts):
+            if page_no > 0:
+                c.showPage()
+                summary_start_y = top_y
+            page_items = sorted_items[item_start:item_start + items_per_page]
+            
+            # 品目ごとの総数セクションのタイトル
+            c.setFont(font_name, summary_title_font_size)
+            c.drawString(10 * mm, summary_start_y, summary_title)
+            
+            c.setFont(font_name, summary_data_font_size)
+            summary_y_base = summary_start_y - 14 * mm
+            n = len(page_items)
+            mid = (n + 1) // 2  # 左列に1つ多くする場合: 0〜mid-1 が左、mid〜n-1 が右
+            
+            # 左列・右列を描画（品目表示名＝品目+荷姿で統一）
+            for column_x, column_items in ((left_x, page_items[:mid]), (right_x, page_items[mid:])):
+                column_y = summary_y_base
+                for display_name, total, unit_label in column_items:
+                    summary_text = f"・{display_name}：{total}{unit_label}"
+                    c.drawString(column_x, column_y, summary_text)
+                    column_y -= row_height
+    
+    def _draw_summary_title(self, c: canvas.Canvas, title: str, font_name: str, font_size: int):
+        """出荷一覧表のタイトル（上マージン最小限に）"""
+        c.setFont(font_name, font_size)
+        c.drawString(10 * mm, self.page_height - 22 * mm, title)
+    
+    def _build_summary_table(self, table_data: List[List[str]], font_name: str,
+                             row_heights: List[float] = None, odd_start: bool = False) -> Table:
+        """
+        出荷一覧表の1ページ分のTableを作成
+        
+        Args:
+            table_data: ヘッダー行 + データ行
+            row_heights: 行の高さ（指定すると各セルの高さ計算を省略）
+            odd_start: 先頭のデータ行が全体で奇数番目か（行の背景色の縞を前ページから続ける）
+        """
+        header_font_size = 16
+        data_font_size = 14
         
         # テーブルの列幅を設定（mm単位）- A4幅（210mm）に収まるように調整
         # 左右マージン10mmずつ = 20mm、テーブル幅は190mm以内に収める
         col_widths = [42 * mm, 52 * mm, 30 * mm, 30 * mm, 36 * mm]  # 合計190mm
-        # 行の高さを調整（A4一枚に確実に収まるように）
-        row_height = 15 * mm
+        row_colors = [white, HexColor('#F0F0F0')]
+        if odd_start:
+            row_colors.reverse()
         
         # Tableオブジェクトを作成
-        table = Table(table_data, colWidths=col_widths, repeatRows=1)
+        table = Table(table_data, colWidths=col_widths, rowHeights=row_heights, repeatRows=1)
         
         # TableStyleを設定（視認性を最大化）
         table_style = TableStyle([
@@ -294,7 +1026,7 @@ class LabelPDFGenerator:
             ('FONTSIZE', (0, 1), (-1, -1), data_font_size),
             ('ALIGN', (0, 1), (-1, -1), 'LEFT'),
             ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, HexColor('#F0F0F0')]),  # 1行おきに色を変える（白と薄い灰色、コントラスト向上）
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), row_colors),  # 1行おきに色を変える（白と薄い灰色、コントラスト向上）
             
             # 行の高さとパディング（A4一枚に確実に収まるように最適化）
             ('LEFTPADDING', (0, 0), (-1, -1), 4),
@@ -304,77 +1036,7 @@ class LabelPDFGenerator:
         ])
         
         table.setStyle(table_style)
-        
-        # テーブルのサイズを計算
-        table_width, table_height = table.wrap(0, 0)
-        
-        # テーブルを描画する位置を計算（左右マージン10mm）
-        table_x = 10 * mm
-        table_y = self.A4_HEIGHT - 48 * mm
-        
-        # テーブルを描画
-        table.drawOn(c, table_x, table_y - table_height)
-        
-        # 品目ごとの総数セクション用のY座標を更新
-        current_y = table_y - table_height - 10 * mm
-        
-        # 品目ごとの総数セクションを追加
-        # テーブルの下に余白を確保（A4一枚に収まるように調整）
-        summary_start_y = current_y - 8 * mm
-        
-        # 品目ごとに集計
-        from collections import defaultdict
-        item_totals = defaultdict(int)
-        item_units = {}
-        
-        for entry in summary_data:
-            item = entry.get('item', '')
-            spec = entry.get('spec', '').strip()
-            total_quantity = entry.get('total_quantity', 0)
-            unit_label = entry.get('unit_label', '')
-            
-            # キーをitemとspecの組み合わせにする（胡瓜の3本Pとバラを別物として扱う）
-            key = (item, spec)
-            item_totals[key] += total_quantity
-            item_units[key] = unit_label
-        
-        # 品目ごとの総数セクションのタイトル
-        c.setFont(font_name, summary_title_font_size)
-        summary_title = f"【{shipment_date} 出荷・作成総数】"
-        c.drawString(10 * mm, summary_start_y, summary_title)
-        
-        # 品目ごとの総数を2列で表示（左半分・右半分に分割）
-        summary_y_base = summary_start_y - 14 * mm
-        row_height = 13 * mm  # 1行あたりの高さ
-        left_x = 10 * mm
-        right_x = self.A4_WIDTH / 2 + 12 * mm  # 右列は用紙中央 + 余白
-        
-        c.setFont(font_name, summary_data_font_size)
-        
-        # キーをソート（品目名→規格の順）
-        sorted_items = sorted(item_totals.items(), key=lambda x: (x[0][0], x[0][1]))
-        n = len(sorted_items)
-        mid = (n + 1) // 2  # 左列に1つ多くする場合: 0〜mid-1 が左、mid〜n-1 が右
-        left_items = sorted_items[:mid]
-        right_items = sorted_items[mid:]
-        
-        # 左列を描画（品目表示名＝品目+荷姿で統一）
-        left_y = summary_y_base
-        for (item, spec), total in left_items:
-            unit_label = item_units.get((item, spec), '')
-            display_name = f"{item} {spec}".strip() if spec else item
-            summary_text = f"・{display_name}：{total}{unit_label}"
-            c.drawString(left_x, left_y, summary_text)
-            left_y -= row_height
-        
-        # 右列を描画
-        right_y = summary_y_base
-        for (item, spec), total in right_items:
-            unit_label = item_units.get((item, spec), '')
-            display_name = f"{item} {spec}".strip() if spec else item
-            summary_text = f"・{display_name}：{total}{unit_label}"
-            c.drawString(right_x, right_y, summary_text)
-            right_y -= row_height
+        return table
     
     def _draw_text_in_quadrant(self, c: canvas.Canvas, text: str, font_name: str, 
                                max_font_size: int, quadrant_width: float, 
@@ -385,58 +1047,122 @@ class LabelPDFGenerator:
         Returns:
             (font_size, text_width, text_height) のタプル
         """
-        font_size = max_font_size
-        text_width = c.stringWidth(text, font_name, font_size)
-        text_height = font_size * 0.7  # フォント高さの概算
+        return fit_text(text, font_name, max_font_size, quadrant_width, quadrant_height)
+    
+    def _draw_form(self, c: canvas.Canvas, name: str, x: float, y: float, draw,
+                   stroke_alpha: float = None, fill_alpha: float = None):
+        """
+        ラベル共通の静的な図形をForm XObjectとして1回だけ定義し、(x, y) に配置する
+        （枠線・ウォーターマーク等を毎ラベル描き直さず、PDF内で使い回す）
+        
+        ReportLabはフォーム内の透明度（ExtGState）をリソースに出力しないため、
+        透明度はフォームの外で設定する（フォームは呼び出し側の描画状態を引き継ぐ）
         
-        # 領域内に収まるまでフォントサイズを縮小
-        while (text_width > quadrant_width * 0.9 or 
-               text_height > quadrant_height * 0.9) and font_size > 8:
-            font_size -= 1
-            text_width = c.stringWidth(text, font_name, font_size)
-            text_height = font_size * 0.7
+        Args:
+            name: フォーム名（キャンバス内で一意）
+            draw: ラベル左下を原点として図形を描く関数 draw(c)（透明度は設定しない）
+            stroke_alpha: 線の透明度
+            fill_alpha: 塗りの透明度
+        """
+        if not c.hasForm(name):
+            margin = self.FORM_MARGIN + max(self.layout.gutter_x, self.layout.gutter_y) / 2
+            c.beginForm(name, -margin, -margin,
+                        self.label_width + margin, self.label_height + margin)
+            draw(c)
+            c.endForm()
+        c.saveState()
+        if stroke_alpha is not None:
+            c.setStrokeAlpha(stroke_alpha)
+        if fill_alpha is not None:
+            c.setFillAlpha(fill_alpha)
+        c.translate(x, y)
+        c.doForm(name)
+        c.restoreState()
+    
+    def _draw_label_frame(self, c: canvas.Canvas):
+        """通常ラベルの枠（薄い線、透明度0.3で配置）"""
+        c.setStrokeColor(gray)
+        c.setLineWidth(0.5)
+        c.rect(0, 0, self.label_width, self.label_height, stroke=1, fill=0)
+    
+    def _draw_fraction_watermark(self, c: canvas.Canvas, font_name: str):
+        """端数ラベルの「！」ウォーターマーク（透明度0.08で配置）"""
+        c.setFillColor(gray)
+        mark_size = self._font_size(120)  # 大きなフォントサイズ
+        c.setFont(font_name, mark_size)
+        exclamation_width = c.stringWidth('！', font_name, mark_size)
+        exclamation_x = (self.label_width - exclamation_width) / 2
+        exclamation_y = (self.label_height - mark_size * 0.7) / 2
+        c.drawString(exclamation_x, exclamation_y, '！')
+    
+    def _draw_fraction_border(self, c: canvas.Canvas):
+        """端数ラベルの太い破線枠と二重線"""
+        # 太い黒の破線枠（端数ラベル）
+        c.setStrokeColor(black)
+        c.setLineWidth(4)  # 太めの破線
+        c.setDash([12, 6])  # 破線パターン（長めの破線）
+        c.rect(3, 3, self.label_width - 6, self.label_height - 6, 
+              stroke=1, fill=0)
+        c.setDash()  # 破線をリセット
         
-        return font_size, text_width, text_height
+        # 下部に太い二重線を描画
+        c.setStrokeColor(black)
+        c.setLineWidth(2)
+        line_y = self.label_height / 2  # 中央の横線
+        c.line(5, line_y, self.label_width - 5, line_y)
+        c.setLineWidth(1.5)
+        c.line(5, line_y - 1, self.label_width - 5, line_y - 1)
+    
+    def _draw_guide_line(self, c: canvas.Canvas, vertical: bool):
+        """切断用ガイド線（極めて薄いグレー、間隔の広い破線。透明度0.15で配置）"""
+        c.setStrokeColor(gray)
+        c.setLineWidth(0.3)
+        c.setDash([20, 10])  # 間隔の広い破線
+        # ラベル間に隙間があるレイアウトでは、隙間の中央を切断線にする
+        if vertical:
+            line_x = self.label_width + self.layout.gutter_x / 2
+            c.line(line_x, 0, line_x, self.label_height)
+        else:
+            line_y = -self.layout.gutter_y / 2
+            c.line(0, line_y, self.label_width, line_y)
     
     def _draw_standard_label(self, c: canvas.Canvas, x: float, y: float, 
                             label: Dict, font_name: str):
         """通常ラベルを描画（4つの領域に厳格に分割）"""
         # ラベル枠（薄い線）
-        c.setStrokeColor(gray, alpha=0.3)
-        c.setLineWidth(0.5)
-        c.rect(x, y, self.LABEL_WIDTH, self.LABEL_HEIGHT, stroke=1, fill=0)
+        self._draw_form(c, 'LabelFrame', x, y, self._draw_label_frame, stroke_alpha=0.3)
         
         # テキスト色を黒に
         c.setFillColor(black)
         
         # 4つの領域のサイズ
-        q_width = self.LABEL_WIDTH / 2  # 52.5mm
-        q_height = self.LABEL_HEIGHT / 2  # 37.125mm
+        q_width = self.label_width / 2  # 52.5mm
+        q_height = self.label_height / 2  # 37.125mm
         
         # Q1: 左上 - 目的地（店舗名）を最大サイズ（中央寄せ）
         store = label.get('store', '')
         font_size, text_width, text_height = self._draw_text_in_quadrant(
-            c, store, font_name, 50, q_width, q_height
+            c, store, font_name, self._font_size(50), q_width, q_height
         )
         c.setFont(font_name, font_size)
         q1_center_x = x + q_width / 2  # Q1の中央X座標
-        q1_center_y = y + self.LABEL_HEIGHT - q_height / 2  # Q1の中央Y座標
+        q1_center_y = y + self.label_height - q_height / 2  # Q1の中央Y座標
         c.drawString(q1_center_x - text_width / 2, q1_center_y - text_height / 2, store)
         
         # Q2: 右上 - コンテナ数（通し番号）（中央寄せ）
         sequence = label.get('sequence', '')
         font_size, text_width, text_height = self._draw_text_in_quadrant(
-            c, sequence, font_name, 40, q_width, q_height
+            c, sequence, font_name, self._font_size(40), q_width, q_height
         )
         c.setFont(font_name, font_size)
-        q2_center_x = x + self.LABEL_WIDTH - q_width / 2  # Q2の中央X座標
-        q2_center_y = y + self.LABEL_HEIGHT - q_height / 2  # Q2の中央Y座標
+        q2_center_x = x + self.label_width - q_width / 2  # Q2の中央X座標
+        q2_center_y = y + self.label_height - q_height / 2  # Q2の中央Y座標
         c.drawString(q2_center_x - text_width / 2, q2_center_y - text_height / 2, sequence)
         
         # Q3: 左下 - 品目（中央寄せ）
         item = label.get('item', '')
         font_size, text_width, text_height = self._draw_text_in_quadrant(
-            c, item, font_name, 50, q_width, q_height
+            c, item, font_name, self._font_size(50), q_width, q_height
         )
         c.setFont(font_name, font_size)
         q3_center_x = x + q_width / 2  # Q3の中央X座標
@@ -446,75 +1172,57 @@ class LabelPDFGenerator:
         # Q4: 右下 - 入り数（中央寄せ）
         quantity = label.get('quantity', '')
         font_size, text_width, text_height = self._draw_text_in_quadrant(
-            c, quantity, font_name, 30, q_width, q_height
+            c, quantity, font_name, self._font_size(30), q_width, q_height
         )
         c.setFont(font_name, font_size)
-        q4_center_x = x + self.LABEL_WIDTH - q_width / 2  # Q4の中央X座標
+        q4_center_x = x + self.label_width - q_width / 2  # Q4の中央X座標
         q4_center_y = y + q_height / 2  # Q4の中央Y座標
         c.drawString(q4_center_x - text_width / 2, q4_center_y - text_height / 2, quantity)
         
         # 出荷日（ラベル水平中央、大きめの文字）
         shipment_date = label.get('shipment_date', '')
         if shipment_date:
-            center_x = x + self.LABEL_WIDTH / 2
-            date_y = y + 12  # 下端から12pt上
-            c.setFont(font_name, 16)
+            center_x = x + self.label_width / 2
+            date_y = y + 12 * self.layout.scale  # 下端から12pt上
+            c.setFont(font_name, self._font_size(16))
             c.drawCentredString(center_x, date_y, shipment_date)
     
     def _draw_fraction_label(self, c: canvas.Canvas, x: float, y: float, 
                             label: Dict, font_name: str):
         """端数ラベル（最後の1箱）を描画（4つの領域、Q4に超巨大フォント、下部に二重線、！ウォーターマーク）"""
         # 「！」ウォーターマークを背景に描画（とても薄い灰色）
-        c.saveState()
-        c.setFillColor(gray, alpha=0.08)  # 非常に薄い灰色
-        c.setFont(font_name, 120)  # 大きなフォントサイズ
-        exclamation_width = c.stringWidth('！', font_name, 120)
-        exclamation_x = x + (self.LABEL_WIDTH - exclamation_width) / 2
-        exclamation_y = y + (self.LABEL_HEIGHT - 120 * 0.7) / 2
-        c.drawString(exclamation_x, exclamation_y, '！')
-        c.restoreState()
-        
-        # 太い黒の破線枠（端数ラベル）
-        c.setStrokeColor(black)
-        c.setLineWidth(4)  # 太めの破線
-        c.setDash([12, 6])  # 破線パターン（長めの破線）
-        c.rect(x + 3, y + 3, self.LABEL_WIDTH - 6, self.LABEL_HEIGHT - 6, 
-              stroke=1, fill=0)
-        c.setDash()  # 破線をリセット
+        self._draw_form(c, f'FractionMark-{font_name}', x, y,
+                        lambda form: self._draw_fraction_watermark(form, font_name),
+                        fill_alpha=0.08)
         
-        # 下部に太い二重線を描画
-        c.setStrokeColor(black)
-        c.setLineWidth(2)
-        line_y = y + self.LABEL_HEIGHT / 2  # 中央の横線
-        c.line(x + 5, line_y, x + self.LABEL_WIDTH - 5, line_y)
-        c.setLineWidth(1.5)
-        c.line(x + 5, line_y - 1, x + self.LABEL_WIDTH - 5, line_y - 1)
+        # 太い黒の破線枠と下部の二重線
+        self._draw_form(c, 'FractionBorder', x, y, self._draw_fraction_border)
         
         # テキスト色を黒に
         c.setFillColor(black)
         
         # 4つの領域のサイズ
-        q_width = self.LABEL_WIDTH / 2  # 52.5mm
-        q_height = self.LABEL_HEIGHT / 2  # 37.125mm
+        q_width = self.label_width / 2  # 52.5mm
+        q_height = self.label_height / 2  # 37.125mm
         
         # Q1: 左上 - 目的地（店舗名）を最大サイズ（中央寄せ）
         store = label.get('store', '')
         font_size, text_width, text_height = self._draw_text_in_quadrant(
-            c, store, font_name, 50, q_width, q_height
+            c, store, font_name, self._font_size(50), q_width, q_height
         )
         c.setFont(font_name, font_size)
         q1_center_x = x + q_width / 2  # Q1の中央X座標
-        q1_center_y = y + self.LABEL_HEIGHT - q_height / 2  # Q1の中央Y座標
+        q1_center_y = y + self.label_height - q_height / 2  # Q1の中央Y座標
         c.drawString(q1_center_x - text_width / 2, q1_center_y - text_height / 2, store)
         
         # Q2: 右上 - コンテナ数（通し番号）（中央寄せ）
         sequence = label.get('sequence', '')
         font_size, text_width, text_height = self._draw_text_in_quadrant(
-            c, sequence, font_name, 40, q_width, q_height
+            c, sequence, font_name, self._font_size(40), q_width, q_height
         )
         c.setFont(font_name, font_size)
-        q2_center_x = x + self.LABEL_WIDTH - q_width / 2  # Q2の中央X座標
-        q2_center_y = y + self.LABEL_HEIGHT - q_height / 2  # Q2の中央Y座標
+        q2_center_x = x + self.label_width - q_width / 2  # Q2の中央X座標
+        q2_center_y = y + self.label_height - q_height / 2  # Q2の中央Y座標
         c.drawString(q2_center_x - text_width / 2, q2_center_y - text_height / 2, sequence)
         
         # Q3: 左下 - 品目（Q4と重ならないように幅を制限、中央寄せ）
@@ -522,7 +1230,7 @@ class LabelPDFGenerator:
         # Q4が超巨大フォントになるため、Q3の幅を制限（Q4のスペースを確保）
         q3_max_width = q_width * 0.8  # Q3の最大幅を80%に制限
         font_size, text_width, text_height = self._draw_text_in_quadrant(
-            c, item, font_name, 50, q3_max_width, q_height
+            c, item, font_name, self._font_size(50), q3_max_width, q_height
         )
         c.setFont(font_name, font_size)
         q3_center_x = x + q3_max_width / 2  # Q3の中央X座標（制限された幅内）
@@ -532,10 +1240,10 @@ class LabelPDFGenerator:
         # Q4: 右下 - 数量を超巨大フォント（Q3と重ならないように、中央寄せ）
         quantity = label.get('quantity', '')
         # Q4を大幅に拡張（Q3の右側のスペースも使用）
-        q4_extended_width = self.LABEL_WIDTH - q3_max_width - 10  # Q3の右側まで使用
+        q4_extended_width = self.label_width - q3_max_width - 10  # Q3の右側まで使用
         q4_extended_height = q_height
         font_size, text_width, text_height = self._draw_text_in_quadrant(
-            c, quantity, font_name, 60, q4_extended_width, q4_extended_height
+            c, quantity, font_name, self._font_size(60), q4_extended_width, q4_extended_height
         )
         c.setFont(font_name, font_size)
         q4_center_x = x + q3_max_width + 10 + q4_extended_width / 2  # Q4の中央X座標（拡張領域内）
@@ -545,26 +1253,47 @@ class LabelPDFGenerator:
         # 出荷日（ラベル最下段・水平中央、太字で視認性最大化）
         shipment_date = label.get('shipment_date', '')
         if shipment_date:
-            center_x = x + self.LABEL_WIDTH / 2
-            date_y = y + 5 * mm  # ラベル下端から5mm上にどっしり配置
+            center_x = x + self.label_width / 2
+            date_y = y + 5 * mm * self.layout.scale  # ラベル下端から5mm上にどっしり配置
             date_font = self._get_font_name_bold()
-            c.setFont(date_font, 22)  # ラベルに合わせて拡大
+            c.setFont(date_font, self._font_size(22))  # ラベルに合わせて拡大
             c.drawCentredString(center_x, date_y, shipment_date)
     
     def _draw_guide_lines(self, c: canvas.Canvas, x: float, y: float, 
                          col: int, row: int, label_idx: int, total_labels: int, is_last_label: bool = False):
         """切断用ガイド線を描画（極めて薄いグレー、間隔の広い破線）"""
-        c.setStrokeColor(gray, alpha=0.15)  # 極めて薄いグレー
-        c.setLineWidth(0.3)
-        c.setDash([20, 10])  # 間隔の広い破線
-        
         # 右側の縦線（左列で、最後のラベルでない場合）
-        if col == 0 and not is_last_label:
-            c.line(x + self.LABEL_WIDTH, y, 
-                  x + self.LABEL_WIDTH, y + self.LABEL_HEIGHT)
+        if col < self.layout.columns - 1 and not is_last_label:
+            self._draw_form(c, 'GuideLineV', x, y,
+                            lambda form: self._draw_guide_line(form, vertical=True),
+                            stroke_alpha=0.15)
         
         # 下側の横線（最下段でない場合）
-        if row < 3:
-            c.line(x, y, x + self.LABEL_WIDTH, y)
-        
-        c.setDash()  # 破線をリセット
+        if row < self.layout.rows - 1:
+            self._draw_form(c, 'GuideLineH', x, y,
+                            lambda form: self._draw_guide_line(form, vertical=False),
+                            stroke_alpha=0.15)
+
+
+def _render_pdf_chunk(job: tuple) -> bytes:
+    """
+    並列描画用: 連続したラベルページ（と先頭チャンクなら出荷一覧表）を1つのPDFとして描画
+    （プロセスプールから呼ぶためモジュールレベルに置く）
+    """
+    font_path, layout, summary_data, shipment_date, chunk_labels, chunk_pages, total_labels = job
+    generator = LabelPDFGenerator(font_path, layout)
+    font_name = generator._get_font_name()
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(generator.page_width, generator.page_height))
+    if summary_data is not None:
+        generator._draw_summary_page(c, summary_data, generator._format_shipment_date(shipment_date), font_name)
+        c.showPage()
+    generator._draw_label_pages(c, chunk_labels, total_labels, chunk_pages, font_name)
+    c.save()
+    return buffer.getvalue()
+
+
+def _render_store_pdf(job: tuple) -> bytes:
+    """店舗別PDFの並列生成用: 1店舗分のPDFを描画（プロセスプールから呼ぶためモジュールレベルに置く）"""
+    font_path, layout, labels, summary_data, shipment_date = job
+    return LabelPDFGenerator(font_path, layout).render_bytes(labels, summary_data, shipment_date)